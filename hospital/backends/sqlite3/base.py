@@ -0,0 +1,43 @@
+"""
+SQLite backend that applies per-connection PRAGMAs.
+
+Accepts two extra ``OPTIONS``:
+
+* ``pragmas``: a mapping such as ``{'journal_mode': 'WAL', 'busy_timeout': 5000}``
+  executed on every new connection.
+* ``transaction_mode``: ``'IMMEDIATE'`` takes the write lock when a transaction
+  starts, so writers wait for ``busy_timeout`` instead of failing on lock upgrade.
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        options = self.settings_dict['OPTIONS']
+        pragmas = options.get('pragmas', {})
+        mode = options.get('transaction_mode')
+        if mode and mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"Unknown SQLite transaction_mode {mode!r}.")
+        self.pragmas = pragmas
+        self.begin = f'BEGIN {mode.upper()}' if mode else 'BEGIN'
+        self.settings_dict = {
+            **self.settings_dict,
+            'OPTIONS': {key: value for key, value in options.items() if key not in ('pragmas', 'transaction_mode')},
+        }
+        try:
+            return super().get_connection_params()
+        finally:
+            self.settings_dict = {**self.settings_dict, 'OPTIONS': options}
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(self.begin)
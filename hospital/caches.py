@@ -0,0 +1,34 @@
+"""
+Cache settings chosen from the environment.
+
+``CACHE_BACKEND`` is ``locmem`` (the default, per process), ``file`` (shared by
+the processes of one host, stored in ``CACHE_LOCATION`` or ``BASE_DIR/cache``)
+or ``redis`` (``CACHE_LOCATION`` defaults to ``redis://127.0.0.1:6379/0``; any
+Redis-compatible server such as Valkey or KeyDB will do).
+"""
+
+BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'dummy': 'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def cache_settings(base_dir, env):
+    backend = env.get('CACHE_BACKEND', 'locmem')
+    if backend not in BACKENDS:
+        raise ValueError(f'Unsupported CACHE_BACKEND {backend!r}.')
+    config = {
+        'BACKEND': BACKENDS[backend],
+        'KEY_PREFIX': env.get('CACHE_KEY_PREFIX', 'hospital'),
+        'TIMEOUT': int(env.get('CACHE_TIMEOUT', 60 * 60 * 24)),
+    }
+    if backend == 'file':
+        config['LOCATION'] = env.get('CACHE_LOCATION') or str(base_dir / 'cache')
+    elif backend == 'redis':
+        config['LOCATION'] = env.get('CACHE_LOCATION') or 'redis://127.0.0.1:6379/0'
+    elif backend == 'locmem':
+        config['LOCATION'] = 'hospital'
+        config['OPTIONS'] = {'MAX_ENTRIES': int(env.get('CACHE_MAX_ENTRIES', 10000))}
+    return config
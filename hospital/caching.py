@@ -0,0 +1,147 @@
+"""
+Versioned cache keys and hit/miss metrics.
+
+Cached values are stored under keys that embed the current version of every
+scope they depend on, e.g. a patient or a ward. Bumping a scope's version makes
+all of its entries unreachable at once; they simply expire. Versions start from
+the clock, so a version evicted from the cache never comes back at an old value.
+"""
+
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from .routers import current_read_alias
+
+DEFAULT_TIMEOUT = object()
+
+WARDS = ('wards', '*')
+OCCUPANCY = ('wards', 'occupancy')
+USERS = ('users', '*')
+
+_lock = threading.Lock()
+_totals = Counter()
+_request_counts = ContextVar('cache_request_counts', default=None)
+
+
+def patient(pk):
+    return ('patient', pk)
+
+
+def ward(floor):
+    return ('ward', floor)
+
+
+def user(pk):
+    return ('user', pk)
+
+
+def version_key(scope):
+    return 'version:%s:%s' % scope
+
+
+def versions(scopes):
+    keys = [version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in found}
+    if missing:
+        for key, value in missing.items():
+            if cache.add(key, value, None):
+                found[key] = value
+            else:
+                found[key] = cache.get(key, value)
+    return [found[key] for key in keys]
+
+
+def make_key(name, scopes):
+    return ':'.join([name, *(f'{kind}{ident}.{version}' for (kind, ident), version in zip(scopes, versions(scopes)))])
+
+
+def bump(*scopes):
+    """Invalidate everything cached under any of ``scopes``.
+
+    Inside a transaction the scopes are bumped again on commit: until then other
+    connections still read the old rows, and may cache them under the new version.
+    """
+    increment(scopes)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: increment(scopes))
+
+
+def increment(scopes):
+    for scope in scopes:
+        key = version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def replica_timeout(timeout=DEFAULT_TIMEOUT):
+    """``timeout``, or ``REPLICA_PIN_SECONDS`` when the current request reads from a replica.
+
+    A replica may lag behind the invalidation signals, so a value computed from
+    it must not outlive the lag under a version that is already current.
+    """
+    if current_read_alias() != DEFAULT_DB_ALIAS:
+        return settings.REPLICA_PIN_SECONDS
+    return timeout
+
+
+def record(name, hit):
+    outcome = 'hits' if hit else 'misses'
+    with _lock:
+        _totals[name, outcome] += 1
+    counts = _request_counts.get()
+    if counts is not None:
+        counts[outcome] += 1
+
+
+def get(name, scopes, compute, timeout=DEFAULT_TIMEOUT):
+    """The value of ``compute()`` cached as ``name`` for the current versions of ``scopes``.
+
+    ``timeout`` may be a callable, evaluated after a miss has been computed.
+    """
+    key = make_key(name, scopes)
+    value = cache.get(key)
+    record(name, value is not None)
+    if value is None:
+        value = compute()
+        if callable(timeout):
+            timeout = timeout()
+        if timeout is DEFAULT_TIMEOUT:
+            cache.set(key, value)
+        else:
+            cache.set(key, value, timeout)
+    return value
+
+
+def stats():
+    """Hits and misses since the process started, per cached name."""
+    with _lock:
+        totals = dict(_totals)
+    names = sorted({name for name, _ in totals})
+    result = {}
+    for name in names:
+        hits, misses = totals.get((name, 'hits'), 0), totals.get((name, 'misses'), 0)
+        result[name] = {'hits': hits, 'misses': misses, 'ratio': hits / (hits + misses)}
+    return result
+
+
+def reset_stats():
+    with _lock:
+        _totals.clear()
+
+
+def track_request():
+    """Start counting the current request's hits and misses; returns the counter and a reset token."""
+    counts = Counter()
+    return counts, _request_counts.set(counts)
+
+
+def untrack_request(token):
+    _request_counts.reset(token)
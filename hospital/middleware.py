@@ -0,0 +1,149 @@
+"""
+Per-request SQL and timing instrumentation.
+
+Every request counts its queries, SQL time and cache hits and misses, and flags
+SQL statements repeated ``REQUEST_DUPLICATE_QUERY_THRESHOLD`` times or more
+(typically an N+1 loop). The numbers go out in a ``Server-Timing`` header.
+Requests slower than ``REQUEST_SLOW_MS`` are logged to ``hospital.requests`` as JSON. A
+``REQUEST_TRACE_SAMPLE_RATE`` share of requests also logs every statement it ran.
+"""
+
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from . import caching
+
+logger = logging.getLogger('hospital.requests')
+
+_recorder = ContextVar('query_recorder', default=None)
+
+
+class QueryRecorder:
+    def __init__(self, trace):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        self.trace = [] if trace else None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            self.statements[sql] += 1
+            if self.trace is not None:
+                self.trace.append({
+                    'alias': context['connection'].alias,
+                    'sql': sql,
+                    'params': repr(params)[:500],
+                    'ms': round(elapsed * 1000, 3),
+                })
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper that hands the query to the current request's recorder.
+
+    Looking the recorder up in a context variable keeps queries another thread
+    runs on a shared connection (the live test server's) out of this request.
+    """
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install(connection, **kwargs):
+    # At the front, so execute_wrapper() blocks popping their own wrapper leave it alone.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+connection_created.connect(install)
+
+
+class RequestTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'REQUEST_SLOW_MS', 500)
+        self.sample_rate = getattr(settings, 'REQUEST_TRACE_SAMPLE_RATE', 0.01)
+        self.duplicate_threshold = getattr(settings, 'REQUEST_DUPLICATE_QUERY_THRESHOLD', 5)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            self.stop(state)
+        return self.finish(request, response, state)
+
+    async def __acall__(self, request):
+        state = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.stop(state)
+        return self.finish(request, response, state)
+
+    def start(self):
+        for connection in connections.all():
+            install(connection)
+        recorder = QueryRecorder(trace=random.random() < self.sample_rate)
+        cache_counts, cache_token = caching.track_request()
+        return recorder, _recorder.set(recorder), cache_counts, cache_token, time.perf_counter()
+
+    def stop(self, state):
+        _, recorder_token, _, cache_token, _ = state
+        caching.untrack_request(cache_token)
+        _recorder.reset(recorder_token)
+
+    def finish(self, request, response, state):
+        recorder, _, cache_counts, _, started = state
+        total_ms = (time.perf_counter() - started) * 1000
+        db_ms = recorder.duration * 1000
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={db_ms:.1f};desc="{recorder.count} queries"',
+            f'cache;desc="{cache_counts["hits"]} hits, {cache_counts["misses"]} misses"',
+            f'app;dur={total_ms - db_ms:.1f}',
+            f'total;dur={total_ms:.1f}',
+        ])
+
+        duplicates = {sql: count for sql, count in recorder.statements.items() if count >= self.duplicate_threshold}
+        if total_ms >= self.slow_ms or duplicates or recorder.trace is not None:
+            record = {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'user': getattr(getattr(request, 'user', None), 'pk', None),
+                'total_ms': round(total_ms, 1),
+                'db_ms': round(db_ms, 1),
+                'queries': recorder.count,
+                'cache': {'hits': cache_counts['hits'], 'misses': cache_counts['misses']},
+                'duplicates': [{'sql': sql, 'count': count} for sql, count in
+                               sorted(duplicates.items(), key=lambda item: -item[1])],
+            }
+            if recorder.trace is not None:
+                record['trace'] = recorder.trace
+            level = logging.WARNING if total_ms >= self.slow_ms or duplicates else logging.INFO
+            logger.log(level, json.dumps(record), extra={'request_stats': record})
+        return response
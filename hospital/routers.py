@@ -0,0 +1,131 @@
+"""
+Read-replica routing.
+
+Reads go to the primary unless a view opts in with ``replica_reads``. Inside
+such a view they go to ``settings.REPLICA_DATABASE``, except when the user
+wrote something within the last ``REPLICA_PIN_SECONDS`` (read-your-writes) or
+the current request has already written.
+"""
+
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+SESSION_KEY = '_db_written_at'
+
+_read_alias = ContextVar('read_alias', default=None)
+_has_written = ContextVar('has_written', default=False)
+
+
+def replica_alias(request=None):
+    """The alias read-only traffic of ``request`` may use."""
+    replica = getattr(settings, 'REPLICA_DATABASE', None)
+    if not replica:
+        return DEFAULT_DB_ALIAS
+    session = getattr(request, 'session', None)
+    if session is not None:
+        written_at = session.get(SESSION_KEY)
+        if written_at and time.time() - written_at < getattr(settings, 'REPLICA_PIN_SECONDS', 60):
+            return DEFAULT_DB_ALIAS
+    return replica
+
+
+def current_read_alias():
+    return _read_alias.get() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def reading_from_replica(request=None):
+    """Route reads in the block to the replica until the block itself writes."""
+    alias = replica_alias(request)
+    written = _has_written.set(False)
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+        _has_written.reset(written)
+
+
+def replica_reads(view):
+    """Send the ORM reads made while ``view`` runs to the replica when it is safe to."""
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            await sync_to_async(getattr)(getattr(request, 'user', None), 'pk', None)
+            with reading_from_replica(request):
+                return await view(request, *args, **kwargs)
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        # Resolve the user from the primary; a snapshot may not know a new account yet.
+        getattr(getattr(request, 'user', None), 'pk', None)
+        with reading_from_replica(request):
+            return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias and not _has_written.get():
+            return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _has_written.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinningMiddleware:
+    """Remember when a user last wrote, so their next reads stay on the primary."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = _has_written.set(False)
+        try:
+            response = self.get_response(request)
+            if self.wrote(request, response):
+                request.session[SESSION_KEY] = time.time()
+            return response
+        finally:
+            _has_written.reset(token)
+
+    async def __acall__(self, request):
+        token = _has_written.set(False)
+        try:
+            response = await self.get_response(request)
+            if self.wrote(request, response):
+                await sync_to_async(request.session.__setitem__)(SESSION_KEY, time.time())
+            return response
+        finally:
+            _has_written.reset(token)
+
+    def wrote(self, request, response):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 \
+            and getattr(request, 'session', None) is not None and getattr(settings, 'REPLICA_DATABASE', None)
+
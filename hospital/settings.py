@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from .caches import cache_settings
+from .database import database_settings, replica_settings
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -41,11 +45,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'hospital.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'hospital.routers.ReplicaPinningMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -73,12 +79,55 @@ WSGI_APPLICATION = 'hospital.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
+# Set HOSPITAL_DB_PROFILE=production for WAL, busy timeouts and persistent
+# connections, or DATABASE_URL to use another database (see hospital/database.py).
 
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_settings(BASE_DIR, os.environ),
+}
+
+# Invoices, exports and other report-style reads go to a replica when
+# REPLICA_DATABASE_URL is set; users stay on the primary for
+# REPLICA_PIN_SECONDS after they write (see hospital/routers.py).
+REPLICA = replica_settings(os.environ)
+if REPLICA:
+    DATABASES['replica'] = REPLICA
+    REPLICA_DATABASE = 'replica'
+
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 60))
+
+DATABASE_ROUTERS = ['hospital.routers.ReplicaRouter']
+
+
+# Set CACHE_BACKEND to locmem, file or redis (see hospital/caches.py). Cached
+# invoices, ward occupancy and role lookups are invalidated by versioned keys
+# (see hospital/caching.py and manager/signals.py).
+
+CACHES = {
+    'default': cache_settings(BASE_DIR, os.environ),
+}
+
+
+# Request instrumentation (see hospital/middleware.py): every response gets a
+# Server-Timing header; slow requests, repeated queries and a sampled share of
+# full query traces are logged to hospital.requests.
+
+REQUEST_SLOW_MS = float(os.environ.get('REQUEST_SLOW_MS', 500))
+REQUEST_TRACE_SAMPLE_RATE = float(os.environ.get('REQUEST_TRACE_SAMPLE_RATE', 0.01))
+REQUEST_DUPLICATE_QUERY_THRESHOLD = int(os.environ.get('REQUEST_DUPLICATE_QUERY_THRESHOLD', 5))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'hospital.requests': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'WARNING'),
+        },
+    },
 }
 
 
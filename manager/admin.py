@@ -1,6 +1,16 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.exceptions import ValidationError
+from django.urls import reverse
 from django.utils.html import format_html
-from .models import Patient, Bed, Medicine, Payment
+from .models import (Patient, Bed, BedOccupancy, Medicine, Payment, ArchivedPatient, ArchivedPayment,
+                     ArchivedMedicine, ArchivedBedOccupancy)
+from . import search
+from .archive import restore_patient
+from .pagination import KeysetChangeList, KeysetPaginationMixin
+from .beds import allocate_bed
+from .exports import export_queryset
+from .views import export_response
+from .roles import DOCTORS, HIDDEN_PATIENT_FIELDS, MANAGERS, NURSES, ROLES, SUPERUSER, get_role, user_groups
 from datetime import datetime
 from django.utils.translation import gettext_lazy as _
 from django.forms import CheckboxInput
@@ -8,8 +18,17 @@ from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
 from django.conf import settings
 from pytz import timezone
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import F
+
+
+def export_action(kind, fmt):
+    @admin.action(description=f'Export selected as {fmt.upper()}', permissions=['view'])
+    def action(modeladmin, request, queryset):
+        selection = queryset.model.objects.filter(pk__in=queryset.values('pk'))
+        role = get_role(request)
+        return export_response(kind, export_queryset(kind, queryset=selection, role=role), fmt, role)
+
+    action.__name__ = f'export_{fmt}'
+    return action
 
 
 class MedicineInline(admin.TabularInline):
@@ -17,7 +36,7 @@ class MedicineInline(admin.TabularInline):
     extra = 0
 
     def has_add_permission(self, request, obj=None):
-        if obj and request.user != obj.doctor and not request.user.is_superuser:
+        if obj and obj.doctor_id != request.user.pk and not request.user.is_superuser:
             return False
         return super().has_add_permission(request, obj)
 
@@ -48,8 +67,33 @@ class BedInline(admin.TabularInline):
     extra = 0
 
 
-class PatientAdmin(admin.ModelAdmin):
+class HasDebtFilter(admin.SimpleListFilter):
+    title = _('Debt')
+    parameter_name = 'has_debt'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('1', _('With debt')),
+            ('0', _('Settled')),)
+
+    def queryset(self, request, queryset):
+        if self.value() == '1':
+            return queryset.filter(total_due__gt=0)
+        elif self.value() == '0':
+            return queryset.filter(total_due=0)
+        else:
+            return queryset
+
+
+class PatientChangeList(KeysetChangeList):
+    def get_queryset(self, request, *args, **kwargs):
+        return super().get_queryset(request, *args, **kwargs).defer('doctor_order', 'nurse_report')
+
+
+class PatientAdmin(KeysetPaginationMixin, admin.ModelAdmin):
     search_fields = ('first_name', "last_name")
+    ordering = ('-login_at',)
+    list_filter = (HasDebtFilter,)
     list_display = [
         '__str__',
         'sickness',
@@ -82,6 +126,111 @@ class PatientAdmin(admin.ModelAdmin):
         'doctor_order',
     ]
 
+    actions = ['discharge_patients', 'allocate_beds', export_action('patients', 'csv'),
+               export_action('patients', 'jsonl')]
+
+    readonly_fields = [
+        'first_name',
+        'last_name',
+        'insurance_type',
+        'doctor_order',
+        'nurse_report',
+        'watchful_name',
+        'age',
+        'sickness',
+        'blood_type',
+        'height',
+        'weight',
+        'doctor',
+        'nurse',
+        'is_hospitalized',
+        'discharge_date',
+    ]
+    role_hidden_list_display = {
+        DOCTORS: ['debt', 'paid', 'login_at', 'discharge_date'],
+        NURSES: ['debt', 'paid', 'login_at', 'discharge_date'],
+    }
+    role_hidden_fields = HIDDEN_PATIENT_FIELDS
+    role_editable_fields = {
+        SUPERUSER: readonly_fields,
+        DOCTORS: ['sickness', 'blood_type', 'height', 'weight', 'doctor_order'],
+        NURSES: ['sickness', 'blood_type', 'height', 'weight', 'nurse_report'],
+        MANAGERS: [
+            'first_name',
+            'last_name',
+            'insurance_type',
+            'watchful_name',
+            'age',
+            'doctor',
+            'nurse',
+            'is_hospitalized',
+            'discharge_date',
+        ],
+    }
+    # Doctors and nurses may only edit the patients assigned to them.
+    role_owner_fields = {
+        DOCTORS: 'doctor_id',
+        NURSES: 'nurse_id',
+    }
+
+    def __init__(self, model, admin_site):
+        super().__init__(model, admin_site)
+        self.role_list_display = {}
+        self.role_fields = {}
+        self.role_readonly_fields = {}
+        self.role_fieldsets = {}
+        self.role_forms = {}
+        for role in ROLES:
+            hidden = self.role_hidden_list_display.get(role, [])
+            self.role_list_display[role] = tuple(name for name in self.list_display if name not in hidden)
+            hidden = self.role_hidden_fields.get(role, [])
+            self.role_fields[role] = tuple(name for name in self.fields if name not in hidden)
+            self.role_fieldsets[role] = ((None, {'fields': self.role_fields[role]}),)
+            editable = self.role_editable_fields.get(role, [])
+            self.role_readonly_fields[role] = tuple(name for name in self.readonly_fields if name not in editable)
+
+    def get_changelist(self, request, **kwargs):
+        return PatientChangeList
+
+    @admin.action(description='Discharge selected patients', permissions=['discharge'])
+    def discharge_patients(self, request, queryset):
+        discharged, rejected = queryset.discharge()
+        for patient, outstanding in rejected.items():
+            self.message_user(
+                request,
+                _('%(patient)s (%(national_id)s) not discharged: outstanding balance $%(balance)s') % {
+                    'patient': patient, 'national_id': patient.national_id, 'balance': outstanding},
+                messages.WARNING,
+            )
+        if discharged:
+            self.message_user(request, _('%(count)d patient(s) discharged.') % {'count': len(discharged)})
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('bed', 'doctor', 'nurse')
+
+    @admin.action(description='Allocate free beds to selected patients', permissions=['discharge'])
+    def allocate_beds(self, request, queryset):
+        for patient in queryset.filter(is_hospitalized=True, bed__isnull=True):
+            bed = allocate_bed(patient)
+            if bed is None:
+                self.message_user(request, _('No free bed left for %(patient)s.') % {'patient': patient},
+                                  messages.WARNING)
+                break
+            self.message_user(request, _('%(patient)s assigned to bed %(bed)s.') % {'patient': patient, 'bed': bed})
+
+    def get_search_results(self, request, queryset, search_term):
+        # Don't let search reveal columns the role cannot see.
+        hidden = self.role_hidden_fields.get(get_role(request), ())
+        columns = [column for column in search.COLUMNS if column not in hidden]
+        matches = search.filter_queryset(queryset, search_term, columns)
+        if matches is not None:
+            queryset, may_have_duplicates = matches, False
+        else:
+            queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if request.GET.get('model_name') == 'bed' and request.GET.get('field_name') == 'patient':
+            queryset = queryset.filter(is_hospitalized=True, bed__isnull=True)
+        return queryset, may_have_duplicates
+
     def custom_login_at(self, obj):
         return obj.login_at.strftime('%y/%m/%d %H:%M')
 
@@ -105,84 +254,66 @@ class PatientAdmin(admin.ModelAdmin):
         return formfield
 
     def save_model(self, request, obj, form, change):
+        if not change and ArchivedPatient.objects.filter(national_id=obj.national_id).exists():
+            self.message_user(request, _('National ID %(national_id)s has an archived record; readmit it from the '
+                                         'archive to keep its history.') % {'national_id': obj.national_id},
+                              messages.WARNING)
         if change:
             if not obj.is_hospitalized:
-                try:
-                    obj.bed.delete()
-                except ObjectDoesNotExist:
-                    pass
                 obj.discharge_date = datetime.now(tz=timezone(settings.TIME_ZONE))
+                Patient.objects.filter(pk=obj.pk).release_beds(obj.discharge_date)
             elif obj.is_hospitalized:
                 obj.discharge_date = None
         super().save_model(request, obj, form, change)
 
+    def has_discharge_permission(self, request):
+        # Only the roles that may edit is_hospitalized on the form.
+        return 'is_hospitalized' in self.role_editable_fields.get(get_role(request), []) \
+            and super().has_change_permission(request)
+
     def has_change_permission(self, request, obj=None):
         if obj and not obj.is_hospitalized and not request.user.is_superuser:
             return False
         return super().has_change_permission(request, obj)
 
     def get_list_display(self, request, obj=None):
-        if request.user.groups.filter(name__in=['Doctors', 'Nurses']):
-            return [display for display in self.list_display
-                    if display not in ['debt', 'paid', 'login_at', 'discharge_date']]
-        else:
-            return self.list_display
+        return self.role_list_display[get_role(request)]
 
-    def get_fields(self, request, obj=None):
-        if request.user.groups.filter(name__in=['Doctors', 'Nurses']):
-            self.fields = [field for field in self.fields if field not in ['national_id', 'phone_number', 'address']]
+    def get_list_filter(self, request):
+        # The debt filter would tell roles that may not see the ledger who owes money.
+        if 'debt' in self.role_hidden_list_display.get(get_role(request), []):
+            return ()
+        return self.list_filter
 
-        return super(PatientAdmin, self).get_fields(request, obj)
+    def get_fields(self, request, obj=None):
+        return self.role_fields[get_role(request)]
+
+    def get_fieldsets(self, request, obj=None):
+        return self.role_fieldsets[get_role(request)]
+
+    def get_form(self, request, obj=None, change=False, **kwargs):
+        # The form only depends on the role, the field layout, which fields are
+        # read-only and whether the object may be changed at all (the doctor/nurse
+        # pickers are not wrapped with per-user admin links), so each variant is
+        # built once and shared by every request.
+        if set(kwargs) - {'fields'}:
+            return super().get_form(request, obj, change, **kwargs)
+        key = (get_role(request), change, tuple(kwargs.get('fields') or ()),
+               tuple(self.get_readonly_fields(request, obj)), change and self.has_change_permission(request, obj))
+        form = self.role_forms.get(key)
+        if form is None:
+            form = super().get_form(request, obj, change, **kwargs)
+            # The fields are built by now; the callback is bound to this request and would keep it alive.
+            form.Meta.formfield_callback = form._meta.formfield_callback = None
+            form = self.role_forms.setdefault(key, form)
+        return form
 
     def get_readonly_fields(self, request, obj=None):
-        readonly_fields = ['first_name',
-                           'last_name',
-                           'insurance_type',
-                           'doctor_order',
-                           'nurse_report',
-                           'watchful_name',
-                           'age',
-                           'sickness',
-                           'blood_type',
-                           'height',
-                           'weight',
-                           'doctor',
-                           'nurse',
-                           'is_hospitalized',
-                           'discharge_date',
-                           ]
-        if request.user.is_superuser:
-            return []
-        else:
-            user_groups = request.user.groups.values_list('name', flat=True)
-            if 'Doctors' in user_groups or 'Nurses' in user_groups:
-                readonly_fields.remove('sickness')
-                readonly_fields.remove('blood_type')
-                readonly_fields.remove('height')
-                readonly_fields.remove('weight')
-            if 'Doctors' in user_groups:
-                readonly_fields.remove('doctor_order')
-                if request.user != obj.doctor:
-                    readonly_fields = self.fields
-            elif 'Nurses' in user_groups:
-                readonly_fields.remove('nurse_report')
-                if request.user != obj.nurse:
-                    readonly_fields = self.fields
-            elif 'Managers' in user_groups:
-                readonly_fields = [
-                    field for field in readonly_fields
-                    if field not in [
-                        'first_name',
-                        'last_name',
-                        'insurance_type',
-                        'watchful_name',
-                        'age',
-                        'doctor',
-                        'nurse',
-                        'is_hospitalized',
-                        'discharge_date',
-                    ]]
-        return readonly_fields
+        role = get_role(request)
+        owner = self.role_owner_fields.get(role)
+        if owner and obj is not None and getattr(obj, owner) != request.user.pk:
+            return self.role_fields[role]
+        return self.role_readonly_fields[role]
 
     inlines = [
         MedicineInline,
@@ -191,19 +322,19 @@ class PatientAdmin(admin.ModelAdmin):
     ]
 
     def debt(self, obj):
-        unpaid_payments = obj.payment_set.filter(cost__gt=F('paid'))
-        total_amount = sum((payment.cost - payment.paid) for payment in unpaid_payments)
-        return format_html(f'<a href="/invoice/{obj.national_id}"><u style="color: red">${total_amount}</u></a>')
+        return format_html('<a href="/invoice/{}"><u style="color: red">${}</u></a>',
+                           obj.national_id, obj.total_due)
 
     debt.short_description = 'Debt'
+    debt.admin_order_field = 'total_due'
     debt.allow_tag = True
 
     def paid(self, obj):
-        paid_payments = obj.payment_set.all()
-        total_amount = sum(payment.paid for payment in paid_payments)
-        return format_html(f'<a href="/invoice/{obj.national_id}"><u style="color: green">${total_amount}</u></a>')
+        return format_html('<a href="/invoice/{}"><u style="color: green">${}</u></a>',
+                           obj.national_id, obj.total_paid)
 
     paid.short_description = 'Paid'
+    paid.admin_order_field = 'total_paid'
     paid.allow_tag = True
 
 
@@ -250,16 +381,106 @@ class BedAdmin(admin.ModelAdmin):
     is_filled_order.admin_order_field = 'is_filled_field'
 
     list_display = ('name', 'floor', 'room', 'bed', 'is_filled')
+    list_select_related = ('patient',)
     list_display_links = ('name', 'floor', 'room', 'bed', 'is_filled')
     list_filter = (IsFilledFilter,)
 
+    autocomplete_fields = ('patient',)
+
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == 'patient':
-            kwargs['queryset'] = Patient.objects.filter(bed__isnull=True)
+            kwargs['queryset'] = Patient.objects.filter(is_hospitalized=True)
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
-class PaymentAdmin(admin.ModelAdmin):
+class BedOccupancyAdmin(admin.ModelAdmin):
+    list_display = ('bed', 'patient', 'start', 'end')
+    list_select_related = ('bed', 'patient')
+    list_filter = ('bed__floor',)
+    date_hierarchy = 'start'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class ArchivedRowInline(admin.TabularInline):
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class ArchivedPaymentInline(ArchivedRowInline):
+    model = ArchivedPayment
+    fields = readonly_fields = ('title', 'cost', 'paid')
+
+
+class ArchivedMedicineInline(ArchivedRowInline):
+    model = ArchivedMedicine
+    fields = readonly_fields = ('name', 'order')
+
+
+class ArchivedBedOccupancyInline(ArchivedRowInline):
+    model = ArchivedBedOccupancy
+    fields = readonly_fields = ('bed', 'start', 'end')
+
+
+class ArchivedPatientAdmin(admin.ModelAdmin):
+    list_display = ('national_id', 'first_name', 'last_name', 'sickness', 'login_at', 'discharge_date',
+                    'total_due', 'archived_at')
+    search_fields = ('=national_id', '^last_name', '^first_name', '=phone_number')
+    date_hierarchy = 'discharge_date'
+    ordering = ('-discharge_date',)
+    readonly_fields = ('invoice',)
+    inlines = [ArchivedPaymentInline, ArchivedMedicineInline, ArchivedBedOccupancyInline]
+    actions = ['readmit']
+
+    def invoice(self, obj):
+        return format_html('<a href="{}" target="_blank">Print invoice</a>', reverse('archived_invoice', args=[obj.pk]))
+
+    def get_fields(self, request, obj=None):
+        return ['invoice', *(field.name for field in ArchivedPatient._meta.fields if field.name != 'id')]
+
+    def get_readonly_fields(self, request, obj=None):
+        return self.get_fields(request, obj)
+
+    @admin.action(description='Readmit selected patients', permissions=['readmit'])
+    def readmit(self, request, queryset):
+        readmitted = 0
+        for archived in queryset:
+            try:
+                restore_patient(archived, readmit=True)
+            except ValidationError as error:
+                self.message_user(request, error.messages[0], messages.ERROR)
+            else:
+                readmitted += 1
+        if readmitted:
+            self.message_user(request, f'{readmitted} patients readmitted.', messages.SUCCESS)
+
+    def has_readmit_permission(self, request):
+        return request.user.has_perm('manager.add_patient')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class PaymentAdmin(KeysetPaginationMixin, admin.ModelAdmin):
     fieldsets = (
         ('Payment:', {"fields": [
             'patient',
@@ -269,6 +490,8 @@ class PaymentAdmin(admin.ModelAdmin):
         ], }),)
 
     list_display = ('patient', 'title', 'cost', 'paid')
+    autocomplete_fields = ('patient',)
+    actions = [export_action('payments', 'csv'), export_action('payments', 'jsonl')]
 
 
 class CustomUserAdmin(UserAdmin):
@@ -291,7 +514,7 @@ class CustomUserAdmin(UserAdmin):
         ]
         if request.user.is_superuser:
             return []
-        elif request.user.groups.filter(name='Managers'):
+        elif MANAGERS in user_groups(request):
             readonly_fields.remove('is_active')
             readonly_fields.remove('groups')
         return readonly_fields
@@ -307,4 +530,6 @@ admin.site.unregister(User)
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(Payment, PaymentAdmin)
 admin.site.register(Bed, BedAdmin)
+admin.site.register(BedOccupancy, BedOccupancyAdmin)
 admin.site.register(Patient, PatientAdmin)
+admin.site.register(ArchivedPatient, ArchivedPatientAdmin)
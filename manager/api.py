@@ -0,0 +1,250 @@
+"""
+Read-only JSON API, version 1.
+
+``/api/v1/<resource>`` lists patients, beds, payments or medicines in id order,
+``limit`` rows at a time; the ``next`` URL continues after the last row (keyset,
+see ``manager.pagination``). ``?fields=a,b`` selects fields, including the nested
+ones (a patient's ``bed``, ``medicines`` and ``payments``), which are fetched with
+one extra query per relation. Responses carry an ETag and answer
+``If-None-Match`` with 304. Doctors and nurses don't see the fields
+``PatientAdmin`` hides from them.
+
+``/api/v1/changes?since=N`` returns the change feed after sequence number N.
+"""
+
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import urlencode
+from django.views.decorators.http import require_GET
+from hospital.routers import replica_reads
+from .admin import PatientAdmin
+from .models import Bed, Change, Medicine, Patient, Payment
+from .pagination import IncorrectLookupParameters, decode_cursor, encode_cursor, seek
+from .roles import DOCTORS, NURSES, get_role
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+LEDGER_FIELDS = ['total_cost', 'total_paid', 'total_due']
+
+
+class Nested:
+    """A relation serialised inside each row: ``to_one`` via select_related, otherwise prefetched."""
+
+    def __init__(self, model, accessor, fields, to_one=False):
+        self.model = model
+        self.accessor = accessor
+        self.fields = fields
+        self.to_one = to_one
+
+    def serialize(self, obj):
+        if self.to_one:
+            related = getattr(obj, self.accessor, None)
+            return serialize(related, self.fields) if related else None
+        return [serialize(row, self.fields) for row in getattr(obj, self.accessor).all()]
+
+
+class Resource:
+    def __init__(self, model, fields, nested=None, filters=None, hidden=None):
+        self.model = model
+        self.fields = fields
+        self.nested = nested or {}
+        # Query parameter -> (lookup, parser).
+        self.filters = filters or {}
+        # Role -> fields it may not see.
+        self.hidden = hidden or {}
+
+    def visible(self, role):
+        hidden = set(self.hidden.get(role, ()))
+        return [name for name in (*self.fields, *self.nested) if name not in hidden]
+
+    def queryset(self, fields):
+        opts = self.model._meta
+        columns = [opts.get_field(name).name for name in fields if name in self.fields and name != 'id']
+        for name in fields:
+            nested = self.nested.get(name)
+            if nested and nested.to_one:
+                columns += [f'{nested.accessor}__{field}' for field in nested.fields]
+        queryset = self.model.objects.only(*columns)
+        for name in fields:
+            nested = self.nested.get(name)
+            if nested is None:
+                continue
+            if nested.to_one:
+                queryset = queryset.select_related(nested.accessor)
+            else:
+                related = nested.model.objects.only(
+                    *(name for name in nested.fields if name != 'id'), nested.model._meta.get_field('patient').name,
+                ).order_by('pk')
+                queryset = queryset.prefetch_related(Prefetch(nested.accessor, queryset=related))
+        return queryset.order_by('pk')
+
+    def row(self, obj, fields):
+        data = {}
+        for name in fields:
+            if name in self.nested:
+                data[name] = self.nested[name].serialize(obj)
+            else:
+                data[name] = getattr(obj, self.model._meta.get_field(name).attname)
+        return data
+
+
+def serialize(obj, fields):
+    return {name: getattr(obj, obj._meta.get_field(name).attname) for name in fields}
+
+
+def parse_bool(value):
+    return value.lower() in ('1', 'true', 'yes')
+
+
+PATIENT_HIDDEN = {
+    role: [*PatientAdmin.role_hidden_fields.get(role, ()), *LEDGER_FIELDS, 'payments'] for role in (DOCTORS, NURSES)
+}
+
+RESOURCES = {
+    'patients': Resource(
+        Patient,
+        fields=('id', 'national_id', 'first_name', 'last_name', 'sickness', 'watchful_name', 'age', 'height',
+                'weight', 'phone_number', 'insurance_type', 'address', 'blood_type', 'doctor_order', 'nurse_report',
+                'doctor', 'nurse', 'login_at', 'is_hospitalized', 'discharge_date', *LEDGER_FIELDS),
+        nested={
+            'bed': Nested(Bed, 'bed', ('id', 'floor', 'room', 'bed'), to_one=True),
+            'medicines': Nested(Medicine, 'medicine_set', ('id', 'name', 'order')),
+            'payments': Nested(Payment, 'payment_set', ('id', 'title', 'cost', 'paid')),
+        },
+        filters={
+            'present': ('is_hospitalized', parse_bool),
+            'doctor': ('doctor', int),
+            'nurse': ('nurse', int),
+        },
+        hidden=PATIENT_HIDDEN,
+    ),
+    'beds': Resource(
+        Bed,
+        fields=('id', 'floor', 'room', 'bed', 'patient'),
+        filters={
+            'floor': ('floor', int),
+            'free': ('patient__isnull', parse_bool),
+        },
+    ),
+    'payments': Resource(
+        Payment,
+        fields=('id', 'patient', 'title', 'cost', 'paid'),
+        filters={'patient': ('patient', int)},
+    ),
+    'medicines': Resource(
+        Medicine,
+        fields=('id', 'patient', 'name', 'order'),
+        filters={'patient': ('patient', int)},
+    ),
+}
+
+
+def error(status, message):
+    return JsonResponse({'error': message}, status=status)
+
+
+def json_response(request, data):
+    """``data`` as JSON with a strong ETag, or 304 if the client already has it."""
+    body = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False).encode()
+    etag = quote_etag(hashlib.md5(body).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    response['Vary'] = 'Cookie'
+    return response
+
+
+def resolve(request, resource_name):
+    """The resource, the fields to return and an error response, if any."""
+    resource = RESOURCES.get(resource_name)
+    if resource is None:
+        return None, None, error(404, f'Unknown resource {resource_name!r}.')
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return None, None, error(401, 'Authentication required.')
+    opts = resource.model._meta
+    if not request.user.has_perm(f'{opts.app_label}.view_{opts.model_name}'):
+        return None, None, error(403, 'Permission denied.')
+    visible = resource.visible(get_role(request))
+    if request.GET.get('fields'):
+        fields = [name for name in request.GET['fields'].split(',') if name]
+        unknown = [name for name in fields if name not in visible]
+        if unknown:
+            return None, None, error(400, f"Unknown fields: {', '.join(unknown)}.")
+    else:
+        fields = [name for name in visible if name in resource.fields]
+    return resource, fields, None
+
+
+@require_GET
+@replica_reads
+def collection(request, resource_name):
+    resource, fields, response = resolve(request, resource_name)
+    if response:
+        return response
+    queryset = resource.queryset(fields)
+    try:
+        limit = min(int(request.GET.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+        for param, (lookup, parse) in resource.filters.items():
+            if param in request.GET:
+                queryset = queryset.filter(**{lookup: parse(request.GET[param])})
+        if request.GET.get('cursor'):
+            queryset = queryset.filter(seek(['pk'], decode_cursor(request.GET['cursor'])))
+    except (ValueError, IncorrectLookupParameters) as exc:
+        return error(400, str(exc))
+    if limit < 1:
+        return error(400, 'limit must be positive.')
+    rows = list(queryset[:limit + 1])
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        params = request.GET.copy()
+        params['cursor'] = encode_cursor([rows[-1].pk])
+        next_url = f'{request.path}?{urlencode(sorted(params.items()))}'
+    return json_response(request, {
+        'results': [resource.row(obj, fields) for obj in rows],
+        'next': next_url,
+    })
+
+
+@require_GET
+@replica_reads
+def detail(request, resource_name, pk):
+    resource, fields, response = resolve(request, resource_name)
+    if response:
+        return response
+    obj = resource.queryset(fields).filter(pk=pk).first()
+    if obj is None:
+        return error(404, 'Not found.')
+    return json_response(request, resource.row(obj, fields))
+
+
+@require_GET
+def changes(request):
+    """Change feed entries after ``?since=``, for the models the user may view."""
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return error(401, 'Authentication required.')
+    models = [name for name in Change.MODELS if request.user.has_perm(f'manager.view_{name}')]
+    try:
+        since = int(request.GET.get('since', 0))
+        limit = min(int(request.GET.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+    except ValueError as exc:
+        return error(400, str(exc))
+    if limit < 1:
+        return error(400, 'limit must be positive.')
+    if request.GET.get('model'):
+        models = [name for name in models if name in request.GET['model'].split(',')]
+    entries = list(Change.since(since, models)[:limit + 1])
+    more = len(entries) > limit
+    entries = entries[:limit]
+    return json_response(request, {
+        'results': [entry.as_dict() for entry in entries],
+        'last_seq': entries[-1].seq if entries else since,
+        'more': more,
+    })
@@ -0,0 +1,148 @@
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from hospital import caching
+from . import search
+from .models import (ArchivedBedOccupancy, ArchivedMedicine, ArchivedPatient, ArchivedPayment, BedOccupancy,
+                     Medicine, Patient, Payment, change_rows, log_changes)
+
+
+# Set while archive_patients() deletes the moved rows. The per-row delete
+# receivers then skip the cache, search index and change feed, which
+# archive_patients() updates in bulk for the whole batch.
+moving = ContextVar('archive_moving', default=False)
+
+
+def archivable(cutoff):
+    """Discharged patients without a bed whose discharge is older than ``cutoff``."""
+    return Patient.objects.filter(is_hospitalized=False, discharge_date__lt=cutoff, bed__isnull=True)
+
+
+def archive_patients(patient_ids):
+    """Move the given discharged patients and their rows into the archive tables in one transaction.
+
+    Patients that were readmitted or given a bed in the meantime are skipped.
+    Returns the number of patients archived.
+    """
+    with transaction.atomic():
+        patients = list(Patient.objects.select_for_update(of=('self',)).filter(
+            pk__in=list(patient_ids), is_hospitalized=False, bed__isnull=True,
+        ))
+        if not patients:
+            return 0
+        pks = [patient.pk for patient in patients]
+        ArchivedPatient.objects.bulk_create([
+            ArchivedPatient(
+                original_id=patient.pk,
+                total_cost=patient.total_cost,
+                total_paid=patient.total_paid,
+                total_due=patient.total_due,
+                **{field: getattr(patient, field) for field in ArchivedPatient.COPIED_FIELDS},
+            )
+            for patient in patients
+        ])
+        archived = dict(ArchivedPatient.objects.filter(original_id__in=pks).values_list('original_id', 'pk'))
+        payments = list(Payment.objects.filter(patient__in=pks).order_by('pk'))
+        ArchivedPayment.objects.bulk_create([
+            ArchivedPayment(patient_id=archived[payment.patient_id], original_id=payment.pk, title=payment.title,
+                            cost=payment.cost, paid=payment.paid)
+            for payment in payments
+        ])
+        medicines = list(Medicine.objects.filter(patient__in=pks).order_by('pk'))
+        ArchivedMedicine.objects.bulk_create([
+            ArchivedMedicine(patient_id=archived[medicine.patient_id], original_id=medicine.pk, name=medicine.name,
+                             order=medicine.order)
+            for medicine in medicines
+        ])
+        ArchivedBedOccupancy.objects.bulk_create([
+            ArchivedBedOccupancy(patient_id=archived[patient_id], bed_id=bed_id, start=start, end=end)
+            for patient_id, bed_id, start, end in BedOccupancy.objects.filter(patient__in=pks).order_by(
+                'pk').values_list('patient_id', 'bed_id', 'start', 'end')
+        ])
+        token = moving.set(True)
+        try:
+            Patient.objects.filter(pk__in=pks).delete()
+        finally:
+            moving.reset(token)
+        search.unindex_patients(pks)
+        log_changes(Patient, 'archive', [(pk, pk, {'archived_id': archived[pk]}) for pk in pks])
+        log_changes(Payment, 'archive', change_rows(payments))
+        log_changes(Medicine, 'archive', change_rows(medicines))
+        caching.bump(*(caching.patient(pk) for pk in pks))
+    return len(pks)
+
+
+def archive_discharged(days, batch_size=500, now=None):
+    """Archive the patients discharged more than ``days`` days ago, one transaction per batch.
+
+    Yields the number of patients archived by each batch.
+    """
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    while True:
+        batch = list(archivable(cutoff).order_by('discharge_date', 'pk').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return
+        yield archive_patients(batch)
+
+
+def free_original_ids(model, rows):
+    """The ``original_id`` of each archived row, or ``None`` where ``model`` has reused that primary key."""
+    taken = set(model.objects.filter(pk__in=[row.original_id for row in rows if row.original_id]).values_list(
+        'pk', flat=True))
+    return [None if row.original_id in taken else row.original_id for row in rows]
+
+
+def restore_patient(archived, readmit=False):
+    """Move ``archived`` back into the hot tables, as a new admission if ``readmit``.
+
+    The patient keeps their old primary key when it is still free, and the
+    balance ledger is rebuilt from the restored payments.
+    """
+    with transaction.atomic():
+        if Patient.objects.filter(national_id=archived.national_id).exists():
+            raise ValidationError(
+                _('A patient with National ID %(national_id)s is already on record.'),
+                params={'national_id': archived.national_id},
+            )
+        patient = Patient(**{field: getattr(archived, field) for field in ArchivedPatient.COPIED_FIELDS})
+        if not Patient.objects.filter(pk=archived.original_id).exists():
+            patient.pk = archived.original_id
+        if readmit:
+            patient.is_hospitalized = True
+            patient.discharge_date = None
+        else:
+            patient.is_hospitalized = False
+        patient.save(force_insert=True)
+        if not readmit:
+            # login_at is auto_now_add, so the original admission time is written back afterwards.
+            patient.login_at = archived.login_at
+            Patient.objects.filter(pk=patient.pk).update(login_at=archived.login_at)
+        # Payments and medicines also keep their old primary keys when free, so
+        # a change feed consumer sees them come back rather than new rows.
+        payments = list(archived.archivedpayment_set.order_by('pk'))
+        Payment.objects.bulk_create([
+            Payment(pk=pk, patient=patient, title=payment.title, cost=payment.cost, paid=payment.paid)
+            for pk, payment in zip(free_original_ids(Payment, payments), payments)
+        ])
+        medicines = list(archived.archivedmedicine_set.order_by('pk'))
+        Medicine.objects.bulk_create([
+            Medicine(pk=pk, patient=patient, name=medicine.name, order=medicine.order)
+            for pk, medicine in zip(free_original_ids(Medicine, medicines), medicines)
+        ])
+        BedOccupancy.objects.bulk_create([
+            BedOccupancy(patient=patient, bed_id=occupancy.bed_id, start=occupancy.start, end=occupancy.end)
+            for occupancy in archived.archivedbedoccupancy_set.order_by('pk')
+        ])
+        archived.delete()
+    patient.refresh_from_db(fields=Patient.LEDGER_FIELDS)
+    return patient
+
+
+def readmit(national_id):
+    """Restore the latest archived record of ``national_id`` as a present patient, or return ``None``."""
+    archived = ArchivedPatient.objects.filter(national_id=national_id).order_by('-archived_at', '-pk').first()
+    return restore_patient(archived, readmit=True) if archived else None
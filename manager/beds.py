@@ -0,0 +1,110 @@
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from hospital import caching
+from .models import Bed, BedOccupancy, Patient, beds_changed, patients_changed
+
+ICU = 0
+
+
+def free_beds(floor=None):
+    beds = Bed.objects.filter(patient__isnull=True)
+    if floor is not None:
+        beds = beds.filter(floor=floor)
+    return beds.order_by('floor', 'room', 'bed')
+
+
+def first_free_bed(floor=None):
+    return free_beds(floor).first()
+
+
+def current_bed(patient):
+    return Bed.objects.filter(patient=patient).first()
+
+
+def allocate_bed(patient, floor=None, attempts=3):
+    """Assign the first free bed (on ``floor`` if given) to ``patient``.
+
+    The bed is claimed with a single conditional UPDATE, so two clerks can never
+    end up with the same bed. Returns the bed, or ``None`` when the ward is full.
+    Discharged patients are refused with ``ValidationError``.
+    """
+    if not patient.is_hospitalized:
+        raise ValidationError(_('%(patient)s is not hospitalized.'), params={'patient': patient})
+    current = current_bed(patient)
+    if current:
+        return current
+    for attempt in range(attempts):
+        candidate = free_beds(floor).values('pk')[:1]
+        try:
+            with transaction.atomic():
+                claimed = Bed.objects.filter(pk=Subquery(candidate), patient__isnull=True).update(patient=patient)
+                if claimed:
+                    bed = Bed.objects.get(patient=patient)
+                    BedOccupancy.objects.create(bed=bed, patient=patient, start=timezone.now())
+        except IntegrityError:
+            # A concurrent call gave the patient a bed first.
+            return current_bed(patient)
+        if claimed:
+            beds_changed.send(sender=Bed, floors=[bed.floor], assigned=[(bed, patient.pk)])
+            patients_changed.send(sender=Patient, patient_ids=[patient.pk])
+            return bed
+        if not free_beds(floor).exists():
+            return None
+    return None
+
+
+def occupancy_by_floor():
+    def compute():
+        rows = Bed.objects.order_by().values('floor').annotate(
+            total=Count('pk'),
+            occupied=Count('patient'),
+        ).order_by('floor')
+        return [dict(row, free=row['total'] - row['occupied']) for row in rows]
+    return caching.get('occupancy', [caching.WARDS, caching.OCCUPANCY], compute, caching.replica_timeout)
+
+
+def ward_beds(floor):
+    """The beds of ``floor`` as ``room``/``bed``/``patient_id`` dicts."""
+    def compute():
+        return list(Bed.objects.filter(floor=floor).order_by('room', 'bed').values('pk', 'room', 'bed', 'patient_id'))
+    return caching.get('ward_beds', [caching.WARDS, caching.ward(floor)], compute, caching.replica_timeout)
+
+
+def occupancies_during(start, end):
+    """Occupancy intervals overlapping ``[start, end)``."""
+    return BedOccupancy.objects.filter(start__lt=end).filter(Q(end__isnull=True) | Q(end__gt=start))
+
+
+def occupant(floor, room, bed, when):
+    """The patient who was in bed ``floor``/``room``/``bed`` at ``when``, if any."""
+    occupancy = BedOccupancy.objects.filter(
+        bed__floor=floor, bed__room=room, bed__bed=bed, start__lte=when,
+    ).filter(Q(end__isnull=True) | Q(end__gt=when)).select_related('patient').first()
+    return occupancy.patient if occupancy else None
+
+
+def average_stay(start, end):
+    """Average length of the stays that ended within ``[start, end)``."""
+    return BedOccupancy.objects.filter(end__gte=start, end__lt=end).aggregate(
+        stay=Avg(ExpressionWrapper(F('end') - F('start'), output_field=DurationField())),
+    )['stay']
+
+
+def utilisation(start, end):
+    """Share of the available bed time in ``[start, end)`` that was occupied."""
+    beds = Bed.objects.count()
+    if not beds:
+        return 0.0
+    occupied = occupancies_during(start, end).aggregate(
+        total=Sum(ExpressionWrapper(
+            Least(Coalesce('end', Value(end)), Value(end)) - Greatest('start', Value(start)),
+            output_field=DurationField(),
+        )),
+    )['total']
+    if not occupied:
+        return 0.0
+    return occupied / ((end - start) * beds)
@@ -0,0 +1,97 @@
+"""
+In-process broker for bed events.
+
+``publish`` is called from the model signals (after the transaction commits)
+and fans each event out to every open server-sent-events stream of this
+process. Recent events are kept so a reconnecting display can resume from its
+``Last-Event-ID``; a subscriber that falls too far behind gets a ``resync``
+event instead of the events it missed.
+"""
+
+import asyncio
+import queue
+import threading
+from collections import deque
+
+QUEUE_SIZE = 256
+HISTORY_SIZE = 1024
+RESYNC = 'resync'
+
+
+class Broker:
+    def __init__(self, history_size=HISTORY_SIZE):
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.history = deque(maxlen=history_size)
+        self.subscribers = set()
+
+    def publish(self, kind, data):
+        with self.lock:
+            self.last_id += 1
+            event = (self.last_id, kind, data)
+            self.history.append(event)
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(event)
+        return event
+
+    def since(self, last_id):
+        """Events after ``last_id``, or ``None`` if some of them are no longer kept."""
+        with self.lock:
+            events = [event for event in self.history if event[0] > last_id]
+            # An id from before a restart (higher than ours) or older than the history can't be resumed.
+            complete = last_id == self.last_id or (
+                last_id < self.last_id and self.history and self.history[0][0] <= last_id + 1)
+        return events if complete else None
+
+    def subscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+
+class AsyncSubscriber:
+    """Receives events on the event loop it was created on."""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def put(self, event):
+        self.loop.call_soon_threadsafe(self.put_nowait, event)
+
+    def put_nowait(self, event):
+        if self.queue.full():
+            # Too slow to keep up: drop the backlog and tell the client to reload.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = (event[0], RESYNC, {})
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class ThreadSubscriber:
+    """Receives events in a WSGI worker thread."""
+
+    def __init__(self):
+        self.queue = queue.Queue(QUEUE_SIZE)
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            self.queue.put_nowait((event[0], RESYNC, {}))
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+
+bed_events = Broker()
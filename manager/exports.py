@@ -0,0 +1,67 @@
+import csv
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import Medicine, Patient, Payment
+from .roles import HIDDEN_PATIENT_FIELDS
+
+CHUNK_SIZE = 2000
+
+EXPORTS = {
+    'patients': (Patient, '', (
+        'id', 'national_id', 'first_name', 'last_name', 'sickness', 'watchful_name', 'age', 'height', 'weight',
+        'phone_number', 'insurance_type', 'address', 'blood_type', 'doctor_order', 'nurse_report',
+        'doctor_id', 'nurse_id', 'login_at', 'is_hospitalized', 'discharge_date',
+    )),
+    'payments': (Payment, 'patient__', ('id', 'patient_id', 'patient__national_id', 'title', 'cost', 'paid')),
+    'medicines': (Medicine, 'patient__', ('id', 'patient_id', 'patient__national_id', 'name', 'order')),
+}
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def day_start(date):
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
+
+def export_fields(kind, role=None):
+    """The columns of ``kind`` that ``role`` may see."""
+    model, patient, fields = EXPORTS[kind]
+    hidden = {f'{patient}{name}' for name in HIDDEN_PATIENT_FIELDS.get(role, ())}
+    return tuple(field for field in fields if field not in hidden)
+
+
+def export_queryset(kind, admitted=(None, None), discharged=(None, None), queryset=None, role=None):
+    """The rows to export for ``kind``, filtered by inclusive admission/discharge date ranges."""
+    model, patient, _ = EXPORTS[kind]
+    if queryset is None:
+        queryset = model.objects.all()
+    for field, (start, end) in (('login_at', admitted), ('discharge_date', discharged)):
+        if start:
+            queryset = queryset.filter(**{f'{patient}{field}__gte': day_start(start)})
+        if end:
+            queryset = queryset.filter(**{f'{patient}{field}__lt': day_start(end + datetime.timedelta(days=1))})
+    return queryset.order_by('pk').values_list(*export_fields(kind, role))
+
+
+def stream_rows(kind, rows, fmt, role=None):
+    """Yield the export as encoded text, one line at a time."""
+    fields = export_fields(kind, role)
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+        for row in rows.iterator(chunk_size=CHUNK_SIZE):
+            yield writer.writerow(row)
+    else:
+        for row in rows.iterator(chunk_size=CHUNK_SIZE):
+            yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
@@ -0,0 +1,287 @@
+"""Concurrent load harness replaying clinical and billing traffic against the app."""
+import html
+import http.cookiejar
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+from django.contrib.admin import site
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from .models import CustomUser, Patient
+from .roles import DOCTORS, MANAGERS, NURSES
+
+# Relative weights of what each kind of user does between two requests.
+MIXES = {
+    DOCTORS: {'changelist': 30, 'search': 20, 'change_form': 30, 'doctor_order': 20},
+    NURSES: {'changelist': 30, 'search': 20, 'change_form': 20, 'nurse_report': 30},
+    MANAGERS: {'changelist': 20, 'search': 10, 'payment_entry': 40, 'invoice': 30},
+}
+# Share of the virtual users given to each role.
+ROLE_SHARES = ((DOCTORS, 0.4), (NURSES, 0.4), (MANAGERS, 0.2))
+INLINE_PREFIXES = ('medicine_set', 'payment_set', 'bed')
+# The changelist pages by ``?cursor=``, so deep pages are reached through this link.
+NEXT_PAGE = re.compile(r'<a href="(\?[^"]*)" class="end">Next page</a>')
+
+
+class LockError(Exception):
+    pass
+
+
+class RequestFailed(Exception):
+    pass
+
+
+def check(status, body, expected):
+    if status == 500 and b'database is locked' in body:
+        raise LockError
+    if status not in expected:
+        raise RequestFailed(status)
+
+
+class WSGISession:
+    """Drives the WSGI handler in-process, one client and database connection per thread."""
+
+    def __init__(self, user, password):
+        self.client = Client()
+        self.call(self.client.force_login, user)
+
+    @staticmethod
+    def call(method, *args):
+        try:
+            return method(*args)
+        except Exception as error:
+            if 'locked' in str(error):
+                raise LockError from error
+            raise
+
+    def request(self, method, path, data=None, expected=(200,)):
+        response = self.call(getattr(self.client, method), path, data)
+        content = b'' if response.streaming else response.content
+        check(response.status_code, content, expected)
+        return content
+
+    def close(self):
+        connection.close()
+
+
+class HTTPSession:
+    """Talks to a running server (runserver, gunicorn hospital.wsgi, uvicorn hospital.asgi, ...)."""
+
+    def __init__(self, user, password, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), NoRedirect)
+        login = reverse('admin:login')
+        self.request('get', login)
+        self.request('post', login, {'username': user.username, 'password': password, 'next': reverse('admin:index')},
+                     expected=(302,))
+
+    def csrf_token(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+
+    def request(self, method, path, data=None, expected=(200,)):
+        url = self.base_url + path
+        body = None
+        headers = {'Referer': self.base_url + '/'}
+        if method == 'get' and data:
+            url += '?' + urllib.parse.urlencode(data)
+        elif method == 'post':
+            body = urllib.parse.urlencode({**(data or {}), 'csrfmiddlewaretoken': self.csrf_token()}).encode()
+        request = urllib.request.Request(url, body, headers, method=method.upper())
+        try:
+            with self.opener.open(request) as response:
+                status, content = response.status, response.read()
+        except urllib.error.HTTPError as error:
+            status, content = error.code, error.read()
+        check(status, content, expected)
+        return content
+
+    def close(self):
+        pass
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects as responses so a successful admin POST shows up as a 302."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Workload:
+    """Patients and staff sampled once up front and shared, read-only, by every virtual user."""
+
+    def __init__(self, sample_size=500):
+        patients = list(Patient.objects.filter(is_hospitalized=True).order_by('?').values(
+            'pk', 'national_id', 'last_name', 'doctor_id', 'nurse_id', 'sickness', 'blood_type', 'height', 'weight',
+            'doctor_order', 'nurse_report')[:sample_size])
+        if not patients:
+            raise ValueError('No hospitalized patients; seed the database first (manage.py seed_hospital).')
+        self.patients = patients
+        self.assigned = defaultdict(list)
+        for patient in patients:
+            self.assigned[patient['doctor_id']].append(patient)
+            self.assigned[patient['nurse_id']].append(patient)
+        self.staff = {
+            role: list(CustomUser.objects.filter(groups__name=role, is_active=True).order_by('pk'))
+            for role, share in ROLE_SHARES
+        }
+        self.model_admin = site._registry[Patient]
+        self.pages = max(1, min(20, Patient.objects.count() // self.model_admin.list_per_page))
+
+    def users(self, count):
+        """``count`` (role, user) pairs split between the roles by ROLE_SHARES."""
+        shares = [(role, share) for role, share in ROLE_SHARES if self.staff[role]]
+        if not shares:
+            raise ValueError('No Doctors, Nurses or Managers accounts; seed the database first.')
+        roles, weights = zip(*shares)
+        chosen = []
+        for i in range(count):
+            role = random.Random(i).choices(roles, weights)[0]
+            members = self.staff[role]
+            chosen.append((role, members[i % len(members)]))
+        return chosen
+
+    def edit_data(self, role, patient, text_field, rng):
+        """POST data for the role's editable fields of the patient change form."""
+        readonly = set(self.model_admin.role_readonly_fields[role])
+        data = {field: patient[field] for field in ('sickness', 'blood_type', 'height', 'weight', text_field)
+                if field in self.model_admin.role_fields[role] and field not in readonly}
+        data[text_field] = f'{patient[text_field]}\nRound at {time.strftime("%H:%M")}: {rng.random():.3f}'[-2000:]
+        for prefix in INLINE_PREFIXES:
+            data.update({f'{prefix}-TOTAL_FORMS': 0, f'{prefix}-INITIAL_FORMS': 0})
+        return data
+
+
+def next_page(content):
+    match = NEXT_PAGE.search(content.decode())
+    return html.unescape(match.group(1)) if match else None
+
+
+def run_action(action, session, role, user, workload, rng, state):
+    patients = workload.assigned.get(user.pk) or workload.patients
+    patient = rng.choice(patients)
+    changelist = reverse('admin:manager_patient_changelist')
+    if action == 'changelist':
+        # Three views in ten go one page deeper into the user's current walk, up to workload.pages.
+        if state.get('next') and rng.random() < 0.3:
+            content = session.request('get', changelist + state['next'])
+            state['depth'] += 1
+            state['next'] = next_page(content) if state['depth'] < workload.pages else None
+        else:
+            content = session.request('get', changelist)
+            if not state.get('next'):
+                state.update(next=next_page(content), depth=1)
+    elif action == 'search':
+        session.request('get', changelist, {'q': patient['last_name']})
+    elif action == 'change_form':
+        session.request('get', reverse('admin:manager_patient_change', args=[patient['pk']]))
+    elif action in ('doctor_order', 'nurse_report'):
+        session.request('post', reverse('admin:manager_patient_change', args=[patient['pk']]),
+                        workload.edit_data(role, patient, action, rng), expected=(302,))
+    elif action == 'payment_entry':
+        cost = rng.randint(1, 50) * 10000
+        session.request('post', reverse('admin:manager_payment_add'), {
+            'patient': patient['pk'], 'title': 'Pharmacy', 'cost': cost, 'paid': rng.choice([0, cost]),
+        }, expected=(302,))
+    elif action == 'invoice':
+        session.request('get', reverse('invoice', args=[patient['national_id']]))
+
+
+def virtual_user(session_factory, role, user, workload, clock, think_time, seed, results, lock):
+    rng = random.Random(seed)
+    actions, weights = zip(*MIXES[role].items())
+    samples = []
+    state = {}
+    started = time.perf_counter()
+    try:
+        session = session_factory(user)
+    except Exception as error:
+        session = None
+        samples.append(('login', 'locked' if isinstance(error, LockError) else 'error',
+                        (time.perf_counter() - started) * 1000))
+    # Every user logs in before the clock starts, so slow password hashing does not eat the run.
+    clock['barrier'].wait()
+    try:
+        while session and time.monotonic() < clock['deadline']:
+            action = rng.choices(actions, weights)[0]
+            started = time.perf_counter()
+            outcome = 'ok'
+            try:
+                run_action(action, session, role, user, workload, rng, state)
+            except LockError:
+                outcome = 'locked'
+            except Exception:
+                outcome = 'error'
+            samples.append((action, outcome, (time.perf_counter() - started) * 1000))
+            if think_time:
+                time.sleep(rng.uniform(0, 2 * think_time))
+    finally:
+        if session:
+            session.close()
+        with lock:
+            results.extend(samples)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(fraction * len(values) + 0.5) - 1))
+    return round(values[index], 2)
+
+
+def summarize(samples, elapsed):
+    by_action = defaultdict(list)
+    for action, outcome, latency in samples:
+        by_action[action].append((outcome, latency))
+    by_action['total'] = [(outcome, latency) for action, outcome, latency in samples]
+    summary = {}
+    for action, rows in sorted(by_action.items()):
+        latencies = sorted(latency for outcome, latency in rows)
+        summary[action] = {
+            'requests': len(rows),
+            'errors': sum(outcome == 'error' for outcome, latency in rows),
+            'lock_errors': sum(outcome == 'locked' for outcome, latency in rows),
+            'throughput_rps': round(len(rows) / elapsed, 2) if elapsed else None,
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+        }
+    return summary
+
+
+def run(target='wsgi', users=10, duration=30.0, think_time=0.0, password='password', base_url=None, seed=0):
+    workload = Workload()
+    if target == 'http':
+        def session_factory(user):
+            return HTTPSession(user, password, base_url)
+    else:
+        def session_factory(user):
+            return WSGISession(user, password)
+
+    pairs = workload.users(users)
+    results, lock = [], threading.Lock()
+    clock = {}
+
+    def start_clock():
+        clock['started'] = time.monotonic()
+        clock['deadline'] = clock['started'] + duration
+
+    clock['barrier'] = threading.Barrier(len(pairs), action=start_clock)
+    threads = [
+        threading.Thread(target=virtual_user, args=(
+            session_factory, role, user, workload, clock, think_time, seed + i, results, lock))
+        for i, (role, user) in enumerate(pairs)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(results, time.monotonic() - clock['started'])
@@ -0,0 +1,38 @@
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from manager.archive import archive_discharged, readmit
+
+
+class Command(BaseCommand):
+    help = 'Move patients discharged more than --days ago, with their payments and medicines, to the archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, help='Keep archiving every INTERVAL seconds.')
+        parser.add_argument('--readmit', metavar='NATIONAL_ID',
+                            help='Restore the archived record of NATIONAL_ID as a present patient instead.')
+
+    def handle(self, *args, **options):
+        if options['readmit']:
+            try:
+                patient = readmit(options['readmit'])
+            except ValidationError as error:
+                raise CommandError(error.messages[0])
+            if patient is None:
+                raise CommandError(f"No archived patient with National ID {options['readmit']}.")
+            self.stdout.write(self.style.SUCCESS(f'Readmitted {patient} (#{patient.pk}).'))
+            return
+        while True:
+            started = time.monotonic()
+            total = 0
+            for archived in archive_discharged(options['days'], options['batch_size']):
+                total += archived
+                self.stdout.write(f'Archived {total} patients...', ending='\r')
+            self.stdout.write(f'Archived {total} patients discharged more than {options["days"]} days ago.')
+            if not options['interval']:
+                return
+            time.sleep(max(0.0, options['interval'] - (time.monotonic() - started)))
@@ -0,0 +1,147 @@
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from contextlib import ExitStack
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from hospital import caching
+from manager.models import Bed, Patient, Payment
+
+
+def scenarios():
+    """(name, url, clear cache first) for every page the benchmark measures."""
+    fields = ('pk', 'national_id', 'last_name')
+    patient = (Patient.objects.filter(is_hospitalized=True).order_by('-total_cost').only(*fields).first()
+               or Patient.objects.only(*fields).first())
+    bed = Bed.objects.only('pk').first()
+    payment = Payment.objects.only('pk').first()
+    pages = [
+        ('patient_changelist', reverse('admin:manager_patient_changelist'), False),
+        ('patient_changelist_search', reverse('admin:manager_patient_changelist') + '?q=' + (
+            patient.last_name if patient else 'Doe'), False),
+        ('patient_changelist_debt', reverse('admin:manager_patient_changelist') + '?has_debt=1', False),
+        ('bed_changelist', reverse('admin:manager_bed_changelist'), False),
+        ('payment_changelist', reverse('admin:manager_payment_changelist'), False),
+    ]
+    if patient:
+        pages += [
+            ('patient_change', reverse('admin:manager_patient_change', args=[patient.pk]), False),
+            ('invoice', reverse('invoice', args=[patient.national_id]), True),
+            ('invoice_cached', reverse('invoice', args=[patient.national_id]), False),
+        ]
+    if bed:
+        pages.append(('bed_change', reverse('admin:manager_bed_change', args=[bed.pk]), False))
+    if payment:
+        pages.append(('payment_change', reverse('admin:manager_payment_change', args=[payment.pk]), False))
+    return pages
+
+
+class Command(BaseCommand):
+    help = 'Measure query counts, wall time and peak memory of the admin pages and the invoice.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--username', help='Superuser to browse as. Defaults to the first superuser.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--compare', help='Earlier JSON results to report regressions against.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative wall-time increase reported as a regression.')
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(is_superuser=True)
+        if options['username']:
+            users = users.filter(username=options['username'])
+        user = users.order_by('pk').first()
+        if user is None:
+            raise CommandError('No superuser to run the benchmark as; create one first.')
+
+        client = Client()
+        client.force_login(user)
+        results = {
+            'created_at': timezone.now().isoformat(),
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'rows': {
+                'patients': Patient.objects.count(),
+                'payments': Payment.objects.count(),
+                'beds': Bed.objects.count(),
+            },
+            'scenarios': {},
+        }
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, url, cold in scenarios():
+                results['scenarios'][name] = self.measure(client, url, cold, options['repeat'])
+                self.report(name, results['scenarios'][name])
+        results['cache'] = caching.stats()
+        for name, counts in results['cache'].items():
+            self.stdout.write(f"cache {name:22} {counts['hits']:6} hits {counts['misses']:6} misses "
+                              f"{counts['ratio']:7.1%}")
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+        if options['compare']:
+            self.compare(options['compare'], results, options['threshold'])
+
+    def measure(self, client, url, cold, repeat):
+        timings, peak = [], 0
+        for _ in range(repeat):
+            if cold:
+                cache.clear()
+            tracemalloc.start()
+            # Every alias, so pages served from the replica are counted too.
+            with ExitStack() as stack:
+                contexts = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            if response.status_code != 200:
+                raise CommandError(f'{url} answered {response.status_code}.')
+            captured = [query for context in contexts for query in context.captured_queries]
+        return {
+            'url': url,
+            'queries': len(captured),
+            'sql_ms': round(sum(float(query['time']) for query in captured) * 1000, 2),
+            'wall_ms': {
+                'median': round(statistics.median(timings), 2),
+                'min': round(min(timings), 2),
+                'max': round(max(timings), 2),
+            },
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def report(self, name, result):
+        self.stdout.write(f"{name:28} {result['queries']:4} queries {result['wall_ms']['median']:9.2f} ms "
+                          f"{result['peak_memory_kb']:10.1f} KB")
+
+    def compare(self, path, results, threshold):
+        with open(path) as file:
+            previous = json.load(file)['scenarios']
+        regressions = 0
+        for name, result in results['scenarios'].items():
+            before = previous.get(name)
+            if not before:
+                continue
+            slower = result['wall_ms']['median'] > before['wall_ms']['median'] * (1 + threshold)
+            if result['queries'] > before['queries'] or slower:
+                regressions += 1
+                self.stdout.write(self.style.WARNING(
+                    f"{name}: {before['queries']} -> {result['queries']} queries, "
+                    f"{before['wall_ms']['median']} -> {result['wall_ms']['median']} ms"))
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('No regressions.'))
@@ -0,0 +1,36 @@
+import json
+import time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.management.base import BaseCommand, CommandError
+
+from manager.models import Change
+
+
+class Command(BaseCommand):
+    help = 'Print the change feed entries after sequence number --since as JSON lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=int, default=0)
+        parser.add_argument('--model', action='append', choices=Change.MODELS,
+                            help='Only entries of this model; may be repeated.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--follow', type=float, metavar='INTERVAL',
+                            help='Keep polling for new entries every INTERVAL seconds.')
+
+    def handle(self, *args, **options):
+        if options['since'] < 0:
+            raise CommandError('--since must not be negative.')
+        since = options['since']
+        models = options['model'] or Change.MODELS
+        while True:
+            entries = list(Change.since(since, models)[:options['batch_size']])
+            for entry in entries:
+                self.stdout.write(json.dumps(entry.as_dict(), cls=DjangoJSONEncoder, ensure_ascii=False))
+            if entries:
+                since = entries[-1].seq
+                if len(entries) == options['batch_size']:
+                    continue
+            if not options['follow']:
+                return
+            time.sleep(options['follow'])
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from manager.exports import EXPORTS, FORMATS, export_queryset, stream_rows
+
+
+def date_argument(value):
+    date = parse_date(value)
+    if date is None:
+        raise ValueError(value)
+    return date
+
+
+class Command(BaseCommand):
+    help = 'Stream patients, payments or medicines to CSV or JSON Lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--output', help='Defaults to standard output.')
+        for prefix in ('admitted', 'discharged'):
+            for suffix in ('from', 'to'):
+                parser.add_argument(f'--{prefix}-{suffix}', type=date_argument, metavar='YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        rows = export_queryset(
+            options['kind'],
+            admitted=(options['admitted_from'], options['admitted_to']),
+            discharged=(options['discharged_from'], options['discharged_to']),
+        )
+        lines = stream_rows(options['kind'], rows, options['format'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        try:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(lines)
+        except OSError as error:
+            raise CommandError(error)
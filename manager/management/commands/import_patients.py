@@ -0,0 +1,150 @@
+import csv
+import json
+import sys
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from manager import search
+from manager.models import Patient
+
+REQUIRED = ('national_id', 'first_name', 'last_name', 'sickness', 'watchful_name', 'address', 'blood_type')
+TEXT_FIELDS = ('first_name', 'last_name', 'sickness', 'watchful_name', 'address', 'phone_number')
+INTEGER_FIELDS = ('age', 'height', 'weight')
+
+
+def field_regex(name):
+    return Patient._meta.get_field(name).validators[0].regex
+
+
+def choice_lookup(name):
+    """Map both stored values and their labels ('A+') to the stored value ('0')."""
+    choices = Patient._meta.get_field(name).choices
+    lookup = {str(value): str(value) for value, label in choices}
+    lookup.update({str(label).strip().lower(): str(value) for value, label in choices})
+    return lookup
+
+
+class Command(BaseCommand):
+    help = 'Import patients from a CSV or JSON Lines transfer file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Input file, or - for standard input.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--rejects', help='Where to write rejected rows (JSON Lines). '
+                                              'Defaults to <path>.rejects.jsonl.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        if path == '-' and not options['format']:
+            raise CommandError('--format is required when reading standard input.')
+        rejects_path = options['rejects'] or ('rejects.jsonl' if path == '-' else f'{path}.rejects.jsonl')
+
+        self.national_id = field_regex('national_id')
+        self.phone_number = field_regex('phone_number')
+        self.blood_types = choice_lookup('blood_type')
+        self.insurances = choice_lookup('insurance_type')
+
+        source = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        imported = rejected = 0
+        try:
+            with open(rejects_path, 'w', encoding='utf-8') as rejects:
+                rows = self.read(source, fmt)
+                while True:
+                    batch = list(islice(rows, options['batch_size']))
+                    if not batch:
+                        break
+                    created, failures = self.import_batch(batch)
+                    imported += created
+                    rejected += len(failures)
+                    for line, row, reason in failures:
+                        rejects.write(json.dumps({'line': line, 'error': reason, 'row': row}, ensure_ascii=False))
+                        rejects.write('\n')
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        self.stdout.write(self.style.SUCCESS(f'Imported {imported} patients.'))
+        if rejected:
+            self.stdout.write(self.style.WARNING(f'Rejected {rejected} rows, see {rejects_path}.'))
+
+    def read(self, source, fmt):
+        if fmt == 'csv':
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line, text in enumerate(source, 1):
+                if not text.strip():
+                    continue
+                try:
+                    yield line, json.loads(text)
+                except ValueError as error:
+                    yield line, {'_error': str(error), '_raw': text.rstrip('\n')}
+
+    def import_batch(self, batch):
+        failures, candidates = [], []
+        for line, row in batch:
+            try:
+                candidates.append((line, row, self.build(row)))
+            except ValueError as error:
+                failures.append((line, row, str(error)))
+
+        existing = set(Patient.objects.filter(
+            national_id__in=[patient.national_id for line, row, patient in candidates],
+        ).values_list('national_id', flat=True))
+        # Duplicates across batches are caught by the lookup above, as earlier batches are committed.
+        accepted, seen = [], set()
+        for line, row, patient in candidates:
+            if patient.national_id in existing:
+                failures.append((line, row, 'A patient with this national ID already exists.'))
+            elif patient.national_id in seen:
+                failures.append((line, row, 'Duplicate national ID in the input.'))
+            else:
+                seen.add(patient.national_id)
+                accepted.append(patient)
+
+        with transaction.atomic():
+            created = Patient.objects.bulk_create(accepted)
+            if any(patient.pk is None for patient in created):
+                created = Patient.objects.filter(national_id__in=[patient.national_id for patient in created])
+            search.index_patients(created)
+        return len(accepted), failures
+
+    def build(self, row):
+        if not isinstance(row, dict):
+            raise ValueError('Expected a JSON object.')
+        if '_error' in row:
+            raise ValueError(f"Invalid JSON: {row['_error']}")
+        row = {key: (value.strip() if isinstance(value, str) else value) for key, value in row.items() if key}
+        missing = [name for name in REQUIRED if not row.get(name)]
+        if missing:
+            raise ValueError(f"Missing {', '.join(missing)}.")
+        national_id = str(row['national_id'])
+        if not self.national_id.match(national_id):
+            raise ValueError('Only digits(10) are allowed.')
+        phone_number = str(row.get('phone_number') or Patient._meta.get_field('phone_number').default)
+        if not self.phone_number.match(phone_number):
+            raise ValueError('Enter valid phone number.(+989)')
+        blood_type = self.blood_types.get(str(row['blood_type']).lower())
+        if blood_type is None:
+            raise ValueError(f"Unknown blood type {row['blood_type']!r}.")
+        insurance_type = self.insurances.get(str(row.get('insurance_type') or '0').lower())
+        if insurance_type is None:
+            raise ValueError(f"Unknown insurance type {row['insurance_type']!r}.")
+        values = {name: str(row.get(name) or '') for name in TEXT_FIELDS}
+        for name in INTEGER_FIELDS:
+            try:
+                values[name] = int(row.get(name) or 0)
+            except (TypeError, ValueError):
+                raise ValueError(f'{name} must be an integer.')
+        for name in TEXT_FIELDS:
+            if len(values[name]) > Patient._meta.get_field(name).max_length:
+                raise ValueError(f'{name} is too long.')
+        values.update(national_id=national_id, phone_number=phone_number,
+                      blood_type=blood_type, insurance_type=insurance_type,
+                      doctor_order=str(row.get('doctor_order') or ''), nurse_report=str(row.get('nurse_report') or ''))
+        return Patient(**values)
@@ -0,0 +1,49 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from manager import loadtest
+
+
+class Command(BaseCommand):
+    help = ('Replay concurrent doctor, nurse and manager traffic against a seeded database and report '
+            'latency percentiles, throughput and "database is locked" errors per scenario.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=['wsgi', 'http'], default='wsgi',
+                            help='wsgi drives the WSGI handler in-process with one thread per user; '
+                                 'http talks to a running WSGI or ASGI server at --url.')
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--users', type=int, default=20, help='Concurrent virtual users.')
+        parser.add_argument('--duration', type=float, default=30.0, help='Seconds to run.')
+        parser.add_argument('--think-time', type=float, default=0.0, help='Mean pause between requests (s).')
+        parser.add_argument('--password', default='password', help='Password of the seeded staff (http only).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the summary as JSON to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                summary = loadtest.run(
+                    target=options['target'],
+                    users=options['users'],
+                    duration=options['duration'],
+                    think_time=options['think_time'],
+                    password=options['password'],
+                    base_url=options['url'],
+                    seed=options['seed'],
+                )
+        except ValueError as error:
+            raise CommandError(error)
+
+        self.stdout.write(f"{'scenario':16} {'requests':>8} {'errors':>7} {'locked':>7} {'rps':>8} "
+                          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for name, row in summary.items():
+            self.stdout.write(f"{name:16} {row['requests']:8} {row['errors']:7} {row['lock_errors']:7} "
+                              f"{row['throughput_rps']:8} {row['p50_ms']:9} {row['p95_ms']:9} {row['p99_ms']:9}")
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'options': {key: options[key] for key in ('target', 'users', 'duration', 'think_time')},
+                           'scenarios': summary}, output, indent=2)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from manager import search
+from manager.models import Patient
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text patient search index from the patient table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('The patient search index needs SQLite with FTS5; run migrate first.')
+        count = search.rebuild(Patient.objects.all(), options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} patients.'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from manager.models import Patient, refresh_balances
+
+
+class Command(BaseCommand):
+    help = "Check the stored patient balances against their payments and optionally repair drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Recompute the balances that drifted.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        drifted = list(Patient.objects.with_balance_drift().order_by('pk').values_list(
+            'pk', 'national_id', 'total_due', 'computed_total_due'))
+        for pk, national_id, stored, computed in drifted:
+            self.stdout.write(f'{national_id}: stored debt ${stored}, payments say ${computed}')
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All balances match their payments.'))
+            return
+        if options['fix']:
+            batch_size = options['batch_size']
+            for start in range(0, len(drifted), batch_size):
+                refresh_balances(pk for pk, *rest in drifted[start:start + batch_size])
+            self.stdout.write(self.style.SUCCESS(f'Repaired {len(drifted)} balances.'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{len(drifted)} balances drifted; rerun with --fix to repair.'))
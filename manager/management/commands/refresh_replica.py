@@ -0,0 +1,44 @@
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def snapshot(source, target):
+    """Copy ``source`` into ``target`` with the online backup API and swap it in atomically."""
+    temporary = f'{target}.tmp'
+    primary, copy = sqlite3.connect(source), sqlite3.connect(temporary)
+    try:
+        primary.backup(copy)
+        # The copy inherits the primary's WAL mode; a rollback journal leaves no side files to swap.
+        copy.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        copy.close()
+        primary.close()
+    os.replace(temporary, target)
+
+
+class Command(BaseCommand):
+    help = 'Refresh the SQLite read replica from the primary database using the online backup API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Keep refreshing every INTERVAL seconds.')
+
+    def handle(self, *args, **options):
+        replica = getattr(settings, 'REPLICA_DATABASE', None)
+        if not replica:
+            raise CommandError('No replica configured; set REPLICA_DATABASE_URL.')
+        if connections[DEFAULT_DB_ALIAS].vendor != 'sqlite' or connections[replica].vendor != 'sqlite':
+            raise CommandError("Snapshots are only for SQLite; use the database server's own replication.")
+        while True:
+            started = time.monotonic()
+            snapshot(str(connections[DEFAULT_DB_ALIAS].settings_dict['NAME']),
+                     str(connections[replica].settings_dict['NAME']))
+            connections[replica].close()
+            self.stdout.write(f'Replica refreshed in {time.monotonic() - started:.2f}s.')
+            if not options['interval']:
+                return
+            time.sleep(max(0.0, options['interval'] - (time.monotonic() - started)))
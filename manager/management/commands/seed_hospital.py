@@ -0,0 +1,154 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, Permission
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from manager import search
+from manager.models import Bed, BedOccupancy, CustomUser, Medicine, Patient, Payment, unlogged
+from manager.roles import DOCTORS, MANAGERS, NURSES
+
+FIRST_NAMES = ['علی', 'محمد', 'رضا', 'حسین', 'مهدی', 'زهرا', 'فاطمه', 'مریم', 'سارا', 'نرگس', 'امیر', 'نیما']
+LAST_NAMES = ['احمدی', 'محمدی', 'کریمی', 'رحیمی', 'حسینی', 'رضایی', 'موسوی', 'جعفری', 'قاسمی', 'صادقی']
+SICKNESSES = ['Fever', 'Flu', 'Fracture', 'Pneumonia', 'Diabetes', 'Asthma', 'Migraine', 'Appendicitis']
+MEDICINES = ['Paracetamol', 'Ibuprofen', 'Amoxicillin', 'Insulin', 'Salbutamol', 'Omeprazole']
+CHARGES = ['Bed', 'Visit', 'Laboratory', 'Radiology', 'Surgery', 'Pharmacy', 'Nursing']
+
+GROUP_PERMISSIONS = {
+    DOCTORS: ['view_patient', 'change_patient', 'add_medicine', 'change_medicine', 'delete_medicine',
+              'view_medicine', 'view_bed'],
+    NURSES: ['view_patient', 'change_patient', 'view_medicine', 'view_bed'],
+    MANAGERS: ['view_patient', 'change_patient', 'add_patient', 'view_payment', 'add_payment', 'change_payment',
+               'view_bed', 'add_bed', 'change_bed', 'view_user', 'change_user'],
+}
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with synthetic staff, beds, patients, payments and medicines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=20000)
+        parser.add_argument('--payments', type=int, default=50, help='Payments per patient.')
+        parser.add_argument('--medicines', type=int, default=20, help='Medicines per patient.')
+        parser.add_argument('--doctors', type=int, default=30)
+        parser.add_argument('--nurses', type=int, default=60)
+        parser.add_argument('--managers', type=int, default=5)
+        parser.add_argument('--discharged', type=float, default=0.8, help='Share of discharged patients.')
+        parser.add_argument('--password', default='password', help='Password of the generated staff.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Patients generated per transaction.')
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        staff = self.create_staff(options)
+        self.create_beds()
+        free_beds = list(Bed.objects.filter(patient__isnull=True).order_by('floor', 'room', 'bed'))
+
+        start = int(Patient.objects.aggregate(last=Max('national_id'))['last'] or 0) + 1
+        now = timezone.now()
+        created = 0
+        while created < options['patients']:
+            count = min(options['batch_size'], options['patients'] - created)
+            # Synthetic rows stay out of the change feed, which would otherwise get one entry per row.
+            with transaction.atomic(), unlogged():
+                patients = [self.patient(start + created + i, staff, options['discharged'], now)
+                            for i in range(count)]
+                # login_at is auto_now_add, so the generated admission times are written back afterwards.
+                login_times = {patient.national_id: patient.login_at for patient in patients}
+                patients = Patient.objects.bulk_create(patients)
+                if any(patient.pk is None for patient in patients):
+                    patients = list(Patient.objects.filter(national_id__in=login_times))
+                for patient in patients:
+                    patient.login_at = login_times[patient.national_id]
+                Patient.objects.bulk_update(patients, ['login_at'], batch_size=500)
+                search.index_patients(patients)
+                self.assign_beds(patients, free_beds)
+                Payment.objects.bulk_create(
+                    payment for patient in patients for payment in self.payments(patient, options['payments']))
+                Medicine.objects.bulk_create(
+                    medicine for patient in patients for medicine in self.medicines(patient, options['medicines']))
+            created += count
+            self.stdout.write(f'{created}/{options["patients"]} patients')
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {created} patients, {created * options["payments"]} payments and '
+            f'{created * options["medicines"]} medicines.'))
+
+    def create_staff(self, options):
+        password = make_password(options['password'])
+        staff = {}
+        for name, count in ((DOCTORS, options['doctors']), (NURSES, options['nurses']),
+                            (MANAGERS, options['managers'])):
+            group, _ = Group.objects.get_or_create(name=name)
+            group.permissions.add(*Permission.objects.filter(
+                content_type__app_label__in=['manager', 'auth'], codename__in=GROUP_PERMISSIONS[name]))
+            prefix = name.lower().rstrip('s')
+            existing = set(CustomUser.objects.filter(username__startswith=prefix).values_list('username', flat=True))
+            CustomUser.objects.bulk_create(
+                CustomUser(username=f'{prefix}{i}', password=password, is_staff=True,
+                           first_name=self.random.choice(FIRST_NAMES), last_name=self.random.choice(LAST_NAMES))
+                for i in range(1, count + 1) if f'{prefix}{i}' not in existing
+            )
+            users = list(CustomUser.objects.filter(username__in=[f'{prefix}{i}' for i in range(1, count + 1)]))
+            group.user_set.add(*users)
+            staff[name] = users
+        return staff
+
+    def create_beds(self):
+        existing = set(Bed.objects.values_list('floor', 'room', 'bed'))
+        Bed.objects.bulk_create(
+            Bed(floor=floor, room=room, bed=bed)
+            for floor, _ in Bed.floors for room, _ in Bed.rooms for bed, _ in Bed.beds
+            if (floor, room, bed) not in existing
+        )
+
+    def patient(self, number, staff, discharged, now):
+        login_at = now - timedelta(days=self.random.uniform(0, 3 * 365))
+        is_hospitalized = self.random.random() >= discharged
+        return Patient(
+            national_id=f'{number:010d}',
+            first_name=self.random.choice(FIRST_NAMES),
+            last_name=self.random.choice(LAST_NAMES),
+            sickness=self.random.choice(SICKNESSES),
+            watchful_name=self.random.choice(FIRST_NAMES),
+            age=self.random.randint(1, 95),
+            height=self.random.randint(50, 200),
+            weight=self.random.randint(3, 140),
+            phone_number=f'+989{self.random.randint(0, 10 ** 9 - 1):09d}',
+            insurance_type=self.random.choice(Patient.insurances)[0],
+            address=f'Tabriz, street {self.random.randint(1, 500)}',
+            blood_type=self.random.choice(Patient.blood_types)[0],
+            doctor_order='Rest and fluids.\n' * self.random.randint(1, 20),
+            nurse_report='Patient is stable.\n' * self.random.randint(1, 20),
+            doctor=self.random.choice(staff[DOCTORS]) if staff[DOCTORS] else None,
+            nurse=self.random.choice(staff[NURSES]) if staff[NURSES] else None,
+            login_at=login_at,
+            is_hospitalized=is_hospitalized,
+            discharge_date=None if is_hospitalized else login_at + timedelta(days=self.random.uniform(1, 30)),
+        )
+
+    def assign_beds(self, patients, free_beds):
+        occupancies = []
+        for patient in patients:
+            if patient.is_hospitalized and free_beds:
+                bed = free_beds.pop(0)
+                bed.patient = patient
+                occupancies.append(BedOccupancy(bed=bed, patient=patient, start=patient.login_at))
+        if occupancies:
+            Bed.objects.bulk_update([occupancy.bed for occupancy in occupancies], ['patient'])
+            BedOccupancy.objects.bulk_create(occupancies)
+
+    def payments(self, patient, count):
+        for i in range(count):
+            cost = self.random.randint(1, 500) * 10000
+            settled = not patient.is_hospitalized or self.random.random() < 0.7
+            yield Payment(patient=patient, title=self.random.choice(CHARGES), cost=cost,
+                          paid=cost if settled else self.random.randint(0, cost // 10000) * 10000)
+
+    def medicines(self, patient, count):
+        for i in range(count):
+            yield Medicine(patient=patient, name=self.random.choice(MEDICINES),
+                           order=f'{self.random.randint(1, 3)} tablets every {self.random.choice([6, 8, 12])} hours')
@@ -0,0 +1,26 @@
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='payment',
+            name='is_paid',
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='paid',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='national_id',
+            field=models.CharField(default='1234567890', max_length=10, unique=True, validators=[django.core.validators.RegexValidator('^\\d{10}$', message='Only digits(10) are allowed.')], verbose_name='National ID'),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0002_payment_paid'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bed',
+            index=models.Index(condition=models.Q(('patient__isnull', True)), fields=['floor', 'room', 'bed'], name='bed_free_idx'),
+        ),
+    ]
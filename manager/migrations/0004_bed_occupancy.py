@@ -0,0 +1,41 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def open_current_occupancies(apps, schema_editor):
+    Bed = apps.get_model('manager', 'Bed')
+    BedOccupancy = apps.get_model('manager', 'BedOccupancy')
+    BedOccupancy.objects.bulk_create(
+        BedOccupancy(bed=bed, patient_id=bed.patient_id, start=bed.patient.login_at)
+        for bed in Bed.objects.filter(patient__isnull=False).select_related('patient')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0003_bed_free_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bed',
+            name='patient',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='manager.patient'),
+        ),
+        migrations.CreateModel(
+            name='BedOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField(blank=True, null=True)),
+                ('bed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='manager.bed')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='manager.patient')),
+            ],
+            options={
+                'verbose_name_plural': 'bed occupancies',
+                'indexes': [models.Index(fields=['bed', 'start', 'end'], name='occupancy_bed_range_idx')],
+            },
+        ),
+        migrations.RunPython(open_current_occupancies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+import re
+
+from django.db import migrations
+
+# A frozen copy of manager.search as of this migration, so later changes to the
+# live module don't change what it does.
+FTS_TABLE = 'manager_patient_fts'
+
+CHARACTERS = str.maketrans({
+    'ي': 'ی',
+    'ى': 'ی',
+    'ئ': 'ی',
+    'ك': 'ک',
+    'ة': 'ه',
+    'ۀ': 'ه',
+    'أ': 'ا',
+    'إ': 'ا',
+    'آ': 'ا',
+    'ؤ': 'و',
+    '\u200c': ' ',  # zero-width non-joiner
+    '\u200d': '',  # zero-width joiner
+    '\u0640': '',  # tatweel
+    **{chr(0x06F0 + i): str(i) for i in range(10)},  # Persian digits
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # Arabic digits
+})
+DIACRITICS = re.compile('[\u064b-\u065f\u0670]')
+TOKEN = re.compile(r'\w+')
+
+
+def normalize(text):
+    return DIACRITICS.sub('', (text or '').translate(CHARACTERS)).lower()
+
+
+def phone_variants(phone_number):
+    digits = ''.join(TOKEN.findall(normalize(phone_number)))
+    if digits.startswith('98') and len(digits) == 12:
+        return f'{digits} 0{digits[2:]} {digits[2:]}'
+    return digits
+
+
+def create_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"name, national_id, phone_number, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    Patient = apps.get_model('manager', 'Patient')
+    rows = [
+        (patient.pk, normalize(f'{patient.first_name} {patient.last_name}'), patient.national_id,
+         phone_variants(patient.phone_number))
+        for patient in Patient.objects.all()
+    ]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, national_id, phone_number) VALUES (%s, %s, %s, %s)', rows)
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0004_bed_occupancy'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_balances(apps, schema_editor):
+    Patient = apps.get_model('manager', 'Patient')
+    Payment = apps.get_model('manager', 'Payment')
+    payments = Payment.objects.filter(patient=OuterRef('pk')).order_by().values('patient')
+    Patient.objects.update(
+        total_cost=Coalesce(Subquery(payments.annotate(total=Sum('cost')).values('total')), Value(0)),
+        total_paid=Coalesce(Subquery(payments.annotate(total=Sum('paid')).values('total')), Value(0)),
+        total_due=Coalesce(Subquery(
+            payments.filter(cost__gt=F('paid')).annotate(total=Sum(F('cost') - F('paid'))).values('total'),
+        ), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0005_patient_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='total_cost',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='total_due',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='total_paid',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(condition=models.Q(('total_due__gt', 0)), fields=['total_due'], name='patient_debt_idx'),
+        ),
+        migrations.RunPython(fill_balances, migrations.RunPython.noop),
+    ]
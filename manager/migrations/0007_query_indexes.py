@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0006_patient_balance_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['login_at', 'id'], name='patient_login_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(condition=models.Q(('is_hospitalized', True)), fields=['doctor', 'login_at'], name='patient_present_doctor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(condition=models.Q(('is_hospitalized', True)), fields=['nurse', 'login_at'], name='patient_present_nurse_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(condition=models.Q(('discharge_date__isnull', False)), fields=['discharge_date'], name='patient_discharged_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['last_name', 'first_name'], name='patient_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('cost__gt', models.F('paid'))), fields=['patient'], name='payment_unpaid_idx'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0007_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPatient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.BigIntegerField(unique=True)),
+                ('national_id', models.CharField(db_index=True, max_length=10, verbose_name='National ID')),
+                ('first_name', models.CharField(max_length=50)),
+                ('last_name', models.CharField(max_length=50)),
+                ('sickness', models.CharField(max_length=50)),
+                ('watchful_name', models.CharField(max_length=50)),
+                ('age', models.IntegerField(default=0)),
+                ('height', models.IntegerField(default=0, verbose_name='Height (cm)')),
+                ('weight', models.IntegerField(default=0, verbose_name='Weight (kg)')),
+                ('phone_number', models.CharField(max_length=13)),
+                ('insurance_type', models.CharField(choices=[('0', 'ٔNo Insurance'), ('1', 'General Health'), ('2', 'Social Supply'), ('3', 'ٔNomads Health')], max_length=10)),
+                ('address', models.CharField(max_length=250)),
+                ('blood_type', models.CharField(choices=[('0', 'A+'), ('1', 'A-'), ('2', 'B+'), ('3', 'B-'), ('4', 'O+'), ('5', 'O-'), ('6', 'AB+'), ('7', 'AB-')], max_length=10)),
+                ('doctor_order', models.TextField(blank=True)),
+                ('nurse_report', models.TextField(blank=True)),
+                ('login_at', models.DateTimeField()),
+                ('discharge_date', models.DateTimeField(blank=True, null=True)),
+                ('total_cost', models.BigIntegerField(default=0)),
+                ('total_paid', models.BigIntegerField(default=0)),
+                ('total_due', models.BigIntegerField(default=0)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='manager.customuser')),
+                ('nurse', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='manager.customuser')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedMedicine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('order', models.TextField()),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='manager.archivedpatient')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedBedOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField(blank=True, null=True)),
+                ('bed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='manager.bed')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='manager.archivedpatient')),
+            ],
+            options={
+                'verbose_name_plural': 'archived bed occupancies',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=50)),
+                ('cost', models.BigIntegerField(default=0)),
+                ('paid', models.BigIntegerField(default=0)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='manager.archivedpatient')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedpatient',
+            index=models.Index(fields=['last_name', 'first_name'], name='archived_patient_name_idx'),
+        ),
+    ]
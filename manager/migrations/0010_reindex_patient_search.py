@@ -0,0 +1,70 @@
+import re
+
+from django.db import migrations
+
+# A frozen copy of manager.search as of this migration, so later changes to the
+# live module don't change what it does.
+FTS_TABLE = 'manager_patient_fts'
+ZWNJ = '\u200c'
+
+CHARACTERS = str.maketrans({
+    'ي': 'ی',
+    'ى': 'ی',
+    'ئ': 'ی',
+    'ك': 'ک',
+    'ة': 'ه',
+    'ۀ': 'ه',
+    'أ': 'ا',
+    'إ': 'ا',
+    'آ': 'ا',
+    'ؤ': 'و',
+    ZWNJ: ' ',
+    '\u200d': '',  # zero-width joiner
+    '\u0640': '',  # tatweel
+    **{chr(0x06F0 + i): str(i) for i in range(10)},  # Persian digits
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # Arabic digits
+})
+DIACRITICS = re.compile('[\u064b-\u065f\u0670]')
+TOKEN = re.compile(r'\w+')
+
+
+def normalize(text):
+    return DIACRITICS.sub('', (text or '').translate(CHARACTERS)).lower()
+
+
+def phone_variants(phone_number):
+    digits = ''.join(TOKEN.findall(normalize(phone_number)))
+    if digits.startswith('98') and len(digits) == 12:
+        return f'{digits} 0{digits[2:]} {digits[2:]}'
+    return digits
+
+
+def joined_words(text):
+    return ' '.join(normalize(word.replace(ZWNJ, '')) for word in (text or '').split() if ZWNJ in word)
+
+
+def reindex(apps, schema_editor):
+    # Index the joined spelling of ZWNJ-split names for existing patients.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Patient = apps.get_model('manager', 'Patient')
+    rows = []
+    for patient in Patient.objects.all():
+        name = f'{patient.first_name} {patient.last_name}'
+        rows.append((patient.pk, normalize(name) + ' ' + joined_words(name), patient.national_id,
+                     phone_variants(patient.phone_number)))
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, national_id, phone_number) VALUES (%s, %s, %s, %s)', rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0009_change_feed'),
+    ]
+
+    operations = [
+        migrations.RunPython(reindex, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0010_reindex_patient_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(condition=models.Q(('total_due__gt', 0)), fields=['login_at', 'id'], name='patient_debtor_login_idx'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0011_debtor_login_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='change',
+            name='action',
+            field=models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete'), ('archive', 'Archive')], max_length=10),
+        ),
+    ]
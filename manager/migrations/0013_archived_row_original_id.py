@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manager', '0012_change_archive_action'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedmedicine',
+            name='original_id',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedpayment',
+            name='original_id',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+    ]
@@ -1,7 +1,16 @@
-from django.db import models
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import RegexValidator, ValidationError
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.dispatch import Signal
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from . import search
 
 
 class CustomUser(User):
@@ -15,6 +24,145 @@ class CustomUser(User):
         return self.full_name()
 
 
+balances_changed = Signal()
+# Sent with ``floors`` (None for every floor) when beds change through queryset
+# updates, and the ``assigned`` and ``released`` (bed, patient id) pairs if known.
+beds_changed = Signal()
+# Sent with ``patient_ids`` when patients or their beds change through queryset updates.
+patients_changed = Signal()
+
+
+def computed_balances():
+    """Correlated subqueries recomputing a patient's ledger columns from its payments."""
+    payments = Payment.objects.filter(patient=OuterRef('pk')).order_by().values('patient')
+    return {
+        'total_cost': Coalesce(Subquery(payments.annotate(total=Sum('cost')).values('total')), Value(0)),
+        'total_paid': Coalesce(Subquery(payments.annotate(total=Sum('paid')).values('total')), Value(0)),
+        'total_due': Coalesce(Subquery(
+            payments.filter(cost__gt=F('paid')).annotate(total=Sum(F('cost') - F('paid'))).values('total'),
+        ), Value(0)),
+    }
+
+
+def refresh_balances(patient_ids):
+    """Recompute the stored ledger of the given patients from their payment rows."""
+    patient_ids = set(patient_ids)
+    if patient_ids:
+        Patient.objects.filter(pk__in=patient_ids).update(**computed_balances())
+        balances_changed.send(sender=Patient, patient_ids=patient_ids)
+
+
+def change_rows(objs):
+    """(object id, patient id, logged fields) for Payment or Medicine instances."""
+    return [(obj.pk, obj.patient_id, {name: getattr(obj, name) for name in obj.CHANGE_FIELDS}) for obj in objs]
+
+
+_unlogged = ContextVar('unlogged_changes', default=False)
+
+
+@contextmanager
+def unlogged():
+    """Keep the writes made inside the block out of the change feed, e.g. synthetic seed data."""
+    token = _unlogged.set(True)
+    try:
+        yield
+    finally:
+        _unlogged.reset(token)
+
+
+def log_changes(model, action, rows):
+    """Append ``rows`` of (object id, patient id, data) to the change feed."""
+    if _unlogged.get():
+        return
+    Change.objects.bulk_create([
+        Change(model=model._meta.model_name, object_id=object_id, patient_id=patient_id, action=action, data=data)
+        for object_id, patient_id, data in rows
+    ])
+
+
+def release_beds(patient_ids, when=None):
+    """Free the beds of the given patients and close their occupancy intervals."""
+    when = when or timezone.now()
+    with transaction.atomic():
+        released = list(Bed.objects.filter(patient__in=patient_ids).only('floor', 'room', 'bed', 'patient'))
+        BedOccupancy.objects.filter(patient__in=patient_ids, end__isnull=True).update(end=when)
+        Bed.objects.filter(patient__in=patient_ids).update(patient=None)
+    if released:
+        beds_changed.send(sender=Bed, floors=sorted({bed.floor for bed in released}),
+                          released=[(bed, bed.patient_id) for bed in released])
+    patients_changed.send(sender=Patient, patient_ids=patient_ids)
+
+
+class PatientQuerySet(models.QuerySet):
+    def with_outstanding(self):
+        return self.annotate(outstanding=F('total_due'))
+
+    def with_balance_drift(self):
+        """Patients whose stored ledger no longer matches their payment rows."""
+        computed = {f'computed_{name}': expression for name, expression in computed_balances().items()}
+        return self.annotate(**computed).exclude(
+            total_cost=F('computed_total_cost'),
+            total_paid=F('computed_total_paid'),
+            total_due=F('computed_total_due'),
+        )
+
+    def discharge(self):
+        """Discharge every hospitalized patient in the queryset whose payments are settled.
+
+        Returns ``(discharged, rejected)``: the primary keys of discharged patients
+        and a mapping of each patient left in hospital to its outstanding balance.
+        """
+        with transaction.atomic():
+            patients = Patient.objects.filter(
+                pk__in=self.values('pk'), is_hospitalized=True,
+            ).select_for_update().only('national_id', 'first_name', 'last_name').with_outstanding()
+            discharged, rejected = [], {}
+            for patient in patients:
+                if patient.outstanding:
+                    rejected[patient] = patient.outstanding
+                else:
+                    discharged.append(patient.pk)
+            if discharged:
+                now = timezone.now()
+                Patient.objects.filter(pk__in=discharged).update(is_hospitalized=False, discharge_date=now)
+                release_beds(discharged, now)
+        return discharged, rejected
+
+    def release_beds(self, when=None):
+        """Free the beds of every patient in the queryset and close their occupancy intervals."""
+        release_beds(list(self.values_list('pk', flat=True)), when)
+
+    # Bulk writes log the change-feed fields they touch, as Patient.save() does,
+    # and update() keeps the search index in step; bulk_update() goes through it.
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        changes = [obj.unlogged_changes(None) for obj in objs]
+        with transaction.atomic():
+            objs = super().bulk_create(objs, *args, **kwargs)
+            log_changes(Patient, 'create', [(obj.pk, obj.pk, data) for obj, data in zip(objs, changes) if data])
+        for obj, data in zip(objs, changes):
+            obj._logged = data
+        return objs
+
+    def update(self, **kwargs):
+        logged = [name for name in Patient.CHANGE_FIELDS if name in kwargs]
+        indexed = set(search.FIELDS) & set(kwargs)
+        if not logged and not indexed:
+            return super().update(**kwargs)
+        with transaction.atomic():
+            pks = list(self.order_by().values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+            if logged:
+                updated = Patient.objects.filter(pk__in=pks).order_by('pk').values_list('pk', *logged)
+                log_changes(Patient, 'update', [(row[0], row[0], dict(zip(logged, row[1:]))) for row in updated])
+            if indexed:
+                search.index_patients(Patient.objects.filter(pk__in=pks).only(*search.FIELDS))
+        return rows
+
+    update.alters_data = True
+
+
 class Patient(models.Model):
     national_id = models.CharField(
         max_length=10,
@@ -79,15 +227,90 @@ class Patient(models.Model):
     login_at = models.DateTimeField(auto_now_add=True)
     is_hospitalized = models.BooleanField(default=True, verbose_name='Present')
     discharge_date = models.DateTimeField(null=True, blank=True)
+    total_cost = models.BigIntegerField(default=0, editable=False)
+    total_paid = models.BigIntegerField(default=0, editable=False)
+    total_due = models.BigIntegerField(default=0, editable=False)
+
+    objects = PatientQuerySet.as_manager()
+
+    LEDGER_FIELDS = ('total_cost', 'total_paid', 'total_due')
+    # Fields whose changes go to the change feed.
+    CHANGE_FIELDS = ('doctor_order', 'nurse_report')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._logged = {name: instance.__dict__[name] for name in cls.CHANGE_FIELDS if name in instance.__dict__}
+        return instance
+
+    def unlogged_changes(self, update_fields):
+        logged = getattr(self, '_logged', {})
+        deferred = self.get_deferred_fields()
+        return {
+            name: getattr(self, name) for name in self.CHANGE_FIELDS
+            if name not in deferred and (update_fields is None or name in update_fields)
+            and getattr(self, name) != logged.get(name, '' if self._state.adding else None)
+        }
+
+    def save(self, *args, **kwargs):
+        # The ledger columns are only ever written by Payment, so saving a stale
+        # patient instance must not overwrite them.
+        if not self._state.adding and not args and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred and field.name not in self.LEDGER_FIELDS
+            ]
+        changes = self.unlogged_changes(kwargs.get('update_fields'))
+        action = 'create' if self._state.adding else 'update'
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if changes:
+                log_changes(Patient, action, [(self.pk, self.pk, changes)])
+        self._logged = {**getattr(self, '_logged', {}), **changes}
+
+    def outstanding_balance(self):
+        if self.pk is None:
+            return 0
+        return Patient.objects.filter(pk=self.pk).values_list('total_due', flat=True).first() or 0
 
     def clean(self):
         if not self.is_hospitalized:
-            payments = Payment.objects.filter(patient=self)
-            if [payment for payment in payments if not payment.is_paid]:
-                raise ValidationError(_('The payments not made!'))
+            balance = self.outstanding_balance()
+            if balance:
+                raise ValidationError(
+                    _('The payments not made! Outstanding balance: $%(balance)s'),
+                    params={'balance': balance},
+                )
 
     class Meta:
         unique_together = ('is_hospitalized', 'national_id')
+        indexes = [
+            models.Index(fields=['total_due'], condition=models.Q(total_due__gt=0), name='patient_debt_idx'),
+            models.Index(fields=['login_at', 'id'], name='patient_login_idx'),
+            # The debt filter of the patient changelist, in its default order.
+            models.Index(
+                fields=['login_at', 'id'],
+                condition=models.Q(total_due__gt=0),
+                name='patient_debtor_login_idx',
+            ),
+            models.Index(
+                fields=['doctor', 'login_at'],
+                condition=models.Q(is_hospitalized=True),
+                name='patient_present_doctor_idx',
+            ),
+            models.Index(
+                fields=['nurse', 'login_at'],
+                condition=models.Q(is_hospitalized=True),
+                name='patient_present_nurse_idx',
+            ),
+            models.Index(
+                fields=['discharge_date'],
+                condition=models.Q(discharge_date__isnull=False),
+                name='patient_discharged_idx',
+            ),
+            models.Index(fields=['last_name', 'first_name'], name='patient_name_idx'),
+        ]
 
     def __str__(self):
         return f'{self.first_name} {self.last_name}'
@@ -114,30 +337,291 @@ class Bed(models.Model):
         (4, '4'),
     ]
     bed = models.IntegerField(default=1, choices=beds)
-    patient = models.OneToOneField(Patient, models.CASCADE, null=True, blank=True)
+    patient = models.OneToOneField(Patient, models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['floor', 'room', 'bed'],
+                condition=models.Q(patient__isnull=True),
+                name='bed_free_idx',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.floor}{self.room}{self.bed}'
 
 
+class BedOccupancy(models.Model):
+    bed = models.ForeignKey(Bed, models.CASCADE)
+    patient = models.ForeignKey(Patient, models.CASCADE)
+    start = models.DateTimeField()
+    end = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'bed occupancies'
+        indexes = [
+            models.Index(fields=['bed', 'start', 'end'], name='occupancy_bed_range_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.bed}: {self.patient}'
+
+
+class MedicineQuerySet(models.QuerySet):
+    """Logs bulk medicine writes to the change feed, as saving one medicine does.
+
+    bulk_update() is covered by update(), which it calls per batch.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic():
+            objs = super().bulk_create(objs, *args, **kwargs)
+            log_changes(Medicine, 'create', change_rows(objs))
+        return objs
+
+    def update(self, **kwargs):
+        with transaction.atomic():
+            pks = list(self.order_by().values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+            log_changes(Medicine, 'update', change_rows(self.model.objects.filter(pk__in=pks).order_by('pk')))
+        return rows
+
+    update.alters_data = True
+
+
 class Medicine(models.Model):
     patient = models.ForeignKey(Patient, models.CASCADE)
     name = models.CharField(max_length=50)
     order = models.TextField()
 
+    objects = MedicineQuerySet.as_manager()
+
+    CHANGE_FIELDS = ('patient_id', 'name', 'order')
+
+    def save(self, *args, **kwargs):
+        # The change feed entry is written by a post_save receiver and must commit with the row.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
 
+class PaymentQuerySet(models.QuerySet):
+    """Keeps the patients' ledger columns in step with bulk payment writes.
+
+    bulk_update() is covered by update(), which it calls per batch.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic():
+            objs = super().bulk_create(objs, *args, **kwargs)
+            refresh_balances(payment.patient_id for payment in objs)
+            log_changes(Payment, 'create', change_rows(objs))
+        return objs
+
+    def update(self, **kwargs):
+        with transaction.atomic():
+            pks = list(self.order_by().values_list('pk', flat=True))
+            affected = set(self.model.objects.filter(pk__in=pks).values_list('patient_id', flat=True).distinct())
+            rows = super().update(**kwargs)
+            updated = list(self.model.objects.filter(pk__in=pks).order_by('pk'))
+            if {'patient', 'patient_id', 'cost', 'paid'} & set(kwargs):
+                refresh_balances(affected | {payment.patient_id for payment in updated})
+            log_changes(Payment, 'update', change_rows(updated))
+        return rows
+
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic():
+            affected = set(self.order_by().values_list('patient_id', flat=True).distinct())
+            result = super().delete()
+            refresh_balances(affected)
+        return result
+
+    delete.alters_data = True
+
+
 class Payment(models.Model):
     patient = models.ForeignKey(Patient, models.CASCADE)
     title = models.CharField(max_length=50)
     cost = models.BigIntegerField(default=0)
     paid = models.BigIntegerField(default=0)
 
+    objects = PaymentQuerySet.as_manager()
+
+    CHANGE_FIELDS = ('patient_id', 'title', 'cost', 'paid')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient'], condition=models.Q(cost__gt=F('paid')), name='payment_unpaid_idx'),
+        ]
+
+    @property
+    def due(self):
+        return max(self.cost - self.paid, 0)
+
+    @staticmethod
+    def apply_to_ledger(patient_id, cost, paid, due):
+        if cost or paid or due:
+            Patient.objects.filter(pk=patient_id).update(
+                total_cost=F('total_cost') + cost,
+                total_paid=F('total_paid') + paid,
+                total_due=F('total_due') + due,
+            )
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = Payment.objects.filter(pk=self.pk).select_for_update().first()
+            super().save(*args, **kwargs)
+            if previous is not None and previous.patient_id != self.patient_id:
+                self.apply_to_ledger(previous.patient_id, -previous.cost, -previous.paid, -previous.due)
+                previous = None
+            self.apply_to_ledger(
+                self.patient_id,
+                self.cost - (previous.cost if previous else 0),
+                self.paid - (previous.paid if previous else 0),
+                self.due - (previous.due if previous else 0),
+            )
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            self.apply_to_ledger(self.patient_id, -self.cost, -self.paid, -self.due)
+        return result
+
     def clean(self):
         if self.paid > self.cost:
             raise ValidationError(_('Can not pay more than cost!'))
 
     def __str__(self):
         return self.title
+
+
+class ArchivedPatient(models.Model):
+    """A discharged patient moved out of the hot tables by ``manage.py archive_patients``."""
+    original_id = models.BigIntegerField(unique=True)
+    national_id = models.CharField(max_length=10, db_index=True, verbose_name='National ID')
+    first_name = models.CharField(max_length=50)
+    last_name = models.CharField(max_length=50)
+    sickness = models.CharField(max_length=50)
+    watchful_name = models.CharField(max_length=50)
+    age = models.IntegerField(default=0)
+    height = models.IntegerField(default=0, verbose_name='Height (cm)')
+    weight = models.IntegerField(default=0, verbose_name='Weight (kg)')
+    phone_number = models.CharField(max_length=13)
+    insurance_type = models.CharField(max_length=10, choices=Patient.insurances)
+    address = models.CharField(max_length=250)
+    blood_type = models.CharField(max_length=10, choices=Patient.blood_types)
+    doctor_order = models.TextField(blank=True)
+    nurse_report = models.TextField(blank=True)
+    doctor = models.ForeignKey(CustomUser, models.SET_NULL, null=True, blank=True, related_name='+')
+    nurse = models.ForeignKey(CustomUser, models.SET_NULL, null=True, blank=True, related_name='+')
+    login_at = models.DateTimeField()
+    discharge_date = models.DateTimeField(null=True, blank=True)
+    total_cost = models.BigIntegerField(default=0)
+    total_paid = models.BigIntegerField(default=0)
+    total_due = models.BigIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    # Patient fields copied as they are; the ledger is rebuilt from the payments on restore.
+    COPIED_FIELDS = (
+        'national_id', 'first_name', 'last_name', 'sickness', 'watchful_name', 'age', 'height', 'weight',
+        'phone_number', 'insurance_type', 'address', 'blood_type', 'doctor_order', 'nurse_report', 'doctor_id',
+        'nurse_id', 'login_at', 'discharge_date',
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_name', 'first_name'], name='archived_patient_name_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.first_name} {self.last_name}'
+
+
+class ArchivedPayment(models.Model):
+    patient = models.ForeignKey(ArchivedPatient, models.CASCADE)
+    original_id = models.BigIntegerField(null=True, editable=False)
+    title = models.CharField(max_length=50)
+    cost = models.BigIntegerField(default=0)
+    paid = models.BigIntegerField(default=0)
+
+    @property
+    def due(self):
+        return max(self.cost - self.paid, 0)
+
+    def __str__(self):
+        return self.title
+
+
+class ArchivedMedicine(models.Model):
+    patient = models.ForeignKey(ArchivedPatient, models.CASCADE)
+    original_id = models.BigIntegerField(null=True, editable=False)
+    name = models.CharField(max_length=50)
+    order = models.TextField()
+
+    def __str__(self):
+        return self.name
+
+
+class ArchivedBedOccupancy(models.Model):
+    bed = models.ForeignKey(Bed, models.CASCADE)
+    patient = models.ForeignKey(ArchivedPatient, models.CASCADE)
+    start = models.DateTimeField()
+    end = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'archived bed occupancies'
+
+    def __str__(self):
+        return f'{self.bed}: {self.patient}'
+
+
+class Change(models.Model):
+    """An entry of the append-only change feed of clinical and billing rows.
+
+    Entries are written in the transaction of the change, so a consumer that
+    remembers the last ``seq`` it saw can ask for everything after it. SQLite
+    serialises writers, so sequence numbers become visible in order; on servers
+    with concurrent writers a consumer should re-read a short window behind its
+    last ``seq``.
+    """
+    ACTIONS = [
+        ('create', 'Create'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+        # The row moved to the archive tables with its patient.
+        ('archive', 'Archive'),
+    ]
+    seq = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField(null=True)
+    patient_id = models.BigIntegerField(null=True, db_index=True)
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    data = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    MODELS = ('patient', 'medicine', 'payment')
+
+    @classmethod
+    def since(cls, seq, models=MODELS):
+        return cls.objects.filter(seq__gt=seq, model__in=models).order_by('seq')
+
+    def as_dict(self):
+        return {
+            'seq': self.seq,
+            'model': self.model,
+            'id': self.object_id,
+            'patient': self.patient_id,
+            'action': self.action,
+            'data': self.data,
+            'at': self.created_at,
+        }
+
+    def __str__(self):
+        return f'#{self.seq} {self.action} {self.model} {self.object_id}'
@@ -0,0 +1,164 @@
+"""
+Keyset pagination for admin changelists.
+
+Each page continues after the sort key of the last row on the previous page
+(``?cursor=``) instead of using OFFSET, so every page costs one range scan. This
+holds for column sorts too, as the sort key always ends with the primary key.
+The row count is capped at ``count_limit`` rather than taken with a full
+``COUNT(*)``. Orderings that aren't plain columns of the model (related lookups,
+expressions) fall back to Django's numbered pages over the full count.
+"""
+
+import base64
+import json
+
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import F, Q
+
+CURSOR_VAR = 'cursor'
+
+
+def estimated_count(queryset, limit):
+    """Rows in ``queryset``, counting at most ``limit + 1`` of them.
+
+    An unfiltered PostgreSQL table answers from the planner's statistics instead.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return row[0]
+    return queryset.order_by()[:limit + 1].count()
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        raise IncorrectLookupParameters(f'Invalid cursor {token!r}.')
+    if not isinstance(values, list) or any(isinstance(value, (list, dict)) for value in values):
+        raise IncorrectLookupParameters(f'Invalid cursor {token!r}.')
+    return values
+
+
+def seek(ordering, values, nullable=()):
+    """A filter for the rows that sort after ``values`` under ``ordering``.
+
+    NULLs of the fields in ``nullable`` must sort first ascending and last descending.
+    """
+    condition, equal = Q(), Q()
+    for name, value in zip(ordering, values):
+        field, descending = name.lstrip('-'), name.startswith('-')
+        if value is None:
+            after = Q(pk__in=[]) if descending else Q(**{f'{field}__isnull': False})
+            same = Q(**{f'{field}__isnull': True})
+        else:
+            after = Q(**{f'{field}__{"lt" if descending else "gt"}': value})
+            if descending and field in nullable:
+                after |= Q(**{f'{field}__isnull': True})
+            same = Q(**{field: value})
+        condition |= equal & after
+        equal &= same
+    return condition
+
+
+class KeysetChangeList(ChangeList):
+    count_limit = 1000
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR)
+        super().__init__(request, *args, **kwargs)
+        for params in (self.params, getattr(self, 'filter_params', {})):
+            params.pop(CURSOR_VAR, None)
+
+    def get_filters_params(self, params=None):
+        params = super().get_filters_params(params)
+        params.pop(CURSOR_VAR, None)
+        return params
+
+    def keyset_ordering(self, request):
+        """The ordering as (``-``)column names and fields, or ``None`` if it isn't made of model columns."""
+        ordering, seen = [], set()
+        for name in self.get_ordering(request, self.root_queryset):
+            if not isinstance(name, str) or '__' in name:
+                return None
+            try:
+                field = self.lookup_opts.pk if name.lstrip('-') == 'pk' else self.lookup_opts.get_field(name.lstrip('-'))
+            except FieldDoesNotExist:
+                return None
+            if not field.concrete:
+                return None
+            if field.attname not in seen:
+                seen.add(field.attname)
+                ordering.append((('-' if name.startswith('-') else '') + field.attname, field))
+        return ordering
+
+    def keyset_order_by(self):
+        """``self.keyset`` for ``order_by()``, with NULLs placed the way ``seek`` expects."""
+        order_by = []
+        for name, field in self.keyset:
+            if not field.null:
+                order_by.append(name)
+            elif name.startswith('-'):
+                order_by.append(F(field.attname).desc(nulls_last=True))
+            else:
+                order_by.append(F(field.attname).asc(nulls_first=True))
+        return order_by
+
+    def cursor_values(self):
+        values = decode_cursor(self.cursor)
+        if len(values) != len(self.keyset):
+            raise IncorrectLookupParameters(f'Invalid cursor {self.cursor!r}.')
+        try:
+            return [field.to_python(value) for (name, field), value in zip(self.keyset, values)]
+        except Exception:
+            raise IncorrectLookupParameters(f'Invalid cursor {self.cursor!r}.')
+
+    def get_results(self, request):
+        self.keyset = self.keyset_ordering(request)
+        self.next_cursor = None
+        if self.keyset is None:
+            return super().get_results(request)
+
+        queryset = self.queryset.order_by(*self.keyset_order_by())
+        if self.cursor:
+            names = [name for name, field in self.keyset]
+            nullable = {field.attname for name, field in self.keyset if field.null}
+            queryset = queryset.filter(seek(names, self.cursor_values(), nullable))
+        rows = list(queryset[:self.list_per_page + 1])
+        has_next = len(rows) > self.list_per_page
+        rows = rows[:self.list_per_page]
+        if has_next:
+            self.next_cursor = encode_cursor([getattr(rows[-1], field.attname) for name, field in self.keyset])
+
+        count = estimated_count(self.queryset, self.count_limit)
+        self.result_count = min(count, self.count_limit)
+        self.result_count_capped = count > self.count_limit
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = has_next or bool(self.cursor)
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.next_url = self.get_query_string({CURSOR_VAR: self.next_cursor}) if has_next else None
+        self.first_url = self.get_query_string(remove=[CURSOR_VAR])
+
+
+class KeysetPaginationMixin:
+    """Keyset pages for a ModelAdmin; see ``KeysetChangeList``."""
+    change_list_template = 'admin/keyset_change_list.html'
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
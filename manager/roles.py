@@ -0,0 +1,35 @@
+from hospital import caching
+
+DOCTORS = 'Doctors'
+NURSES = 'Nurses'
+MANAGERS = 'Managers'
+SUPERUSER = 'superuser'
+
+ROLES = (SUPERUSER, DOCTORS, NURSES, MANAGERS, None)
+
+# Patient columns a role may not see anywhere: admin forms, search, exports and the API.
+HIDDEN_PATIENT_FIELDS = {
+    DOCTORS: ['national_id', 'phone_number', 'address'],
+    NURSES: ['national_id', 'phone_number', 'address'],
+}
+
+
+def user_groups(request):
+    """The names of the requesting user's groups, cached until their memberships change."""
+    if not hasattr(request, '_user_groups'):
+        user = request.user
+        request._user_groups = caching.get('user_groups', [caching.USERS, caching.user(user.pk)],
+                                           lambda: frozenset(user.groups.values_list('name', flat=True)))
+    return request._user_groups
+
+
+def get_role(request):
+    """The requesting user's role; doctors take precedence over nurses, nurses over managers."""
+    if not hasattr(request, '_role'):
+        if request.user.is_superuser:
+            role = SUPERUSER
+        else:
+            groups = user_groups(request)
+            role = next((group for group in (DOCTORS, NURSES, MANAGERS) if group in groups), None)
+        request._role = role
+    return request._role
@@ -0,0 +1,139 @@
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'manager_patient_fts'
+COLUMNS = ('name', 'national_id', 'phone_number')
+# Patient fields the index is built from.
+FIELDS = ('first_name', 'last_name', 'national_id', 'phone_number')
+ZWNJ = '\u200c'
+
+_CHARACTERS = str.maketrans({
+    'ي': 'ی',
+    'ى': 'ی',
+    'ئ': 'ی',
+    'ك': 'ک',
+    'ة': 'ه',
+    'ۀ': 'ه',
+    'أ': 'ا',
+    'إ': 'ا',
+    'آ': 'ا',
+    'ؤ': 'و',
+    ZWNJ: ' ',
+    '‍': '',  # zero-width joiner
+    'ـ': '',  # tatweel
+    **{chr(0x06F0 + i): str(i) for i in range(10)},  # Persian digits
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # Arabic digits
+})
+_DIACRITICS = re.compile('[ً-ٰٟ]')
+_TOKEN = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Fold Arabic letter forms, ZWNJ variants and non-ASCII digits to one spelling."""
+    return _DIACRITICS.sub('', (text or '').translate(_CHARACTERS)).lower()
+
+
+def tokens(text):
+    return _TOKEN.findall(normalize(text))
+
+
+def joined_words(text):
+    """The ZWNJ-split words of ``text`` written together, so علیرضا also finds علی‌رضا."""
+    return ' '.join(normalize(word.replace(ZWNJ, '')) for word in (text or '').split() if ZWNJ in word)
+
+
+def phone_variants(phone_number):
+    digits = ''.join(tokens(phone_number))
+    if digits.startswith('98') and len(digits) == 12:
+        return f'{digits} 0{digits[2:]} {digits[2:]}'
+    return digits
+
+
+def is_available():
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    cached = getattr(connection, '_patient_fts', None)
+    if cached is None or cached[0] != name:
+        cached = connection._patient_fts = (name, FTS_TABLE in connection.introspection.table_names())
+    return cached[1]
+
+
+def create_table(schema_editor):
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"name, national_id, phone_number, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+
+
+def index_rows(cursor, patients):
+    """Write ``patients`` (objects with name, national ID and phone fields) into the index."""
+    rows = [
+        (patient.pk, normalize(f'{patient.first_name} {patient.last_name}') + ' ' +
+         joined_words(f'{patient.first_name} {patient.last_name}'),
+         patient.national_id, phone_variants(patient.phone_number))
+        for patient in patients
+    ]
+    cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+    cursor.executemany(
+        f'INSERT INTO {FTS_TABLE} (rowid, name, national_id, phone_number) VALUES (%s, %s, %s, %s)', rows)
+
+
+def index_patients(patients):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        index_rows(cursor, patients)
+
+
+def unindex_patients(pks):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in pks])
+
+
+def rebuild(queryset, batch_size=2000):
+    if not is_available():
+        return 0
+    count = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        batch = []
+        for patient in queryset.only(*FIELDS).iterator(batch_size):
+            batch.append(patient)
+            if len(batch) == batch_size:
+                index_rows(cursor, batch)
+                count += len(batch)
+                batch = []
+        index_rows(cursor, batch)
+        count += len(batch)
+    return count
+
+
+def match_query(search_term, columns=COLUMNS):
+    clauses = []
+    for word in (search_term or '').split():
+        terms = tokens(word)
+        if not terms:
+            continue
+        clause = ' AND '.join(f'"{term}"*' for term in terms)
+        if ZWNJ in word and len(terms) > 1:
+            clause = f'({clause}) OR "{"".join(terms)}"*'
+        clauses.append(f'({clause})' if len(terms) > 1 else clause)
+    if not clauses:
+        return ''
+    query = ' AND '.join(clauses)
+    if tuple(columns) != COLUMNS:
+        query = '{%s} : (%s)' % (' '.join(columns), query)
+    return query
+
+
+def filter_queryset(queryset, search_term, columns=COLUMNS):
+    """Restrict ``queryset`` to patients matching ``search_term`` in ``columns``, or ``None`` if FTS is unavailable."""
+    query = match_query(search_term, columns)
+    if not query or not is_available():
+        return None
+    return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [query]))
@@ -0,0 +1,164 @@
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from hospital import caching
+from . import archive, search
+from .events import bed_events
+from .models import (Bed, BedOccupancy, Medicine, Patient, Payment, balances_changed, beds_changed, change_rows,
+                     log_changes, patients_changed)
+
+
+@receiver([post_save, post_delete], sender=Payment)
+@receiver([post_save, post_delete], sender=Medicine)
+def invalidate_patient_rows(sender, instance, **kwargs):
+    if archive.moving.get():
+        return
+    caching.bump(caching.patient(instance.patient_id))
+
+
+@receiver(balances_changed, sender=Patient)
+@receiver(patients_changed, sender=Patient)
+def invalidate_patients(sender, patient_ids, **kwargs):
+    caching.bump(*(caching.patient(patient_id) for patient_id in patient_ids))
+
+
+@receiver(post_save, sender=Patient)
+def invalidate_patient(sender, instance, **kwargs):
+    caching.bump(caching.patient(instance.pk))
+
+
+@receiver(post_delete, sender=Patient)
+def invalidate_deleted_patient(sender, instance, **kwargs):
+    if archive.moving.get():
+        return
+    # Deleting a patient frees their bed with a plain UPDATE.
+    caching.bump(caching.patient(instance.pk), caching.WARDS)
+
+
+@receiver(post_save, sender=Bed)
+@receiver(post_delete, sender=Bed)
+def invalidate_ward(sender, instance, **kwargs):
+    scopes = {caching.ward(instance.floor), caching.OCCUPANCY}
+    previous_floor = getattr(instance, '_previous_floor', None)
+    if previous_floor is not None:
+        scopes.add(caching.ward(previous_floor))
+    for patient_id in (instance.patient_id, getattr(instance, '_previous_patient_id', None)):
+        if patient_id is not None:
+            scopes.add(caching.patient(patient_id))
+    caching.bump(*scopes)
+
+
+def bed_event(bed, patient_id):
+    return {'bed': bed.pk, 'floor': bed.floor, 'room': bed.room, 'number': bed.bed, 'patient': patient_id}
+
+
+@receiver(post_save, sender=Bed)
+def publish_bed_assignment(sender, instance, raw=False, **kwargs):
+    previous = getattr(instance, '_previous_patient_id', None)
+    if raw or previous == instance.patient_id:
+        return
+    events = []
+    if previous is not None:
+        events.append(('released', bed_event(instance, previous)))
+    if instance.patient_id is not None:
+        events.append(('assigned', bed_event(instance, instance.patient_id)))
+    transaction.on_commit(lambda: [bed_events.publish(kind, data) for kind, data in events])
+
+
+@receiver(post_delete, sender=Bed)
+def publish_bed_removal(sender, instance, **kwargs):
+    data = bed_event(instance, instance.patient_id)
+    transaction.on_commit(lambda: bed_events.publish('removed', data))
+
+
+@receiver(beds_changed, sender=Bed)
+def publish_beds_changed(sender, floors, assigned=(), released=(), **kwargs):
+    events = [('released', bed_event(bed, patient_id)) for bed, patient_id in released]
+    events += [('assigned', bed_event(bed, patient_id)) for bed, patient_id in assigned]
+    if not events:
+        events = [('changed', {'floors': floors})]
+    transaction.on_commit(lambda: [bed_events.publish(kind, data) for kind, data in events])
+
+
+@receiver(pre_delete, sender=Patient)
+def publish_freed_bed(sender, instance, **kwargs):
+    if archive.moving.get():
+        return  # Archived patients have no bed.
+    # Deleting the patient frees their bed with a plain UPDATE, which sends no Bed signals.
+    bed = Bed.objects.filter(patient=instance).first()
+    if bed is not None:
+        data = bed_event(bed, instance.pk)
+        transaction.on_commit(lambda: bed_events.publish('released', data))
+
+
+@receiver(beds_changed, sender=Bed)
+def invalidate_wards(sender, floors, **kwargs):
+    if floors is None:
+        caching.bump(caching.WARDS)
+    else:
+        caching.bump(caching.OCCUPANCY, *(caching.ward(floor) for floor in floors))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_user_groups(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        caching.bump(caching.user(instance.pk))
+    elif pk_set is None:
+        caching.bump(caching.USERS)
+    else:
+        caching.bump(*(caching.user(pk) for pk in pk_set))
+
+
+@receiver([post_save, post_delete], sender=Group)
+def invalidate_group_names(sender, **kwargs):
+    caching.bump(caching.USERS)
+
+
+@receiver(post_save, sender=Patient)
+def index_patient(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_patients([instance])
+
+
+@receiver(post_delete, sender=Patient)
+def unindex_patient(sender, instance, **kwargs):
+    if not archive.moving.get():
+        search.unindex_patients([instance.pk])
+
+
+@receiver(pre_save, sender=Bed)
+def remember_bed_patient(sender, instance, **kwargs):
+    previous = Bed.objects.filter(pk=instance.pk).values_list('patient_id', 'floor').first() if instance.pk else None
+    instance._previous_patient_id, instance._previous_floor = previous or (None, None)
+
+
+@receiver(post_save, sender=Bed)
+def record_bed_occupancy(sender, instance, raw=False, **kwargs):
+    previous = getattr(instance, '_previous_patient_id', None)
+    if raw or previous == instance.patient_id:
+        return
+    now = timezone.now()
+    if previous is not None:
+        BedOccupancy.objects.filter(bed=instance, end__isnull=True).update(end=now)
+    if instance.patient_id is not None:
+        BedOccupancy.objects.create(bed=instance, patient_id=instance.patient_id, start=now)
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_save, sender=Medicine)
+def log_saved_row(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        log_changes(sender, 'create' if created else 'update', change_rows([instance]))
+
+
+@receiver(post_delete, sender=Payment)
+@receiver(post_delete, sender=Medicine)
+def log_deleted_row(sender, instance, **kwargs):
+    # Also covers queryset deletes and the cascade from a deleted patient, but
+    # not archiving, which logs the moved rows as 'archive' entries instead.
+    if not archive.moving.get():
+        log_changes(sender, 'delete', change_rows([instance]))
@@ -1,5 +1,46 @@
-from django.test import TestCase
-from .models import CustomUser, Patient, Bed, Medicine, Payment
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime, timedelta, timezone as dt_timezone
+import gc
+from io import StringIO
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import weakref
+from pathlib import Path
+from unittest import mock, skipUnless
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.admin import site
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.core.servers.basehttp import WSGIServer
+from django.db import connection, connections
+from django.db.utils import load_backend
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import LiveServerTestCase, RequestFactory, TestCase, override_settings
+from django.test.testcases import LiveServerThread, QuietWSGIRequestHandler
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from hospital import caching, routers
+from hospital.caches import cache_settings
+from hospital.database import database_settings, replica_settings
+from hospital.middleware import RequestTimingMiddleware
+from hospital.routers import ReplicaRouter, reading_from_replica
+from . import archive, beds, loadtest, models, roles, search
+from .management.commands import benchmark
+from .management.commands.refresh_replica import snapshot
+from .events import Broker, bed_events
+from .pagination import KeysetChangeList, encode_cursor
+from .models import (CustomUser, Patient, Bed, BedOccupancy, Medicine, Payment, ArchivedPatient, ArchivedPayment,
+                     ArchivedMedicine, Change, beds_changed)
 
 
 class CustomUserModelTest(TestCase):
@@ -186,8 +227,1522 @@ class PaymentModelTest(PatientTest):
             patient=self.patient,
             title='Hospital fee',
             cost=500000,
-            is_paid=False,
+            paid=0,
         )
 
     def test_str(self):
         self.assertEqual(str(self.payment), 'Hospital fee')
+
+
+class PatientAdminChangelistTest(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.user)
+        self.add_patients(1)
+
+    def add_patients(self, count):
+        start = Patient.objects.count()
+        for i in range(start, start + count):
+            patient = Patient.objects.create(
+                national_id=f'{i:010d}',
+                first_name='John',
+                last_name=f'Doe {i}',
+                sickness='Fever',
+                watchful_name='Jane',
+                blood_type='0',
+                doctor=self.user,
+                nurse=self.user,
+            )
+            Bed.objects.create(floor=1, room=1 + i % 4, bed=1 + i // 4 % 4, patient=patient)
+            Payment.objects.create(patient=patient, title='Bed', cost=300, paid=100)
+            Payment.objects.create(patient=patient, title='Visit', cost=50, paid=50)
+
+    def changelist_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('admin:manager_patient_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(context)
+
+    def test_totals(self):
+        response, _ = self.changelist_queries()
+        self.assertContains(response, '$200')
+        self.assertContains(response, '$150')
+
+    def test_constant_query_count(self):
+        _, single = self.changelist_queries()
+        self.add_patients(10)
+        _, many = self.changelist_queries()
+        self.assertEqual(single, many)
+
+
+class InvoiceViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.patient = Patient.objects.create(
+            national_id='0012345678',
+            first_name='John',
+            last_name='Doe',
+            sickness='Fever',
+            watchful_name='Jane',
+            blood_type='0',
+        )
+        self.url = reverse('invoice', args=[self.patient.national_id])
+        self.client.force_login(CustomUser.objects.create_superuser('admin', password='password'))
+
+    def test_no_payments(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'No payments.')
+
+    def test_requires_payment_view_permission(self):
+        clerk = CustomUser.objects.create_user('clerk', password='password', is_staff=True)
+        self.client.force_login(clerk)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        clerk.user_permissions.add(Permission.objects.get(codename='view_payment'))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_unknown_patient(self):
+        self.assertEqual(self.client.get(reverse('invoice', args=['9999999999'])).status_code, 404)
+
+    def test_totals_and_query_count(self):
+        for i in range(20):
+            Payment.objects.create(patient=self.patient, title=f'Fee {i}', cost=100, paid=40)
+        # session and user, then the patient and its payments
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertContains(response, '$800')
+        self.assertContains(response, '$1200')
+
+    def test_cached_until_payment_changes(self):
+        payment = Payment.objects.create(patient=self.patient, title='Fee', cost=100, paid=0)
+        self.client.get(self.url)
+        # session, user and patient
+        with self.assertNumQueries(3):
+            self.client.get(self.url)
+        payment.paid = 100
+        payment.save()
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Unpaid: <b style="color: red">$0</b>')
+
+
+class DischargeValidationTest(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(
+            national_id='1234567890',
+            first_name='John',
+            last_name='Doe',
+            sickness='Fever',
+            watchful_name='Jane',
+            blood_type='0',
+        )
+        for i in range(50):
+            Payment.objects.create(patient=self.patient, title=f'Fee {i}', cost=100, paid=100 if i % 2 else 70)
+
+    def test_outstanding_balance(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.patient.outstanding_balance(), 750)
+        self.assertEqual(Patient.objects.with_outstanding().get().outstanding, 750)
+
+    def test_clean_rejects_unpaid_discharge(self):
+        self.patient.is_hospitalized = False
+        with self.assertRaisesMessage(ValidationError, '$750'):
+            self.patient.clean()
+
+    def test_clean_allows_paid_discharge(self):
+        Payment.objects.filter(patient=self.patient).update(paid=F('cost'))
+        self.patient.is_hospitalized = False
+        self.patient.clean()
+        self.assertEqual(Patient.objects.with_outstanding().get().outstanding, 0)
+
+
+class BulkDischargeTest(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.user)
+        self.patients = []
+        for i in range(6):
+            patient = Patient.objects.create(
+                national_id=f'{i:010d}',
+                first_name='John',
+                last_name=f'Doe {i}',
+                sickness='Fever',
+                watchful_name='Jane',
+                blood_type='0',
+            )
+            Bed.objects.create(floor=1, room=1, bed=1 + i % 4, patient=patient)
+            Payment.objects.create(patient=patient, title='Bed', cost=100, paid=100 if i % 2 else 40)
+            self.patients.append(patient)
+
+    def test_discharge_queryset(self):
+        # validation select, patient update, released beds select, occupancy/bed updates and their savepoints
+        with self.assertNumQueries(9):
+            discharged, rejected = Patient.objects.all().discharge()
+        self.assertEqual(sorted(discharged), [p.pk for p in self.patients[1::2]])
+        self.assertEqual(set(rejected.values()), {60})
+        self.assertEqual(Patient.objects.filter(is_hospitalized=False, discharge_date__isnull=False).count(), 3)
+        self.assertEqual(Bed.objects.count(), 6)
+        self.assertEqual(Bed.objects.filter(patient__isnull=True).count(), 3)
+
+    def test_invalidates_each_patient_once_and_only_their_floors(self):
+        Bed.objects.create(floor=2, room=1, bed=1)
+        sent = []
+
+        def receiver(sender, floors, **kwargs):
+            sent.append(floors)
+
+        beds_changed.connect(receiver, sender=Bed)
+        self.addCleanup(beds_changed.disconnect, receiver, sender=Bed)
+        with mock.patch.object(caching, 'bump', wraps=caching.bump) as bump:
+            discharged, _ = Patient.objects.all().discharge()
+        self.assertEqual(sent, [[1]])
+        bumped = [scope for call in bump.call_args_list for scope in call.args if scope[0] == 'patient']
+        self.assertEqual(sorted(bumped), [caching.patient(pk) for pk in sorted(discharged)])
+
+    def test_admin_action(self):
+        response = self.client.post(reverse('admin:manager_patient_changelist'), {
+            'action': 'discharge_patients',
+            '_selected_action': [p.pk for p in self.patients],
+        }, follow=True)
+        self.assertContains(response, '3 patient(s) discharged.')
+        self.assertContains(response, 'outstanding balance $60', count=3)
+
+    def test_admin_action_is_limited_to_managers(self):
+        group = Group.objects.create(name=roles.DOCTORS)
+        group.permissions.set(Permission.objects.filter(codename__in=['view_patient', 'change_patient']))
+        doctor = CustomUser.objects.create_user('doctor', password='password', is_staff=True)
+        doctor.groups.add(group)
+        self.client.force_login(doctor)
+        response = self.client.get(reverse('admin:manager_patient_changelist'))
+        self.assertNotContains(response, 'discharge_patients')
+        self.assertNotContains(response, 'allocate_beds')
+        self.client.post(reverse('admin:manager_patient_changelist'), {
+            'action': 'discharge_patients',
+            '_selected_action': [p.pk for p in self.patients],
+        })
+        self.assertEqual(Patient.objects.filter(is_hospitalized=False).count(), 0)
+
+
+class BedAllocationTest(TestCase):
+    def setUp(self):
+        for floor in (0, 1):
+            for bed in (2, 1):
+                Bed.objects.create(floor=floor, room=1, bed=bed)
+        self.patients = [
+            Patient.objects.create(
+                national_id=f'{i:010d}',
+                first_name='John',
+                last_name=f'Doe {i}',
+                sickness='Fever',
+                watchful_name='Jane',
+                blood_type='0',
+            ) for i in range(3)
+        ]
+
+    def test_first_free_bed(self):
+        self.assertEqual(str(beds.first_free_bed(beds.ICU)), '011')
+        self.assertEqual(str(beds.first_free_bed(1)), '111')
+        self.assertIsNone(beds.first_free_bed(2))
+
+    def test_allocate_bed(self):
+        first = beds.allocate_bed(self.patients[0], beds.ICU)
+        second = beds.allocate_bed(self.patients[1], beds.ICU)
+        self.assertEqual((str(first), str(second)), ('011', '012'))
+        self.assertEqual(beds.allocate_bed(self.patients[0]), first)
+        self.assertIsNone(beds.allocate_bed(self.patients[2], beds.ICU))
+        self.assertEqual(str(beds.allocate_bed(self.patients[2])), '111')
+
+    def test_discharged_patient_gets_no_bed(self):
+        Patient.objects.filter(pk=self.patients[0].pk).update(is_hospitalized=False)
+        self.patients[0].refresh_from_db()
+        with self.assertRaises(ValidationError):
+            beds.allocate_bed(self.patients[0])
+        self.assertFalse(Bed.objects.filter(patient__isnull=False).exists())
+
+    def test_claim_and_occupancy_are_one_transaction(self):
+        with mock.patch.object(BedOccupancy.objects, 'create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                beds.allocate_bed(self.patients[0])
+        self.assertFalse(Bed.objects.filter(patient__isnull=False).exists())
+
+    def test_concurrent_allocation_returns_the_held_bed(self):
+        # Another call claimed a bed for the patient after this one found none.
+        held = beds.allocate_bed(self.patients[0], 1)
+        with mock.patch.object(beds, 'current_bed', side_effect=[None, held]):
+            self.assertEqual(beds.allocate_bed(self.patients[0], beds.ICU), held)
+        self.assertEqual(Bed.objects.get(patient=self.patients[0]), held)
+        self.assertEqual(BedOccupancy.objects.filter(patient=self.patients[0]).count(), 1)
+
+    def test_occupancy_by_floor(self):
+        beds.allocate_bed(self.patients[0], 1)
+        with self.assertNumQueries(1):
+            occupancy = beds.occupancy_by_floor()
+        self.assertEqual(occupancy, [
+            {'floor': 0, 'total': 2, 'occupied': 0, 'free': 2},
+            {'floor': 1, 'total': 2, 'occupied': 1, 'free': 1},
+        ])
+
+
+class BedOccupancyTest(TestCase):
+    def setUp(self):
+        self.bed = Bed.objects.create(floor=2, room=1, bed=3)
+        Bed.objects.create(floor=2, room=1, bed=4)
+        self.patient = Patient.objects.create(
+            national_id='1234567890',
+            first_name='John',
+            last_name='Doe',
+            sickness='Fever',
+            watchful_name='Jane',
+            blood_type='0',
+        )
+
+    def test_discharge_releases_bed(self):
+        beds.allocate_bed(self.patient, 2)
+        Patient.objects.all().discharge()
+        self.bed.refresh_from_db()
+        self.assertIsNone(self.bed.patient)
+        occupancy = BedOccupancy.objects.get()
+        self.assertEqual((occupancy.bed, occupancy.patient), (self.bed, self.patient))
+        self.assertIsNotNone(occupancy.end)
+
+    def test_manual_assignment_is_recorded(self):
+        self.bed.patient = self.patient
+        self.bed.save()
+        self.bed.patient = None
+        self.bed.save()
+        self.assertEqual(BedOccupancy.objects.filter(end__isnull=False).count(), 1)
+
+    def test_reports(self):
+        start = datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+        BedOccupancy.objects.create(bed=self.bed, patient=self.patient, start=start, end=start + timedelta(days=2))
+        self.assertEqual(beds.occupant(2, 1, 3, start + timedelta(days=1)), self.patient)
+        self.assertIsNone(beds.occupant(2, 1, 3, start + timedelta(days=3)))
+        self.assertEqual(beds.average_stay(start, start + timedelta(days=10)), timedelta(days=2))
+        self.assertAlmostEqual(beds.utilisation(start + timedelta(days=1), start + timedelta(days=3)), 0.25)
+
+
+class BedPatientPickerTest(TestCase):
+    def setUp(self):
+        self.client.force_login(CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.bed = Bed.objects.create(floor=1, room=1, bed=1)
+        self.patients = [
+            Patient.objects.create(
+                national_id=f'{i:010d}',
+                first_name='John',
+                last_name=f'Doe {i}',
+                sickness='Fever',
+                watchful_name='Jane',
+                blood_type='0',
+                is_hospitalized=i != 1,
+            ) for i in range(3)
+        ]
+        Bed.objects.create(floor=1, room=1, bed=2, patient=self.patients[2])
+
+    def test_autocomplete_only_offers_unbedded_hospitalized(self):
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'manager', 'model_name': 'bed', 'field_name': 'patient', 'term': 'Doe',
+        })
+        self.assertEqual([int(r['id']) for r in response.json()['results']], [self.patients[0].pk])
+
+    def test_change_form_does_not_list_patients(self):
+        response = self.client.get(reverse('admin:manager_bed_change', args=[self.bed.pk]))
+        self.assertNotContains(response, 'Doe 0')
+
+    def test_assign_patient(self):
+        response = self.client.post(reverse('admin:manager_bed_change', args=[self.bed.pk]), {
+            'floor': 1, 'room': 1, 'bed': 1, 'patient': self.patients[0].pk,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.bed.refresh_from_db()
+        self.assertEqual(self.bed.patient, self.patients[0])
+
+
+class PatientSearchTest(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(
+            national_id='0012345678',
+            first_name='علی‌رضا',
+            last_name='کریمی',
+            sickness='Fever',
+            watchful_name='Jane',
+            blood_type='0',
+            phone_number='+989121234567',
+        )
+        Patient.objects.create(
+            national_id='9876543210',
+            first_name='John',
+            last_name='Doe',
+            sickness='Fever',
+            watchful_name='Jane',
+            blood_type='0',
+        )
+
+    def search(self, term):
+        return list(search.filter_queryset(Patient.objects.all(), term))
+
+    def test_normalize(self):
+        self.assertEqual(search.normalize('علي‌رضا كريمي ۱۲'), 'علی رضا کریمی 12')
+
+    def test_queryset_update_reindexes(self):
+        Patient.objects.filter(pk=self.patient.pk).update(last_name='Smith', phone_number='09351112222')
+        self.assertEqual(self.search('Smith'), [self.patient])
+        self.assertEqual(self.search('09351112222'), [self.patient])
+        self.assertEqual(self.search('کریمی'), [])
+
+    def test_arabic_letters_and_zwnj(self):
+        self.assertEqual(self.search('كريمي'), [self.patient])
+        self.assertEqual(self.search('علي رضا'), [self.patient])
+        self.assertEqual(self.search('علیرضا'), [self.patient])
+        self.assertEqual(self.search('علي‌رضا كريمي'), [self.patient])
+        self.patient.first_name = 'علیرضا'
+        self.patient.save()
+        self.assertEqual(self.search('علی‌رضا'), [self.patient])
+
+    def test_national_id_and_phone(self):
+        self.assertEqual(self.search('۰۰۱۲۳'), [self.patient])
+        self.assertEqual(self.search('09121234'), [self.patient])
+
+    def test_index_follows_updates(self):
+        self.patient.last_name = 'Smith'
+        self.patient.save()
+        self.assertEqual(self.search('کریمی'), [])
+        self.patient.delete()
+        self.assertEqual(self.search('Smith'), [])
+
+    def test_rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.FTS_TABLE}')
+        call_command('rebuild_patient_search', stdout=StringIO())
+        self.assertEqual(self.search('کریمی'), [self.patient])
+
+    def test_hidden_columns_are_not_searched(self):
+        self.assertEqual(list(search.filter_queryset(Patient.objects.all(), '0012345678', ['name'])), [])
+        group = Group.objects.create(name=roles.NURSES)
+        group.permissions.set(Permission.objects.filter(codename='view_patient'))
+        nurse = CustomUser.objects.create_user('nurse', password='password', is_staff=True)
+        nurse.groups.add(group)
+        self.client.force_login(nurse)
+        response = self.client.get(reverse('admin:manager_patient_changelist'), {'q': '09121234'})
+        self.assertNotContains(response, 'کریمی')
+        response = self.client.get(reverse('admin:manager_patient_changelist'), {'q': 'کریمی'})
+        self.assertContains(response, 'کریمی')
+
+    def test_admin_search(self):
+        self.client.force_login(CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get(reverse('admin:manager_patient_changelist'), {'q': 'كريمي'})
+        self.assertContains(response, 'علی‌رضا')
+        self.assertNotContains(response, 'John Doe')
+
+
+class RoleLayoutTest(TestCase):
+    def setUp(self):
+        permissions = Permission.objects.filter(codename__in=['view_patient', 'change_patient'])
+        self.users = {}
+        for name in (roles.DOCTORS, roles.NURSES, roles.MANAGERS):
+            group = Group.objects.create(name=name)
+            group.permissions.set(permissions)
+            user = CustomUser.objects.create_user(name.lower(), password='password', is_staff=True)
+            user.groups.add(group)
+            self.users[name] = user
+        self.patient = Patient.objects.create(
+            national_id='1234567890',
+            first_name='John',
+            last_name='Doe',
+            sickness='Fever',
+            watchful_name='Jane',
+            blood_type='0',
+            doctor=self.users[roles.DOCTORS],
+        )
+        self.factory = RequestFactory()
+        self.model_admin = site._registry[Patient]
+
+    def request(self, user):
+        request = self.factory.get('/')
+        request.user = user
+        return request
+
+    def test_cached_form_does_not_keep_the_request(self):
+        self.model_admin.role_forms.clear()
+        request = self.request(self.users[roles.MANAGERS])
+        form = self.model_admin.get_form(request, self.patient, change=True)
+        request = weakref.ref(request)
+        gc.collect()
+        self.assertIsNone(request())
+        self.assertIn('first_name', form.base_fields)
+
+    def test_role_resolved_once_per_request(self):
+        request = self.request(self.users[roles.DOCTORS])
+        with self.assertNumQueries(1):
+            self.assertEqual(roles.get_role(request), roles.DOCTORS)
+            self.model_admin.get_list_display(request)
+            self.model_admin.get_fields(request, self.patient)
+            self.model_admin.get_readonly_fields(request, self.patient)
+
+    def test_layouts(self):
+        doctor = self.request(self.users[roles.DOCTORS])
+        self.assertNotIn('national_id', self.model_admin.get_fields(doctor, self.patient))
+        self.assertNotIn('debt', self.model_admin.get_list_display(doctor))
+        self.assertNotIn('doctor_order', self.model_admin.get_readonly_fields(doctor, self.patient))
+        nurse = self.request(self.users[roles.NURSES])
+        self.assertEqual(self.model_admin.get_readonly_fields(nurse, self.patient),
+                         self.model_admin.get_fields(nurse, self.patient))
+        manager = self.request(self.users[roles.MANAGERS])
+        self.assertIn('national_id', self.model_admin.get_fields(manager, self.patient))
+        self.assertNotIn('first_name', self.model_admin.get_readonly_fields(manager, self.patient))
+
+    def test_debt_filter_follows_ledger_visibility(self):
+        doctor = self.request(self.users[roles.DOCTORS])
+        self.assertEqual(self.model_admin.get_list_filter(doctor), ())
+        manager = self.request(self.users[roles.MANAGERS])
+        self.assertEqual(self.model_admin.get_list_filter(manager), self.model_admin.list_filter)
+        self.client.force_login(self.users[roles.NURSES])
+        response = self.client.get(reverse('admin:manager_patient_changelist'), {'has_debt': '1'})
+        self.assertRedirects(response, reverse('admin:manager_patient_changelist') + '?e=1',
+                             fetch_redirect_response=False)
+
+    def test_forms_are_shared_per_role(self):
+        doctor = self.request(self.users[roles.DOCTORS])
+        form = self.model_admin.get_form(doctor, self.patient, change=True)
+        self.assertIs(self.model_admin.get_form(self.request(self.users[roles.DOCTORS]), self.patient, change=True),
+                      form)
+        self.assertNotIn('national_id', form.base_fields)
+        self.assertIn('doctor_order', form.base_fields)
+
+    def test_doctor_request_does_not_leak_into_manager_layout(self):
+        self.client.force_login(self.users[roles.DOCTORS])
+        response = self.client.get(reverse('admin:manager_patient_change', args=[self.patient.pk]))
+        self.assertNotContains(response, 'name="phone_number"')
+        self.client.force_login(self.users[roles.MANAGERS])
+        response = self.client.get(reverse('admin:manager_patient_change', args=[self.patient.pk]))
+        self.assertContains(response, 'name="phone_number"')
+
+    def test_discharged_patient_form_is_not_reused(self):
+        self.model_admin.role_forms.clear()
+        discharged = Patient.objects.create(national_id='1234567891', first_name='Jane', last_name='Doe',
+                                            sickness='Flu', watchful_name='John', blood_type='0',
+                                            doctor=self.users[roles.DOCTORS], is_hospitalized=False)
+        self.client.force_login(self.users[roles.DOCTORS])
+        response = self.client.get(reverse('admin:manager_patient_change', args=[discharged.pk]))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('admin:manager_patient_change', args=[self.patient.pk]))
+        self.assertContains(response, 'name="sickness"')
+
+    def test_concurrent_layouts(self):
+        requests = [self.request(self.users[name]) for name in (roles.DOCTORS, roles.MANAGERS) * 20]
+        for request in requests:
+            roles.get_role(request)
+
+        def layout(request):
+            return 'national_id' in self.model_admin.get_fields(request, self.patient)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(layout, requests))
+        self.assertEqual(results, [False, True] * 20)
+
+
+class ImportPatientsTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        Patient.objects.create(
+            national_id='1111111111',
+            first_name='John',
+            last_name='Doe',
+            sickness='Fever',
+            watchful_name='Jane',
+            blood_type='0',
+        )
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def test_csv(self):
+        path = self.write('transfer.csv', (
+            'national_id,first_name,last_name,sickness,watchful_name,address,blood_type,phone_number,age\n'
+            '0000000001,Ali,Karimi,Flu,Reza,Tabriz,A+,+989121111111,40\n'
+            '0000000002,Sara,Ahmadi,Flu,Reza,Tabriz,O-,,x\n'
+            '1111111111,Dup,Licate,Flu,Reza,Tabriz,0,,\n'
+            '0000000001,Ali,Again,Flu,Reza,Tabriz,0,,\n'
+            '12345,Bad,Id,Flu,Reza,Tabriz,0,,\n'
+            '0000000003,Mina,Rahimi,Flu,Reza,Tabriz,5,09121111111,\n'
+            '0000000004,Nima,Rahimi,Flu,Reza,Tabriz,B+,,\n'
+        ))
+        call_command('import_patients', path, batch_size=2, stdout=StringIO())
+        self.assertEqual(
+            sorted(Patient.objects.exclude(national_id='1111111111').values_list('national_id', 'blood_type')),
+            [('0000000001', '0'), ('0000000004', '2')],
+        )
+        with open(f'{path}.rejects.jsonl', encoding='utf-8') as file:
+            rejects = [json.loads(line) for line in file]
+        self.assertEqual([reject['line'] for reject in rejects], [3, 4, 5, 6, 7])
+        self.assertEqual(list(search.filter_queryset(Patient.objects.all(), 'Karimi')),
+                         [Patient.objects.get(national_id='0000000001')])
+
+    def test_jsonl(self):
+        path = self.write('transfer.jsonl', '\n'.join([
+            json.dumps({'national_id': '0000000005', 'first_name': 'Ali', 'last_name': 'Karimi', 'sickness': 'Flu',
+                        'watchful_name': 'Reza', 'address': 'Tabriz', 'blood_type': 'AB-', 'height': 180}),
+            '{not json',
+            '[1, 2]',
+            '"x"',
+        ]))
+        rejects = os.path.join(self.directory.name, 'rejects.jsonl')
+        call_command('import_patients', path, rejects=rejects, stdout=StringIO())
+        self.assertEqual(Patient.objects.get(national_id='0000000005').height, 180)
+        with open(rejects, encoding='utf-8') as file:
+            errors = [json.loads(line)['error'] for line in file]
+        self.assertIn('Invalid JSON', errors[0])
+        self.assertEqual(errors[1:], ['Expected a JSON object.'] * 2)
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.user)
+        self.patients = []
+        for i, day in enumerate((1, 15)):
+            patient = Patient.objects.create(
+                national_id=f'{i:010d}',
+                first_name='John',
+                last_name=f'Doe {i}',
+                sickness='Fever',
+                watchful_name='Jane',
+                blood_type='0',
+            )
+            Patient.objects.filter(pk=patient.pk).update(login_at=datetime(2023, 3, day, 12, tzinfo=dt_timezone.utc))
+            Payment.objects.create(patient=patient, title=f'Fee {i}', cost=100, paid=i * 10)
+            Medicine.objects.create(patient=patient, name='Paracetamol', order='Twice a day')
+            self.patients.append(patient)
+
+    def content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_endpoint_with_date_filter(self):
+        response = self.client.get(reverse('export', args=['payments', 'csv']), {
+            'admitted_from': '2023-03-10', 'admitted_to': '2023-03-15',
+        })
+        lines = self.content(response).splitlines()
+        self.assertEqual(lines[0], 'id,patient_id,patient__national_id,title,cost,paid')
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Fee 1', lines[1])
+
+    def test_jsonl_endpoint(self):
+        response = self.client.get(reverse('export', args=['medicines', 'jsonl']))
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual([row['patient__national_id'] for row in rows], ['0000000000', '0000000001'])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get(reverse('export', args=['beds', 'csv'])).status_code, 404)
+        response = self.client.get(reverse('export', args=['patients', 'csv']), {'discharged_to': 'soon'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_admin_action(self):
+        response = self.client.post(reverse('admin:manager_patient_changelist'), {
+            'action': 'export_csv', '_selected_action': [self.patients[0].pk],
+        })
+        lines = self.content(response).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Doe 0', lines[1])
+
+    def test_role_hidden_columns(self):
+        group = Group.objects.create(name=roles.NURSES)
+        group.permissions.set(Permission.objects.filter(codename__in=['view_patient', 'view_medicine']))
+        nurse = CustomUser.objects.create_user('nurse', password='password', is_staff=True)
+        nurse.groups.add(group)
+        self.client.force_login(nurse)
+        header = self.content(self.client.get(reverse('export', args=['patients', 'csv']))).splitlines()[0]
+        self.assertNotIn('national_id', header)
+        self.assertNotIn('phone_number', header)
+        self.assertIn('last_name', header)
+        rows = self.content(self.client.get(reverse('export', args=['medicines', 'jsonl']))).splitlines()
+        self.assertEqual(set(json.loads(rows[0])), {'id', 'patient_id', 'name', 'order'})
+        response = self.client.post(reverse('admin:manager_patient_changelist'), {
+            'action': 'export_jsonl', '_selected_action': [self.patients[0].pk],
+        })
+        self.assertNotIn('address', json.loads(self.content(response)))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_data', 'patients', '--format=jsonl', '--admitted-to=2023-03-02', stdout=out)
+        self.assertEqual([json.loads(line)['last_name'] for line in out.getvalue().splitlines()], ['Doe 0'])
+
+
+class BalanceLedgerTest(TestCase):
+    def setUp(self):
+        self.patients = [
+            Patient.objects.create(
+                national_id=f'{i:010d}',
+                first_name='John',
+                last_name=f'Doe {i}',
+                sickness='Fever',
+                watchful_name='Jane',
+                blood_type='0',
+            ) for i in range(2)
+        ]
+
+    def balance(self, patient):
+        return Patient.objects.values_list('total_cost', 'total_paid', 'total_due').get(pk=patient.pk)
+
+    def test_single_row_writes(self):
+        first, second = self.patients
+        payment = Payment.objects.create(patient=first, title='Bed', cost=100, paid=30)
+        self.assertEqual(self.balance(first), (100, 30, 70))
+        payment.paid = 100
+        payment.save()
+        self.assertEqual(self.balance(first), (100, 100, 0))
+        payment.patient = second
+        payment.save()
+        self.assertEqual(self.balance(first), (0, 0, 0))
+        self.assertEqual(self.balance(second), (100, 100, 0))
+        payment.delete()
+        self.assertEqual(self.balance(second), (0, 0, 0))
+
+    def test_bulk_writes(self):
+        first, second = self.patients
+        Payment.objects.bulk_create([
+            Payment(patient=first, title='Bed', cost=100, paid=0),
+            Payment(patient=second, title='Bed', cost=50, paid=10),
+        ])
+        self.assertEqual((self.balance(first), self.balance(second)), ((100, 0, 100), (50, 10, 40)))
+        Payment.objects.filter(patient=first).update(paid=F('cost'))
+        self.assertEqual(self.balance(first), (100, 100, 0))
+        Payment.objects.filter(patient=second).delete()
+        self.assertEqual(self.balance(second), (0, 0, 0))
+
+    def test_bulk_update_refreshes_balances_once(self):
+        first, second = self.patients
+        payment = Payment.objects.create(patient=first, title='Bed', cost=100, paid=0)
+        payment.patient, payment.paid = second, 60
+        with mock.patch.object(models, 'refresh_balances', wraps=models.refresh_balances) as refresh:
+            Payment.objects.bulk_update([payment], ['patient', 'paid'])
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual((self.balance(first), self.balance(second)), ((0, 0, 0), (100, 60, 40)))
+
+    def test_stale_patient_save_keeps_ledger(self):
+        first = self.patients[0]
+        Payment.objects.create(patient=first, title='Bed', cost=100, paid=0)
+        first.sickness = 'Flu'
+        first.save()
+        self.assertEqual(self.balance(first), (100, 0, 100))
+
+    def test_reconcile(self):
+        first = self.patients[0]
+        Payment.objects.create(patient=first, title='Bed', cost=100, paid=0)
+        Patient.objects.filter(pk=first.pk).update(total_due=5)
+        out = StringIO()
+        call_command('reconcile_balances', stdout=out)
+        self.assertIn('1 balances drifted', out.getvalue())
+        call_command('reconcile_balances', '--fix', stdout=StringIO())
+        self.assertEqual(self.balance(first), (100, 0, 100))
+        self.assertFalse(Patient.objects.with_balance_drift().exists())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked against SQLite.')
+class QueryPlanTest(TestCase):
+    def setUp(self):
+        self.doctor = CustomUser.objects.create_user('doctor')
+        self.patient = Patient.objects.create(
+            national_id='1234567890',
+            first_name='John',
+            last_name='Doe',
+            sickness='Fever',
+            watchful_name='Jane',
+            blood_type='0',
+            doctor=self.doctor,
+        )
+
+    def assertIndexed(self, queryset):
+        plan = queryset.explain()
+        scans = [line for line in plan.splitlines() if re.search(r'\bSCAN \S+$', line.strip())]
+        self.assertFalse(scans, f'Full table scan in:\n{plan}')
+
+    def assertPagesIndexed(self, url):
+        """Check the plan of every patient and payment query the page at ``url`` runs."""
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        queries = [query['sql'] for query in context.captured_queries
+                   if query['sql'].startswith('SELECT') and re.search(r'"manager_(patient|payment)"', query['sql'])]
+        self.assertTrue(queries)
+        for sql in queries:
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = '\n'.join(row[-1] for row in cursor.fetchall())
+            self.assertFalse(re.findall(r'\bSCAN manager_\w+$', plan, re.M), f'Full table scan in:\n{sql}\n{plan}')
+            self.assertNotIn('TEMP B-TREE FOR ORDER BY', plan, f'Unindexed sort in:\n{sql}\n{plan}')
+
+    def test_patient_changelist(self):
+        self.client.force_login(CustomUser.objects.create_superuser('admin', password='password'))
+        changelist = reverse('admin:manager_patient_changelist')
+        self.assertPagesIndexed(changelist)
+        self.assertPagesIndexed(changelist + '?has_debt=1')
+
+    def test_invoice(self):
+        Payment.objects.create(patient=self.patient, title='Fee', cost=100, paid=40)
+        self.client.force_login(CustomUser.objects.create_superuser('admin', password='password'))
+        cache.clear()
+        self.assertPagesIndexed(reverse('invoice', args=[self.patient.national_id]))
+
+    def test_patients_by_doctor_and_nurse(self):
+        self.assertIndexed(Patient.objects.filter(is_hospitalized=True, doctor=self.doctor).order_by('-login_at'))
+        self.assertIndexed(Patient.objects.filter(is_hospitalized=True, nurse=self.doctor).order_by('-login_at'))
+
+    def test_discharged_patients(self):
+        since = datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+        self.assertIndexed(Patient.objects.filter(discharge_date__gte=since).order_by('discharge_date'))
+
+    def test_patient_lookups(self):
+        self.assertIndexed(Patient.objects.filter(national_id='1234567890'))
+        self.assertIndexed(Patient.objects.filter(last_name='Doe').order_by('last_name', 'first_name'))
+
+    def test_unpaid_payments(self):
+        self.assertIndexed(Payment.objects.filter(patient=self.patient, cost__gt=F('paid')))
+
+    def test_free_beds(self):
+        self.assertIndexed(beds.free_beds(1)[:1])
+
+
+class SeedAndBenchmarkTest(TestCase):
+    def test_seed_and_benchmark(self):
+        call_command('seed_hospital', patients=30, payments=3, medicines=2, doctors=2, nurses=2, managers=1,
+                     batch_size=20, seed=1, stdout=StringIO())
+        self.assertEqual(Patient.objects.count(), 30)
+        self.assertEqual(Payment.objects.count(), 90)
+        self.assertEqual(Bed.objects.count(), len(Bed.floors) * len(Bed.rooms) * len(Bed.beds))
+        self.assertFalse(Patient.objects.with_balance_drift().exists())
+        self.assertTrue(Patient.objects.filter(login_at__lt=timezone.now() - timedelta(days=1)).exists())
+        self.assertTrue(CustomUser.objects.filter(username='doctor1', groups__name=roles.DOCTORS).exists())
+        self.assertFalse(Change.objects.exists())
+
+        CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password')
+        with self.assertNumQueries(3):
+            benchmark.scenarios()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.json')
+            call_command('benchmark', repeat=1, output=path, stdout=StringIO())
+            out = StringIO()
+            call_command('benchmark', repeat=1, compare=path, threshold=100, stdout=out)
+            with open(path) as file:
+                results = json.load(file)
+        self.assertEqual(results['rows']['patients'], 30)
+        self.assertIn('invoice', results['scenarios'])
+        self.assertGreater(results['scenarios']['patient_changelist']['queries'], 0)
+        self.assertIn('No regressions.', out.getvalue())
+
+
+class SerialLiveServerThread(LiveServerThread):
+    # The in-memory test database is one connection shared by the live server's
+    # request threads, so concurrent requests would interleave their transactions.
+    def _create_server(self, connections_override=None):
+        return WSGIServer((self.host, self.port), QuietWSGIRequestHandler, allow_reuse_address=False)
+
+
+@override_settings(REQUEST_SLOW_MS=10 ** 6)
+class LoadTestHarnessTest(LiveServerTestCase):
+    server_thread_class = SerialLiveServerThread
+
+    def setUp(self):
+        call_command('seed_hospital', patients=40, payments=2, medicines=1, doctors=2, nurses=2, managers=1,
+                     discharged=0.2, seed=1, stdout=StringIO())
+
+    def test_wsgi(self):
+        summary = loadtest.run(users=3, duration=1)
+        self.assertGreater(summary['total']['requests'], 0)
+        self.assertEqual(summary['total']['errors'], 0)
+
+    def test_http(self):
+        summary = loadtest.run(target='http', base_url=self.live_server_url, users=2, duration=1)
+        self.assertGreater(summary['total']['requests'], 0)
+        self.assertEqual(summary['total']['errors'], 0)
+
+
+class DatabaseSettingsTest(TestCase):
+    def test_development_default(self):
+        config = database_settings(Path('/srv/hospital'), {})
+        self.assertEqual(config['NAME'], Path('/srv/hospital/db.sqlite3'))
+        self.assertEqual(config['OPTIONS'], {})
+        self.assertNotIn('CONN_MAX_AGE', config)
+
+    def test_production_sqlite(self):
+        config = database_settings(Path('/srv'), {'HOSPITAL_DB_PROFILE': 'production', 'SQLITE_BUSY_TIMEOUT': '9000'})
+        self.assertEqual(config['OPTIONS']['pragmas']['journal_mode'], 'WAL')
+        self.assertEqual(config['OPTIONS']['pragmas']['busy_timeout'], 9000)
+        self.assertEqual(config['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertEqual(config['CONN_MAX_AGE'], 600)
+        self.assertTrue(config['CONN_HEALTH_CHECKS'])
+
+    def test_database_url(self):
+        config = database_settings(Path('/srv'), {'DATABASE_URL': 'postgres://hms:s%40cret@db:5432/hospital'})
+        self.assertEqual(
+            (config['ENGINE'], config['NAME'], config['USER'], config['PASSWORD'], config['HOST'], config['PORT']),
+            ('django.db.backends.postgresql', 'hospital', 'hms', 's@cret', 'db', '5432'),
+        )
+        config = database_settings(Path('/srv'), {'DATABASE_URL': 'sqlite:////var/lib/hospital.sqlite3'})
+        self.assertEqual(config['NAME'], '/var/lib/hospital.sqlite3')
+
+    def test_pragmas_applied(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = database_settings(Path(directory), {'HOSPITAL_DB_PROFILE': 'production'})
+            wrapper = load_backend(config['ENGINE']).DatabaseWrapper({
+                **connection.settings_dict, **config, 'TEST': {},
+            }, 'pragma-test')
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA busy_timeout')
+                    self.assertEqual(cursor.fetchone()[0], 5000)
+                    cursor.execute('PRAGMA synchronous')
+                    self.assertEqual(cursor.fetchone()[0], 1)
+            finally:
+                wrapper.close()
+
+
+class ReplicaRouterTest(TestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.request = RequestFactory().get('/')
+        self.request.session = {}
+
+    def test_reads_stay_on_primary_without_replica(self):
+        with reading_from_replica(self.request):
+            self.assertEqual(self.router.db_for_read(Patient), 'default')
+
+    @override_settings(REPLICA_DATABASE='replica')
+    def test_opted_in_reads_use_replica(self):
+        self.assertEqual(self.router.db_for_read(Patient), 'default')
+        with reading_from_replica(self.request):
+            self.assertEqual(self.router.db_for_read(Patient), 'replica')
+        self.assertEqual(self.router.db_for_read(Patient), 'default')
+
+    @override_settings(REPLICA_DATABASE='replica', REPLICA_PIN_SECONDS=60)
+    def test_recent_writer_reads_primary(self):
+        self.request.session[routers.SESSION_KEY] = time.time()
+        with reading_from_replica(self.request):
+            self.assertEqual(self.router.db_for_read(Patient), 'default')
+        self.request.session[routers.SESSION_KEY] = time.time() - 120
+        with reading_from_replica(self.request):
+            self.assertEqual(self.router.db_for_read(Patient), 'replica')
+
+    @override_settings(REPLICA_DATABASE='replica')
+    def test_write_pins_rest_of_request(self):
+        def view(request):
+            before = self.router.db_for_read(Patient)
+            self.router.db_for_write(Patient)
+            return before, self.router.db_for_read(Patient)
+
+        middleware = routers.ReplicaPinningMiddleware(lambda request: HttpResponse(
+            ','.join(routers.replica_reads(view)(request))))
+        self.assertEqual(middleware(self.request).content, b'replica,default')
+        post = RequestFactory().post('/')
+        post.session = {}
+        middleware(post)
+        self.assertIn(routers.SESSION_KEY, post.session)
+
+    def test_replica_settings(self):
+        self.assertIsNone(replica_settings({}))
+        config = replica_settings({'REPLICA_DATABASE_URL': 'sqlite:////tmp/replica.sqlite3'})
+        self.assertEqual(config['OPTIONS']['pragmas']['query_only'], 1)
+        self.assertEqual(config['TEST'], {'MIRROR': 'default'})
+        config = replica_settings({'REPLICA_DATABASE_URL': 'sqlite:////tmp/replica.sqlite3',
+                                   'HOSPITAL_DB_PROFILE': 'production'})
+        self.assertNotIn('journal_mode', config['OPTIONS']['pragmas'])
+        self.assertEqual(config['CONN_MAX_AGE'], 0)
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source, target = os.path.join(directory, 'db.sqlite3'), os.path.join(directory, 'replica.sqlite3')
+            with closing(sqlite3.connect(source)) as primary:
+                primary.execute('PRAGMA journal_mode = WAL')
+                primary.execute('CREATE TABLE t (x)')
+                primary.execute('INSERT INTO t VALUES (1)')
+                primary.commit()
+            snapshot(source, target)
+            with closing(sqlite3.connect(target)) as copy:
+                self.assertEqual(copy.execute('SELECT x FROM t').fetchall(), [(1,)])
+                self.assertEqual(copy.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+            self.assertFalse(os.path.exists(f'{target}-wal'))
+
+
+class RequestTimingMiddlewareTest(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(national_id='0012345678', first_name='John', last_name='Doe',
+                                              sickness='Fever', watchful_name='Jane', blood_type='0')
+
+    def middleware(self, queries):
+        def view(request):
+            for _ in range(queries):
+                Patient.objects.get(pk=self.patient.pk)
+            return HttpResponse()
+        return RequestTimingMiddleware(view)
+
+    def test_server_timing_header(self):
+        self.client.force_login(CustomUser.objects.create_superuser('admin', password='password'))
+        response = self.client.get(reverse('invoice', args=[self.patient.national_id]))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", cache;desc="\d+ hits, \d+ misses", app;dur=[\d.]+, total;dur=[\d.]+$')
+
+    @override_settings(REQUEST_SLOW_MS=10 ** 6, REQUEST_TRACE_SAMPLE_RATE=0, REQUEST_DUPLICATE_QUERY_THRESHOLD=5)
+    def test_counts_queries_and_flags_duplicates(self):
+        response = self.middleware(2)(RequestFactory().get('/'))
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+        with self.assertLogs('hospital.requests', 'WARNING') as logs:
+            self.middleware(5)(RequestFactory().get('/ward'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['path'], record['queries']), ('/ward', 5))
+        self.assertEqual(record['duplicates'][0]['count'], 5)
+        self.assertNotIn('trace', record)
+
+    @override_settings(REQUEST_SLOW_MS=0, REQUEST_TRACE_SAMPLE_RATE=1)
+    def test_slow_request_logged_with_sampled_trace(self):
+        with self.assertLogs('hospital.requests', 'INFO') as logs:
+            self.middleware(1)(RequestFactory().get('/'))
+        record = logs.records[0].request_stats
+        self.assertEqual(logs.records[0].levelname, 'WARNING')
+        self.assertEqual(len(record['trace']), 1)
+        self.assertIn('manager_patient', record['trace'][0]['sql'])
+
+    def test_ignores_other_threads_on_a_shared_connection(self):
+        shared = connections['default']
+        shared.inc_thread_sharing()
+
+        def view(request):
+            with ThreadPoolExecutor(1) as pool:
+                pool.submit(lambda: shared.cursor().execute('SELECT 1')).result()
+            return HttpResponse()
+        try:
+            response = RequestTimingMiddleware(view)(RequestFactory().get('/'))
+        finally:
+            shared.dec_thread_sharing()
+        self.assertIn('desc="0 queries"', response['Server-Timing'])
+
+    async def test_async_chain(self):
+        async def view(request):
+            await Patient.objects.aget(pk=self.patient.pk)
+            return HttpResponse()
+        middleware = RequestTimingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(RequestFactory().get('/'))
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+
+class CacheLayerTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        caching.reset_stats()
+        self.patient = Patient.objects.create(national_id='0012345678', first_name='John', last_name='Doe',
+                                              sickness='Fever', watchful_name='Jane', blood_type='0')
+        self.bed = Bed.objects.create(floor=1, room=1, bed=1)
+        Bed.objects.create(floor=2, room=1, bed=1)
+
+    def test_bump_invalidates_scope_only(self):
+        values = iter(range(10))
+        get = lambda pk: caching.get('thing', [caching.patient(pk)], lambda: next(values))
+        self.assertEqual((get(1), get(2)), (0, 1))
+        caching.bump(caching.patient(1))
+        self.assertEqual((get(1), get(2)), (2, 1))
+        self.assertEqual(caching.stats()['thing'], {'hits': 1, 'misses': 3, 'ratio': 0.25})
+
+    def test_read_between_write_and_commit_is_not_kept(self):
+        scopes = [caching.patient(self.patient.pk)]
+        with self.captureOnCommitCallbacks(execute=True):
+            Payment.objects.create(patient=self.patient, title='Fee', cost=100, paid=0)
+            # Another connection still reads the old balance and caches it under the bumped version.
+            self.assertEqual(caching.get('invoice', scopes, lambda: 'unpaid: 0'), 'unpaid: 0')
+        self.assertEqual(caching.get('invoice', scopes, lambda: 'unpaid: 100'), 'unpaid: 100')
+
+    def test_evicted_version_does_not_revive_old_entries(self):
+        caching.get('thing', [caching.patient(1)], lambda: 'old')
+        cache.delete(caching.version_key(caching.patient(1)))
+        self.assertEqual(caching.get('thing', [caching.patient(1)], lambda: 'new'), 'new')
+
+    def test_ward_occupancy_follows_beds(self):
+        with self.assertNumQueries(1):
+            beds.occupancy_by_floor()
+            beds.occupancy_by_floor()
+        ward_two = beds.ward_beds(2)
+        self.bed.patient = self.patient
+        self.bed.save()
+        self.assertEqual(beds.occupancy_by_floor()[0]['occupied'], 1)
+        self.assertEqual(beds.ward_beds(1)[0]['patient_id'], self.patient.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(beds.ward_beds(2), ward_two)
+        Patient.objects.filter(pk=self.patient.pk).release_beds()
+        self.assertEqual(beds.occupancy_by_floor()[0]['occupied'], 0)
+        beds.allocate_bed(self.patient, floor=2)
+        self.assertEqual(beds.ward_beds(2)[0]['patient_id'], self.patient.pk)
+        self.patient.delete()
+        self.assertIsNone(beds.ward_beds(2)[0]['patient_id'])
+
+    def test_invoice_invalidated_by_medicine(self):
+        self.client.force_login(CustomUser.objects.create_superuser('admin', password='password'))
+        url = reverse('invoice', args=[self.patient.national_id])
+        self.client.get(url)
+        Medicine.objects.create(patient=self.patient, name='Aspirin', order='Daily')
+        self.assertIn('cache;desc="0 hits, 1 misses"', self.client.get(url)['Server-Timing'])
+        self.assertIn('cache;desc="1 hits, 0 misses"', self.client.get(url)['Server-Timing'])
+
+    def test_user_groups_follow_memberships(self):
+        user = CustomUser.objects.create_user('nurse', password='x')
+        group = Group.objects.create(name=roles.NURSES)
+        request = RequestFactory().get('/')
+        request.user = user
+        self.assertEqual(roles.user_groups(request), frozenset())
+        user.groups.add(group)
+        request = RequestFactory().get('/')
+        request.user = user
+        with self.assertNumQueries(1):
+            self.assertEqual(roles.user_groups(request), {roles.NURSES})
+        group.user_set.clear()
+        del request._user_groups
+        self.assertEqual(roles.user_groups(request), frozenset())
+
+    def test_cache_settings(self):
+        base = Path('/srv/hospital')
+        self.assertEqual(cache_settings(base, {})['BACKEND'], 'django.core.cache.backends.locmem.LocMemCache')
+        self.assertEqual(cache_settings(base, {'CACHE_BACKEND': 'file'})['LOCATION'], '/srv/hospital/cache')
+        self.assertEqual(cache_settings(base, {'CACHE_BACKEND': 'redis'})['LOCATION'], 'redis://127.0.0.1:6379/0')
+        with self.assertRaises(ValueError):
+            cache_settings(base, {'CACHE_BACKEND': 'memcached'})
+
+
+class ArchiveTest(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.bed = Bed.objects.create(floor=1, room=1, bed=1)
+        self.old = self.patient('0000000001', discharged=self.now - timedelta(days=400))
+        self.recent = self.patient('0000000002', discharged=self.now - timedelta(days=10))
+        self.present = self.patient('0000000003')
+        Payment.objects.create(patient=self.old, title='Surgery', cost=500, paid=300)
+        Medicine.objects.create(patient=self.old, name='Aspirin', order='Daily')
+        BedOccupancy.objects.create(bed=self.bed, patient=self.old, start=self.now - timedelta(days=405),
+                                    end=self.now - timedelta(days=400))
+
+    def patient(self, national_id, discharged=None):
+        return Patient.objects.create(national_id=national_id, first_name='John', last_name='Doe', sickness='Flu',
+                                      watchful_name='Jane', blood_type='0', is_hospitalized=discharged is None,
+                                      discharge_date=discharged)
+
+    def test_command_archives_old_discharges_only(self):
+        call_command('archive_patients', days=365, batch_size=1, stdout=StringIO())
+        self.assertFalse(Patient.objects.filter(pk=self.old.pk).exists())
+        self.assertEqual(set(Patient.objects.values_list('pk', flat=True)), {self.recent.pk, self.present.pk})
+        archived = ArchivedPatient.objects.get(original_id=self.old.pk)
+        self.assertEqual((archived.national_id, archived.total_due), ('0000000001', 200))
+        self.assertEqual(list(archived.archivedpayment_set.values_list('title', 'cost', 'paid')),
+                         [('Surgery', 500, 300)])
+        self.assertEqual(archived.archivedmedicine_set.get().name, 'Aspirin')
+        self.assertEqual(archived.archivedbedoccupancy_set.get().bed, self.bed)
+        self.assertFalse(BedOccupancy.objects.exists())
+
+    def test_archive_feed_entries_and_one_cache_bump(self):
+        start = Change.objects.order_by('-seq').values_list('seq', flat=True).first() or 0
+        payment, medicine = self.old.payment_set.get(), self.old.medicine_set.get()
+        with mock.patch.object(caching, 'bump', wraps=caching.bump) as bump:
+            self.assertEqual(archive.archive_patients([self.old.pk]), 1)
+        self.assertEqual(bump.call_count, 1)
+        archived = ArchivedPatient.objects.get(original_id=self.old.pk)
+        self.assertEqual([(entry.model, entry.action, entry.object_id, entry.data) for entry in Change.since(start)], [
+            ('patient', 'archive', self.old.pk, {'archived_id': archived.pk}),
+            ('payment', 'archive', payment.pk,
+             {'patient_id': self.old.pk, 'title': 'Surgery', 'cost': 500, 'paid': 300}),
+            ('medicine', 'archive', medicine.pk, {'patient_id': self.old.pk, 'name': 'Aspirin', 'order': 'Daily'}),
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {search.FTS_TABLE} WHERE rowid = %s', [self.old.pk])
+            self.assertEqual(cursor.fetchone()[0], 0)
+        # The restored rows come back under their old ids rather than as new ones.
+        start = Change.objects.latest('seq').seq
+        archive.readmit('0000000001')
+        restored = Change.since(start, ['payment', 'medicine'])
+        self.assertEqual([(entry.model, entry.action, entry.object_id) for entry in restored],
+                         [('payment', 'create', payment.pk), ('medicine', 'create', medicine.pk)])
+
+    def test_patients_in_beds_are_kept(self):
+        self.bed.patient = self.old
+        self.bed.save()
+        self.assertEqual(sum(archive.archive_discharged(365, now=self.now)), 0)
+
+    def test_readmission_restores_record(self):
+        list(archive.archive_discharged(365))
+        patient = archive.readmit('0000000001')
+        self.assertEqual(patient.pk, self.old.pk)
+        self.assertTrue(patient.is_hospitalized)
+        self.assertIsNone(patient.discharge_date)
+        self.assertEqual((patient.total_cost, patient.total_paid, patient.total_due), (500, 300, 200))
+        self.assertEqual(patient.medicine_set.get().name, 'Aspirin')
+        self.assertEqual(BedOccupancy.objects.get().patient, patient)
+        self.assertFalse(ArchivedPatient.objects.exists())
+        self.assertFalse(ArchivedPayment.objects.exists() or ArchivedMedicine.objects.exists())
+        self.assertIsNone(archive.readmit('0000000001'))
+
+    def test_restore_refuses_duplicate_national_id(self):
+        list(archive.archive_discharged(365))
+        self.patient('0000000001')
+        with self.assertRaises(ValidationError):
+            archive.readmit('0000000001')
+
+    def test_admin_search_and_invoice(self):
+        list(archive.archive_discharged(365))
+        self.client.force_login(CustomUser.objects.create_superuser('admin', password='x'))
+        archived = ArchivedPatient.objects.get()
+        response = self.client.get(reverse('admin:manager_archivedpatient_changelist') + '?q=0000000001')
+        self.assertContains(response, '0000000001')
+        response = self.client.get(reverse('admin:manager_archivedpatient_change', args=[archived.pk]))
+        self.assertContains(response, reverse('archived_invoice', args=[archived.pk]))
+        self.assertContains(self.client.get(reverse('archived_invoice', args=[archived.pk])), '$200')
+        self.client.post(reverse('admin:manager_archivedpatient_changelist'),
+                         {'action': 'readmit', '_selected_action': [archived.pk]})
+        self.assertTrue(Patient.objects.get(national_id='0000000001').is_hospitalized)
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.client.force_login(CustomUser.objects.create_superuser('admin', password='x'))
+        start = timezone.now() - timedelta(days=30)
+        patients = [
+            Patient(national_id=f'{i:010d}', first_name='John', last_name=f'Doe{i:03d}', sickness='Flu',
+                    watchful_name='Jane', blood_type='0')
+            for i in range(250)
+        ]
+        Patient.objects.bulk_create(patients)
+        patients = list(Patient.objects.order_by('pk'))
+        for i, patient in enumerate(patients):
+            # Pairs of patients share an admission time, so the id has to break ties.
+            patient.login_at = start + timedelta(hours=i // 2)
+        Patient.objects.bulk_update(patients, ['login_at'])
+        Payment.objects.bulk_create(Payment(patient=patient, title='Fee', cost=10, paid=i % 2 * 10)
+                                    for i, patient in enumerate(patients))
+        search.rebuild(Patient.objects.all())
+        self.url = reverse('admin:manager_patient_changelist')
+
+    def walk(self, url):
+        seen, queries = [], []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            queries.append(len(context))
+            seen += [row.pk for row in response.context['cl'].result_list]
+            next_url = response.context['cl'].next_url
+            url = self.url + next_url if next_url else None
+        return seen, queries
+
+    def test_pages_cover_every_row_once_at_constant_cost(self):
+        seen, queries = self.walk(self.url)
+        expected = list(Patient.objects.order_by('-login_at', '-pk').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(set(queries)), 1)
+        self.assertEqual(len(queries), 3)
+
+    def test_load_test_walks_deep_pages_by_cursor(self):
+        session = loadtest.WSGISession(CustomUser.objects.get(username='admin'), 'x')
+        workload = mock.Mock(pages=3, patients=[{}], assigned={})
+        rng = mock.Mock(random=lambda: 0.0, choice=lambda values: values[0])
+        state = {}
+        with mock.patch.object(session, 'request', wraps=session.request) as request:
+            for _ in range(4):
+                loadtest.run_action('changelist', session, roles.MANAGERS, mock.Mock(pk=None), workload, rng, state)
+        paths = [call.args[1] for call in request.call_args_list]
+        self.assertEqual((paths[0], paths[3]), (self.url, self.url))
+        self.assertTrue(paths[1].startswith(self.url + '?cursor=') and paths[2].startswith(self.url + '?cursor='))
+        self.assertNotEqual(paths[1], paths[2])
+
+    def test_search_and_filters_survive_paging(self):
+        seen, _ = self.walk(self.url + '?has_debt=1&q=Doe')
+        self.assertEqual(sorted(seen), sorted(Patient.objects.filter(total_due__gt=0).values_list('pk', flat=True)))
+        response = self.client.get(self.url + '?has_debt=1')
+        self.assertIn('has_debt=1', response.context['cl'].next_url)
+
+    def test_count_is_capped(self):
+        with mock.patch.object(KeysetChangeList, 'count_limit', 10):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'More than 10 patients')
+        self.assertContains(response, 'Select all patients matching the filters')
+        self.assertNotContains(response, 'Select all 10 patients')
+        with mock.patch.object(KeysetChangeList, 'count_limit', 10):
+            response = self.client.get(self.url + '?q=Doe')
+        self.assertContains(response, '10+ results')
+        self.assertContains(self.client.get(self.url + '?q=Doe001'), '1 result (')
+
+    def test_column_sorts_page_by_keyset(self):
+        doctor = CustomUser.objects.create_user('doctor')
+        Patient.objects.filter(pk__in=Patient.objects.order_by('pk').values('pk')[:100]).update(doctor=doctor)
+        for order in ('2', '-3', '5.-3'):
+            seen, queries = self.walk(f'{self.url}?o={order}')
+            self.assertEqual(sorted(seen), sorted(Patient.objects.values_list('pk', flat=True)), order)
+            self.assertEqual(len(queries), 3)
+
+    def test_invalid_cursor_and_unseekable_sort(self):
+        self.assertRedirects(self.client.get(self.url + '?cursor=bogus'), self.url + '?e=1')
+        # The reverse one-to-one bed column can't be seeked, so it gets numbered pages over the full count.
+        response = self.client.get(self.url + '?o=9&p=2')
+        self.assertIsNone(response.context['cl'].keyset)
+        self.assertEqual(response.context['cl'].page_num, 2)
+        self.assertEqual(response.context['cl'].result_count, 250)
+
+    def test_payment_changelist(self):
+        seen, _ = self.walk_payments()
+        self.assertEqual(seen, list(Payment.objects.order_by('-pk').values_list('pk', flat=True)))
+
+    def walk_payments(self):
+        self.url = reverse('admin:manager_payment_changelist')
+        return self.walk(self.url)
+
+
+class JSONAPITest(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser('admin', password='x')
+        self.client.force_login(self.admin)
+        for i in range(5):
+            patient = Patient.objects.create(national_id=f'{i:010d}', first_name='John', last_name=f'Doe {i}',
+                                             sickness='Flu', watchful_name='Jane', blood_type='0')
+            Payment.objects.create(patient=patient, title='Fee', cost=100, paid=40)
+            Medicine.objects.create(patient=patient, name='Aspirin', order='Daily')
+            Medicine.objects.create(patient=patient, name='Rest', order='Nightly')
+        Bed.objects.create(floor=1, room=1, bed=1, patient=patient)
+        self.url = reverse('api_collection', args=['patients'])
+
+    def get(self, url, **extra):
+        response = self.client.get(url, **extra)
+        return response, json.loads(response.content) if response.content else None
+
+    def test_cursor_pagination(self):
+        seen, url = [], self.url + '?limit=2&fields=id'
+        while url:
+            response, data = self.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [row['id'] for row in data['results']]
+            url = data['next']
+        self.assertEqual(seen, list(Patient.objects.order_by('pk').values_list('pk', flat=True)))
+
+    def test_sparse_nested_fields_without_n_plus_one(self):
+        with self.assertNumQueries(4):
+            _, data = self.get(self.url + '?fields=id,last_name,bed,medicines')
+        self.assertEqual(set(data['results'][0]), {'id', 'last_name', 'bed', 'medicines'})
+        self.assertEqual([row['name'] for row in data['results'][0]['medicines']], ['Aspirin', 'Rest'])
+        self.assertEqual(data['results'][-1]['bed']['floor'], 1)
+        self.assertEqual(self.get(self.url + '?fields=nope')[0].status_code, 400)
+
+    def test_etag(self):
+        response, _ = self.get(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        Patient.objects.filter(pk=Patient.objects.first().pk).update(sickness='Cold')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_role_hiding(self):
+        doctor = CustomUser.objects.create_user('doctor', password='x', is_staff=True)
+        group = Group.objects.create(name=roles.DOCTORS)
+        group.permissions.set(Permission.objects.filter(codename='view_patient'))
+        doctor.groups.add(group)
+        self.client.force_login(doctor)
+        _, data = self.get(self.url)
+        self.assertNotIn('national_id', data['results'][0])
+        self.assertNotIn('total_due', data['results'][0])
+        self.assertEqual(self.get(self.url + '?fields=id,phone_number')[0].status_code, 400)
+        self.assertEqual(self.get(reverse('api_collection', args=['payments']))[0].status_code, 403)
+
+    def test_filters_detail_and_auth(self):
+        _, data = self.get(reverse('api_collection', args=['beds']) + '?free=0')
+        self.assertEqual(len(data['results']), 1)
+        payment = Payment.objects.first()
+        _, data = self.get(reverse('api_detail', args=['payments', payment.pk]))
+        self.assertEqual(data, {'id': payment.pk, 'patient': payment.patient_id, 'title': 'Fee', 'cost': 100,
+                                'paid': 40})
+        self.assertEqual(self.get(self.url + '?present=1&cursor=bogus')[0].status_code, 400)
+        for values in ([{'a': 1}], [[1]]):
+            self.assertEqual(self.get(self.url + f'?cursor={encode_cursor(values)}')[0].status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.get(self.url)[0].status_code, 401)
+
+
+class LiveBedViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_superuser('admin', password='x')
+        self.async_client.force_login(self.user)
+        self.client.force_login(self.user)
+        self.patient = Patient.objects.create(national_id='0012345678', first_name='John', last_name='Doe',
+                                              sickness='Fever', watchful_name='Jane', blood_type='0')
+        self.bed = Bed.objects.create(floor=1, room=2, bed=3)
+
+    async def test_bed_occupancy(self):
+        response = await self.async_client.get(reverse('bed_occupancy'))
+        self.assertEqual(json.loads(response.content)['floors'], [{'floor': 1, 'total': 1, 'occupied': 0, 'free': 1}])
+        response = await self.async_client.get(reverse('bed_occupancy'), {'floor': 1})
+        self.assertEqual(json.loads(response.content)['beds'][0]['room'], 2)
+
+    async def test_patient_summary_and_invoice(self):
+        Medicine_create = sync_to_async(Medicine.objects.create)
+        await Medicine_create(patient=self.patient, name='Aspirin', order='Daily')
+        response = await self.async_client.get(reverse('patient_summary', args=[self.patient.pk]))
+        summary = json.loads(response.content)
+        self.assertEqual((summary['name'], summary['medicines'][0]['name']), ('John Doe', 'Aspirin'))
+        self.assertEqual(summary['balance']['due'], 0)
+        response = await self.async_client.get(reverse('patient_summary', args=[self.patient.pk + 1]))
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(reverse('invoice', args=[self.patient.national_id]))
+        self.assertContains(response, 'No payments.')
+
+    @override_settings(REPLICA_PIN_SECONDS=30)
+    def test_replica_reads_are_cached_briefly(self):
+        with mock.patch.object(caching, 'current_read_alias', return_value='replica'), \
+                mock.patch.object(caching.cache, 'set', wraps=caching.cache.set) as cache_set:
+            self.client.get(reverse('patient_summary', args=[self.patient.pk]))
+            beds.occupancy_by_floor()
+            beds.ward_beds(1)
+        self.assertEqual([(call.args[0].split(':')[0], call.args[2]) for call in cache_set.call_args_list],
+                         [('summary', 30), ('occupancy', 30), ('ward_beds', 30)])
+
+    def test_summary_follows_set_based_bed_and_discharge_updates(self):
+        url = reverse('patient_summary', args=[self.patient.pk])
+        self.assertIsNone(json.loads(self.client.get(url).content)['bed'])
+        beds.allocate_bed(self.patient)
+        self.assertEqual(json.loads(self.client.get(url).content)['bed'], {'floor': 1, 'room': 2, 'bed': 3})
+        Patient.objects.filter(pk=self.patient.pk).discharge()
+        summary = json.loads(self.client.get(url).content)
+        self.assertEqual((summary['present'], summary['bed']), (False, None))
+        self.assertIsNotNone(summary['discharge_date'])
+
+    def test_admin_actions_publish_bed_events(self):
+        url = reverse('admin:manager_patient_changelist')
+        start = bed_events.last_id
+        for action in ('allocate_beds', 'discharge_patients'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(url, {'action': action, '_selected_action': [self.patient.pk]})
+        data = {'bed': self.bed.pk, 'floor': 1, 'room': 2, 'number': 3, 'patient': self.patient.pk}
+        self.assertEqual([(kind, event) for _, kind, event in bed_events.since(start)],
+                         [('assigned', data), ('released', data)])
+
+    def assign_bed(self):
+        self.bed.patient = self.patient
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bed.save()
+
+    async def test_event_stream(self):
+        response = await self.async_client.get(reverse('bed_events'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertIn('event: occupancy', (await anext(stream)).decode())
+        await sync_to_async(self.assign_bed)()
+        event = (await asyncio.wait_for(anext(stream), 5)).decode()
+        self.assertIn('event: assigned', event)
+        self.assertEqual(json.loads(event.split('data: ')[1])['patient'], self.patient.pk)
+        await stream.aclose()
+
+    def test_sync_event_stream_resumes(self):
+        last = bed_events.publish('assigned', {'bed': self.bed.pk})[0]
+        bed_events.publish('released', {'bed': self.bed.pk})
+        response = self.client.get(reverse('bed_events'), HTTP_LAST_EVENT_ID=str(last))
+        stream = iter(response.streaming_content)
+        backlog = next(stream).decode()
+        self.assertIn('event: released', backlog)
+        self.assertNotIn('event: assigned', backlog)
+        response.close()
+
+    def test_broker_history(self):
+        broker = Broker(history_size=2)
+        for i in range(3):
+            broker.publish('assigned', {'bed': i})
+        self.assertEqual([event[0] for event in broker.since(1)], [2, 3])
+        self.assertEqual(broker.since(3), [])
+        self.assertIsNone(broker.since(0))
+        self.assertIsNone(broker.since(10))
+
+
+class ChangeFeedTest(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(national_id='0000000001', first_name='John', last_name='Doe',
+                                              sickness='Flu', watchful_name='Jane', blood_type='0')
+        self.admin = CustomUser.objects.create_superuser('admin', password='x')
+        self.client.force_login(self.admin)
+
+    def feed(self, since=0):
+        return [(entry.model, entry.action, entry.data) for entry in Change.since(since)]
+
+    def test_writes_are_logged_in_order(self):
+        payment = Payment.objects.create(patient=self.patient, title='Fee', cost=100, paid=0)
+        Payment.objects.filter(pk=payment.pk).update(paid=F('paid') + 40)
+        medicine = Medicine.objects.create(patient=self.patient, name='Aspirin', order='Daily')
+        patient = Patient.objects.get(pk=self.patient.pk)
+        patient.doctor_order = 'Rest'
+        patient.save()
+        patient.save()
+        medicine.delete()
+        self.assertEqual(self.feed(), [
+            ('payment', 'create', {'patient_id': self.patient.pk, 'title': 'Fee', 'cost': 100, 'paid': 0}),
+            ('payment', 'update', {'patient_id': self.patient.pk, 'title': 'Fee', 'cost': 100, 'paid': 40}),
+            ('medicine', 'create', {'patient_id': self.patient.pk, 'name': 'Aspirin', 'order': 'Daily'}),
+            ('patient', 'update', {'doctor_order': 'Rest'}),
+            ('medicine', 'delete', {'patient_id': self.patient.pk, 'name': 'Aspirin', 'order': 'Daily'}),
+        ])
+        self.assertTrue(all(entry.patient_id == self.patient.pk for entry in Change.since(0)))
+
+    def test_endpoint_pages_by_sequence(self):
+        for i in range(5):
+            Payment.objects.create(patient=self.patient, title=f'Fee {i}', cost=10, paid=0)
+        seen, since, more = [], 0, True
+        while more:
+            data = json.loads(self.client.get(reverse('api_changes') + f'?since={since}&limit=2&model=payment').content)
+            seen += [row['data']['title'] for row in data['results']]
+            since, more = data['last_seq'], data['more']
+        self.assertEqual(seen, [f'Fee {i}' for i in range(5)])
+        self.assertEqual(self.client.get(reverse('api_changes') + '?since=x').status_code, 400)
+        for limit in ('0', '-5'):
+            response = self.client.get(reverse('api_changes') + f'?limit={limit}')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.content), {'error': 'limit must be positive.'})
+
+    def test_bulk_writes_are_logged(self):
+        medicines = Medicine.objects.bulk_create([
+            Medicine(patient=self.patient, name='Aspirin', order='Daily'),
+            Medicine(patient=self.patient, name='Zinc', order='Weekly'),
+        ])
+        Medicine.objects.filter(name='Zinc').update(order='Daily')
+        medicines[0].order = 'Twice daily'
+        Medicine.objects.bulk_update(medicines[:1], ['order'])
+        Patient.objects.filter(pk=self.patient.pk).update(nurse_report='Stable')
+        Patient.objects.filter(pk=self.patient.pk).update(first_name='Jon')
+        other = Patient(national_id='0000000002', first_name='Ann', last_name='Roe', sickness='Flu',
+                        watchful_name='Jane', blood_type='0', doctor_order='Rest')
+        Patient.objects.bulk_create([other])
+        other.doctor_order = 'Walk'
+        Patient.objects.bulk_update([other], ['doctor_order', 'first_name'])
+        patient = self.patient.pk
+        self.assertEqual(self.feed(), [
+            ('medicine', 'create', {'patient_id': patient, 'name': 'Aspirin', 'order': 'Daily'}),
+            ('medicine', 'create', {'patient_id': patient, 'name': 'Zinc', 'order': 'Weekly'}),
+            ('medicine', 'update', {'patient_id': patient, 'name': 'Zinc', 'order': 'Daily'}),
+            ('medicine', 'update', {'patient_id': patient, 'name': 'Aspirin', 'order': 'Twice daily'}),
+            ('patient', 'update', {'nurse_report': 'Stable'}),
+            ('patient', 'create', {'doctor_order': 'Rest'}),
+            ('patient', 'update', {'doctor_order': 'Walk'}),
+        ])
+        payment = Payment.objects.create(patient=self.patient, title='Fee', cost=10, paid=0)
+        since = Change.objects.latest('seq').seq
+        payment.paid = 10
+        Payment.objects.bulk_update([payment], ['paid'])
+        self.assertEqual(self.feed(since), [
+            ('payment', 'update', {'patient_id': patient, 'title': 'Fee', 'cost': 10, 'paid': 10}),
+        ])
+
+    def test_endpoint_respects_view_permissions(self):
+        Payment.objects.create(patient=self.patient, title='Fee', cost=10, paid=0)
+        nurse = CustomUser.objects.create_user('nurse', password='x', is_staff=True)
+        nurse.user_permissions.set(Permission.objects.filter(codename='view_medicine'))
+        Medicine.objects.create(patient=self.patient, name='Aspirin', order='Daily')
+        self.client.force_login(nurse)
+        data = json.loads(self.client.get(reverse('api_changes')).content)
+        self.assertEqual([row['model'] for row in data['results']], ['medicine'])
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api_changes')).status_code, 401)
+
+    def test_command(self):
+        Payment.objects.create(patient=self.patient, title='Fee', cost=10, paid=0)
+        Medicine.objects.create(patient=self.patient, name='Aspirin', order='Daily')
+        out = StringIO()
+        call_command('changes', '--model', 'medicine', '--batch-size', '1', stdout=out)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([(line['model'], line['data']['name']) for line in lines], [('medicine', 'Aspirin')])
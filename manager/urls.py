@@ -1,8 +1,16 @@
 from django.contrib import admin
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
-    path('invoice/<int:national_id>', views.invoice),
+    path('invoice/<str:national_id>', views.invoice, name='invoice'),
+    path('beds/occupancy', views.bed_occupancy, name='bed_occupancy'),
+    path('beds/events', views.bed_event_stream, name='bed_events'),
+    path('patients/<int:pk>/summary', views.patient_summary, name='patient_summary'),
+    path('archive/<int:pk>/invoice', views.archived_invoice, name='archived_invoice'),
+    path('api/v1/changes', api.changes, name='api_changes'),
+    path('api/v1/<str:resource_name>', api.collection, name='api_collection'),
+    path('api/v1/<str:resource_name>/<int:pk>', api.detail, name='api_detail'),
+    path('export/<str:kind>.<str:fmt>', views.export, name='export'),
     path('', admin.site.urls),
 ]
@@ -1,18 +1,223 @@
-from django.shortcuts import render
-from .models import Payment
+import asyncio
+import json
+import queue
 
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
+from django.utils.dateparse import parse_date
+from hospital import caching
+from hospital.routers import current_read_alias, replica_reads
+from . import beds
+from .events import AsyncSubscriber, ThreadSubscriber, bed_events
+from .exports import EXPORTS, FORMATS, export_queryset, stream_rows
+from .models import ArchivedPatient, Patient, Payment
+from .roles import DOCTORS, NURSES, get_role
 
-def invoice(request, national_id):
-    payments = Payment.objects.filter(patient__national_id=national_id)
+INVOICE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def invoice_timeout():
+    return caching.replica_timeout(INVOICE_CACHE_TIMEOUT)
+
+
+def render_invoice(request, patient, payments):
     context = {
-        'national_id': national_id,
-        'name': f'{payments.last().patient.first_name} {payments.last().patient.last_name}',
-        'address': payments.last().patient.address,
-        'phone_number': payments.last().patient.phone_number,
-        'login_time': payments.last().patient.login_at,
-        'payments': [(i+1, payments[i], payments[i].cost, payments[i].paid) for i in range(len(payments))],
-        'paid': sum(payment.paid for payment in payments),
-        'unpaid': sum(payment.cost - payment.paid for payment in payments),
+        'national_id': patient.national_id,
+        'name': f'{patient.first_name} {patient.last_name}',
+        'address': patient.address,
+        'phone_number': patient.phone_number,
+        'login_time': patient.login_at,
+        'payments': [(i, payment, payment.cost, payment.paid) for i, payment in enumerate(payments, 1)],
+        'paid': patient.total_paid,
+        'unpaid': patient.total_due,
+    }
+    return render_to_string('invoice.html', context=context, request=request)
+
+
+async def has_perm(request, perm):
+    user = request.user
+    return await sync_to_async(lambda: user.is_active and user.is_staff and user.has_perm(perm))()
+
+
+@replica_reads
+async def invoice(request, national_id):
+    if not await has_perm(request, 'manager.view_payment'):
+        raise PermissionDenied
+    patient = await Patient.objects.only(
+        'first_name', 'last_name', 'address', 'phone_number', 'login_at', 'national_id', 'total_paid', 'total_due',
+    ).filter(national_id=national_id).afirst()
+    if patient is None:
+        raise Http404
+
+    def render():
+        return render_invoice(request, patient, Payment.objects.filter(patient=patient).order_by('pk'))
+
+    content = await sync_to_async(caching.get)('invoice', [caching.patient(patient.pk)], render, invoice_timeout)
+    return HttpResponse(content)
+
+
+@replica_reads
+async def bed_occupancy(request):
+    """Free and occupied beds per floor, or the beds of ``?floor=``."""
+    if not await has_perm(request, 'manager.view_bed'):
+        raise PermissionDenied
+    if request.GET.get('floor'):
+        try:
+            floor = int(request.GET['floor'])
+        except ValueError:
+            return HttpResponseBadRequest('Invalid floor.')
+        return JsonResponse({'floor': floor, 'beds': await sync_to_async(beds.ward_beds)(floor)})
+    return JsonResponse({'floors': await sync_to_async(beds.occupancy_by_floor)()})
+
+
+def summarize_patient(pk):
+    patient = Patient.objects.select_related('bed', 'doctor', 'nurse').filter(pk=pk).first()
+    if patient is None:
+        return None
+    bed = getattr(patient, 'bed', None)
+    return {
+        'id': patient.pk,
+        'name': str(patient),
+        'sickness': patient.sickness,
+        'blood_type': patient.get_blood_type_display(),
+        'present': patient.is_hospitalized,
+        'login_at': patient.login_at,
+        'discharge_date': patient.discharge_date,
+        'doctor': str(patient.doctor) if patient.doctor else None,
+        'nurse': str(patient.nurse) if patient.nurse else None,
+        'bed': {'floor': bed.floor, 'room': bed.room, 'bed': bed.bed} if bed else None,
+        'medicines': list(patient.medicine_set.order_by('pk').values('name', 'order')),
+        'balance': {'cost': patient.total_cost, 'paid': patient.total_paid, 'due': patient.total_due},
     }
-    return render(request, 'invoice.html', context=context)
 
+
+@replica_reads
+async def patient_summary(request, pk):
+    if not await has_perm(request, 'manager.view_patient'):
+        raise PermissionDenied
+    summary = await sync_to_async(caching.get)(
+        'summary', [caching.patient(pk)], lambda: summarize_patient(pk) or {}, caching.replica_timeout,
+    )
+    if not summary:
+        raise Http404
+    if await sync_to_async(get_role)(request) in (DOCTORS, NURSES):
+        # Like PatientAdmin, doctors and nurses don't see the patient's balance.
+        summary = {key: value for key, value in summary.items() if key != 'balance'}
+    return HttpResponse(json.dumps(summary, cls=DjangoJSONEncoder), content_type='application/json')
+
+
+BED_EVENTS_HEARTBEAT = 15
+
+
+def sse(event_id, kind, data):
+    return f'id: {event_id}\nevent: {kind}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n'
+
+
+def bed_event_backlog(last_event_id):
+    """The id and text to send before live events: the missed events, or a fresh occupancy snapshot."""
+    missed = None
+    if last_event_id is not None and last_event_id.isdigit():
+        missed = bed_events.since(int(last_event_id))
+    if missed is None:
+        latest = bed_events.last_id
+        return latest, 'retry: 3000\n\n' + sse(latest, 'occupancy', beds.occupancy_by_floor())
+    latest = missed[-1][0] if missed else int(last_event_id)
+    return latest, 'retry: 3000\n\n' + ''.join(sse(*event) for event in missed)
+
+
+async def stream_bed_events(last_event_id):
+    subscriber = bed_events.subscribe(AsyncSubscriber())
+    try:
+        latest, backlog = await sync_to_async(bed_event_backlog)(last_event_id)
+        yield backlog
+        while True:
+            try:
+                event = await subscriber.get(BED_EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if event[0] > latest:
+                latest = event[0]
+                yield sse(*event)
+    finally:
+        bed_events.unsubscribe(subscriber)
+
+
+def stream_bed_events_sync(last_event_id):
+    subscriber = bed_events.subscribe(ThreadSubscriber())
+    try:
+        latest, backlog = bed_event_backlog(last_event_id)
+        yield backlog
+        while True:
+            try:
+                event = subscriber.get(BED_EVENTS_HEARTBEAT)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            if event[0] > latest:
+                latest = event[0]
+                yield sse(*event)
+    finally:
+        bed_events.unsubscribe(subscriber)
+
+
+async def bed_event_stream(request):
+    """Server-sent events for bed assignments and releases.
+
+    Under ASGI a display costs an idle coroutine; under WSGI it holds a worker thread.
+    """
+    if not await has_perm(request, 'manager.view_bed'):
+        raise PermissionDenied
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    if isinstance(request, ASGIRequest):
+        events = stream_bed_events(last_event_id)
+    else:
+        events = stream_bed_events_sync(last_event_id)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@staff_member_required
+@replica_reads
+def archived_invoice(request, pk):
+    if not request.user.has_perm('manager.view_archivedpatient'):
+        raise PermissionDenied
+    patient = get_object_or_404(ArchivedPatient, pk=pk)
+    return HttpResponse(render_invoice(request, patient, patient.archivedpayment_set.order_by('pk')))
+
+
+def export_response(kind, rows, fmt, role=None):
+    response = StreamingHttpResponse(stream_rows(kind, rows, fmt, role), content_type=FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
+
+@staff_member_required
+@replica_reads
+def export(request, kind, fmt):
+    if kind not in EXPORTS or fmt not in FORMATS:
+        raise Http404
+    model = EXPORTS[kind][0]
+    if not request.user.has_perm(f'{model._meta.app_label}.view_{model._meta.model_name}'):
+        raise PermissionDenied
+    ranges = []
+    for prefix in ('admitted', 'discharged'):
+        dates = []
+        for suffix in ('from', 'to'):
+            value = request.GET.get(f'{prefix}_{suffix}')
+            date = parse_date(value) if value else None
+            if value and date is None:
+                return HttpResponseBadRequest(f'Invalid date for {prefix}_{suffix}.')
+            dates.append(date)
+        ranges.append(tuple(dates))
+    # Streaming runs after the view returns, so pin the queryset to the read alias now.
+    role = get_role(request)
+    return export_response(kind, export_queryset(kind, *ranges, role=role).using(current_read_alias()), fmt, role)